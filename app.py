@@ -1,4 +1,5 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, send_from_directory, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, send_from_directory, session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from firebase_functions import https_fn
 from firebase_admin import initialize_app
 import os
@@ -8,6 +9,7 @@ import requests
 import time
 import threading
 import random
+import hmac
 import urllib.parse
 import time
 import traceback
@@ -29,33 +31,74 @@ sys.path.append(BASE_DIR)
 # --- Local Module Imports ---
 from utils.nlp import detect_intent, correct_location, extract_ride_id
 from utils.maps import get_route_details, get_readable_address
+from utils.route_metrics import route_distance_m, route_duration_s
 from utils.invoice import generate_invoice, send_invoice_pdf
+from utils.export import EXPORT_FORMATS
+from utils.query_stats import query_stats
+from utils.bulk_import import parse_payload, validate_rows, ImportPayloadError
+from utils.records import Record
+from utils.scheduler import DeadlineScheduler
+from utils.availability import as_datetime
+from utils.leader import LeaderElection
 from functools import wraps
 from db import (
     manually_assign_driver, get_user, add_user, update_user, delete_user, get_all_users,
     list_available_car_types as get_available_car_types,
-    get_available_driver_and_car, assign_driver_to_ride, get_all_drivers, get_driver_by_id, get_rate_for_car_type,
+    assign_driver_to_ride, get_all_drivers, get_driver_by_id, get_rate_for_car_type,
     add_driver, update_driver, delete_driver, update_driver_location,
     add_ride, update_ride, delete_ride, get_ride_by_id, complete_ride, get_all_rides, get_car_by_id,
     get_coupon, mark_coupon_used, get_all_coupons, add_coupon, update_coupon, delete_coupon,
     update_payment_status, get_latest_ride_id_by_phone, get_all_cars,
     add_car, update_car, delete_car,
-    count_users, count_rides, count_drivers, count_vehicles,
-    count_vehicles_on_ride, count_drivers_on_ride, calculate_revenue,
-    count_pending_payments, get_revenue_by_period,
+    get_revenue_by_period,
     get_all_locations, add_location, update_location, delete_location,
     get_all_pricing, add_pricing, update_pricing, delete_pricing,
     get_owner_by_email, get_prebooked_rides_for_assignment, get_rides_by_user_phone, update_user_name_by_phone,
-    get_all_owner_phone_numbers, get_all_owners, add_owner, update_owner, delete_owner, get_owner_by_phone, get_setting, set_setting, connect, save_chat_session, get_chat_session, update_ride_status_and_time, complete_ride_and_free_resources,
-    get_site_content, set_site_content, list_available_car_types, get_user_by_email, update_password_by_email, update_password_by_email_for_owner, get_available_cars_by_type, get_driver_by_phone, get_pricing_for_vehicle_type
+    get_all_owners, add_owner, update_owner, delete_owner, get_owner_by_phone, get_setting, set_setting, connect, save_chat_session, get_chat_session, touch_chat_session, update_ride_status_and_time, complete_ride_and_free_resources,
+    get_site_content, set_site_content, list_available_car_types, get_user_by_email, update_password_by_email, update_password_by_email_for_owner, get_available_cars_by_type, get_driver_by_phone, get_pricing_for_vehicle_type,
+    get_pool_stats, get_dashboard_stats, list_rides, list_users, list_drivers, list_cars,
+    iter_ride_export_rows, RIDE_EXPORT_COLUMNS, get_cache_stats, is_owner_phone,
+    get_replica_stats, begin_request, get_query_stats, bulk_insert,
+    get_nearest_drivers, get_dispatch_stats, DISPATCH_CANDIDATES, assign_rides_batch,
+    booking_window, free_drivers_for, free_cars_for, get_booking_conflicts, get_availability_stats,
+    add_ride_listener, connect_dedicated, add_ride_with_available_driver, assign_available_driver, get_claim_stats,
+    get_location_ingest_stats, maintain_location_history, get_driver_eta, get_prebooked_rides_changed_since
 )
 
 load_dotenv()
+
+
+class RecordJSONProvider(DefaultJSONProvider):
+    """Serialises compact db records exactly like the dict rows they replace."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o._asdict()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__, template_folder='templates', static_folder='static')
+app.json = RecordJSONProvider(app)
 app.secret_key = os.urandom(24)
 CORS(app)
 
 
+@app.before_request
+def reset_db_request_state():
+    begin_request()
+    start_background_jobs()
+
+
+@app.after_request
+def report_db_request_queries(response):
+    count, total_ms, _ = query_stats.request_summary()
+    query_stats.check_n_plus_one(request.endpoint or request.path)
+    response.headers['X-DB-Query-Count'] = str(count)
+    response.headers['X-DB-Query-Time-Ms'] = f"{total_ms:.1f}"
+    return response
+
+
 def owner_login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -63,7 +106,7 @@ def owner_login_required(f):
             return jsonify({"error": "Unauthorized access"}), 401
 
         user_phone = session['user_phone']
-        if user_phone not in get_all_owner_phone_numbers():
+        if not is_owner_phone(user_phone):
             return jsonify({"error": "Forbidden: Owner access required"}), 403
 
         return f(*args, **kwargs)
@@ -76,6 +119,20 @@ TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+# "batch" matches every ride in the assignment window at once; "greedy" is the old one-by-one loop.
+PREBOOKED_ASSIGNMENT_STRATEGY = os.getenv("PREBOOKED_ASSIGNMENT_STRATEGY", "batch").lower()
+# Prebooked rides get their driver this long before pickup; rides left without one are retried every ASSIGNMENT_RETRY_SECONDS.
+ASSIGNMENT_LEAD_TIME = timedelta(minutes=int(os.getenv("ASSIGNMENT_LEAD_MINUTES", 120)))
+ASSIGNMENT_RETRY_SECONDS = int(os.getenv("ASSIGNMENT_RETRY_SECONDS", 60))
+# Bookings taken by other workers reach the leader's queue on its next resync.
+ASSIGNMENT_RESYNC_SECONDS = int(os.getenv("ASSIGNMENT_RESYNC_SECONDS", 30))
+LOCATION_HISTORY_MAINTENANCE_SECONDS = 3600
+# Every process campaigns for the background-jobs lock; set BACKGROUND_JOBS=0 on web-only nodes.
+BACKGROUND_JOBS_ENABLED = os.getenv("BACKGROUND_JOBS", "1").lower() not in ("0", "false", "no")
+LEADER_HEARTBEAT_SECONDS = int(os.getenv("LEADER_HEARTBEAT_SECONDS", 5))
+# Shared secret for driver apps/trackers posting to /api/drivers/location (sent as X-Location-Token).
+LOCATION_API_TOKEN = os.getenv("LOCATION_API_TOKEN")
+LOCATION_MAX_PINGS_PER_REQUEST = 1000
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 SESSION_TIMEOUT_SECONDS = 300
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
@@ -280,6 +337,8 @@ def toggle_assignment():
     data = request.json
     enabled = data.get('enabled', False)
     set_setting('auto_assignment_enabled', enabled)
+    if enabled:
+        rebuild_assignment_schedule()
     return jsonify({"message": f"Auto-assignment is now {'ON' if enabled else 'OFF'}", "enabled": enabled})
 
 @app.route('/api/unassigned_rides', methods=['GET'])
@@ -288,16 +347,66 @@ def get_unassigned_rides():
     rides = get_rides_by_user_phone(status='prebooked', unassigned_only=True)
     return jsonify(rides)
 
+def ride_booking_window(ride_id):
+    """The window a ride would hold its driver and car for, or None; lets the pickers hide double bookings."""
+    if not ride_id:
+        return None
+    ride = get_ride_by_id(ride_id)
+    if not ride:
+        return None
+    return booking_window(ride['start_time'], ride.get('end_time'), ride.get('duration_s'))
+
 @app.route('/api/available_drivers', methods=['GET'])
 @owner_login_required
 def get_available_drivers_api():
     drivers = get_all_drivers(status='free')
+    window = ride_booking_window(request.args.get('ride_id', type=int))
+    if window and drivers:
+        free_ids = set(free_drivers_for([driver['id'] for driver in drivers], window))
+        drivers = [driver for driver in drivers if driver['id'] in free_ids]
     return jsonify(drivers)
 
+@app.route('/api/drivers/nearest', methods=['GET'])
+@owner_login_required
+def get_nearest_drivers_api():
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    if lat is None or lng is None:
+        return jsonify({"error": "lat and lng are required."}), 400
+    k = min(max(request.args.get('k', DISPATCH_CANDIDATES, type=int), 1), 50)
+    return jsonify(get_nearest_drivers(lat, lng, request.args.get('car_type'), k=k))
+
+@app.route('/api/drivers/location', methods=['POST'])
+def ingest_driver_locations():
+    """
+    Accepts one ping ({"driver_id", "lat", "lng", "recorded_at"?}) or a
+    batch ({"pings": [...]}); `recorded_at` is epoch seconds. Pings are
+    buffered and written in batches, so this returns 202 at once.
+    """
+    token = request.headers.get('X-Location-Token', '')
+    if not LOCATION_API_TOKEN or not hmac.compare_digest(token, LOCATION_API_TOKEN):
+        return jsonify({"error": "A valid X-Location-Token header is required."}), 403
+    data = request.get_json(silent=True) or {}
+    pings = data.get('pings') if isinstance(data.get('pings'), list) else [data]
+    if len(pings) > LOCATION_MAX_PINGS_PER_REQUEST:
+        return jsonify({"error": f"At most {LOCATION_MAX_PINGS_PER_REQUEST} pings per request."}), 413
+    accepted = 0
+    for ping in pings:
+        try:
+            driver_id = int(ping['driver_id'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        accepted += bool(update_driver_location(driver_id, ping.get('lat'), ping.get('lng'), ping.get('recorded_at')))
+    return jsonify({"accepted": accepted, "rejected": len(pings) - accepted}), 202
+
 @app.route('/api/available_cars', methods=['GET'])
 @owner_login_required
 def get_available_cars_api():
     cars = get_all_cars(status='free')
+    window = ride_booking_window(request.args.get('ride_id', type=int))
+    if window and cars:
+        free_ids = set(free_cars_for([car['id'] for car in cars], window))
+        cars = [car for car in cars if car['id'] in free_ids]
     return jsonify(cars)
 
 @app.route('/api/assign_ride_manually', methods=['POST'])
@@ -320,8 +429,13 @@ def assign_ride_manually():
         print(f"Ride {ride_id} is already assigned. Skipping duplicate assignment.")
         return jsonify({"message": "This ride has already been assigned."})
 
-    
-    assign_driver_to_ride(ride_id, driver_id, car_id)
+    window = booking_window(ride_before_assign['start_time'], ride_before_assign.get('end_time'), ride_before_assign.get('duration_s'))
+    conflicts = get_booking_conflicts(int(driver_id), int(car_id), window, ignore_ride=int(ride_id))
+    if conflicts:
+        return jsonify({"error": f"The driver or car is already booked around that time (ride {', '.join(map(str, conflicts))})."}), 409
+
+    if not assign_driver_to_ride(ride_id, driver_id, car_id):
+        return jsonify({"error": "The ride, driver or car was just taken by another booking. Please refresh and try again."}), 409
 
     
     ride = get_ride_by_id(ride_id)
@@ -493,8 +607,7 @@ def dashboard_page():
         return redirect(url_for('login_page'))
 
     user_phone = session['user_phone']
-    all_owner_phones = get_all_owner_phone_numbers()
-    if user_phone not in all_owner_phones:
+    if not is_owner_phone(user_phone):
         return redirect(url_for('user_dashboard_page'))
 
     return render_template('index.html')
@@ -643,12 +756,12 @@ def user_book_ride():
 
     # 2. Validate locations and get route details
     route = get_route_details(pickup, destination)
-    if 'error' in route:
-        return jsonify({"error": route['error']}), 400
+    if not route:
+        return jsonify({"error": "Could not find a route for the given locations."}), 400
 
     # 3. Calculate fare using dynamic pricing
     try:
-        distance_km = float(route['distance'].split()[0])
+        distance_km = route_distance_m(route) / 1000
         pricing_rule = get_pricing_for_vehicle_type(car_type)
         price_per_km = float(pricing_rule['price_per_km']) if pricing_rule else 12.0 # Fallback rate
         fare = round(distance_km * price_per_km, 2)
@@ -661,7 +774,9 @@ def user_book_ride():
         user_phone=user_phone, pickup=pickup, destination=destination,
         distance=route['distance'], duration=route['duration'], fare=fare,
         car_id=None, driver_id=None, status='prebooked', payment_status='pending',
-        start_time=f"{booking_date} {booking_time}:00", end_time=None, car_type=car_type
+        start_time=f"{booking_date} {booking_time}:00", end_time=None, car_type=car_type,
+        distance_m=route_distance_m(route), duration_s=route_duration_s(route),
+        pickup_lat=route.get('start_lat'), pickup_lng=route.get('start_lng')
     )
 
     if not ride_id:
@@ -703,19 +818,23 @@ def serve_static(filename):
 @app.route("/api/dashboard_stats", methods=["GET"])
 @owner_login_required
 def dashboard_stats():
-    stats = {
-        "total_customers": count_users(),
-        "total_drivers": count_drivers(),
-        "total_vehicles": count_vehicles(),
-        "ongoing_rides": count_rides(status="ongoing"),
-        "vehicles_on_ride": count_vehicles_on_ride(),
-        "drivers_on_ride": count_drivers_on_ride(),
-        "total_bookings": count_rides(),
-        "pre_bookings": count_rides(status="prebooked"),
-        "revenue": calculate_revenue(),
-        "payment_pendings": count_pending_payments()
-    }
-    return jsonify(stats)
+    return jsonify(get_dashboard_stats())
+
+@app.route("/api/system/metrics", methods=["GET"])
+@owner_login_required
+def system_metrics():
+    return jsonify({
+        "db_pool": get_pool_stats(),
+        "db_replicas": get_replica_stats(),
+        "caches": get_cache_stats(),
+        "dispatch": get_dispatch_stats(),
+        "availability": get_availability_stats(),
+        "claims": get_claim_stats(),
+        "location_ingest": get_location_ingest_stats(),
+        "assignment_scheduler": assignment_scheduler.stats(),
+        "background_leader": background_leader.stats(),
+        "queries": get_query_stats(request.args.get('limit', 50, type=int))
+    })
 
 # Revenue trend API endpoint
 @owner_login_required 
@@ -725,13 +844,72 @@ def revenue_trend():
     data = get_revenue_by_period(period)
     return jsonify(data)
 
+# --- Data Export ---
+def stream_export(rows, columns, export_format, name):
+    streamer, mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(
+        stream_with_context(streamer(rows, columns)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@app.route("/api/export/rides", methods=["GET"])
+@owner_login_required
+def export_rides():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Format must be 'csv' or 'ndjson'."}), 400
+    rows = iter_ride_export_rows(
+        status=request.args.get('status'),
+        start_from=request.args.get('start_from'),
+        start_to=request.args.get('start_to')
+    )
+    return stream_export(rows, RIDE_EXPORT_COLUMNS, export_format, "rides")
+
+@app.route("/api/export/revenue", methods=["GET"])
+@owner_login_required
+def export_revenue():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Format must be 'csv' or 'ndjson'."}), 400
+    rows = get_revenue_by_period(request.args.get('period', 'monthly')) or []
+    return stream_export(rows, ['period_label', 'revenue'], export_format, "revenue")
+
 # --- CRUD Endpoints for Dashboard Tabs ---
 
+PAGINATION_PARAMS = ('cursor', 'limit', 'sort', 'order')
+
+def get_page_args(*filters):
+    """
+    Collects keyset-pagination and filter arguments from the query string.
+    Returns None when none are present, so listing endpoints can keep
+    returning the full array that the dashboard tables expect.
+    """
+    if not any(name in request.args for name in PAGINATION_PARAMS + filters):
+        return None
+    page_args = {name: request.args[name] for name in PAGINATION_PARAMS + filters if request.args.get(name)}
+    if 'limit' in page_args:
+        page_args['limit'] = request.args.get('limit', type=int) or 0
+    return page_args
+
+def paged_response(list_function, page_args):
+    try:
+        page = list_function(records=True, **page_args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page is None:
+        return jsonify({"error": "Could not load this page."}), 500
+    return jsonify(page)
+
 # Customers
 @app.route("/api/customers", methods=["GET"])
 @owner_login_required
 def api_customers():
-    customers = get_all_users()
+    page_args = get_page_args('phone')
+    if page_args is not None:
+        return paged_response(list_users, page_args)
+    customers = get_all_users(records=True)
     return jsonify(customers)
 
 @app.route("/api/customers", methods=["POST"])
@@ -758,7 +936,10 @@ def delete_customer_api(user_id):
 
 @app.route("/api/drivers", methods=["GET"])
 def api_get_drivers():
-    drivers = get_all_drivers()
+    page_args = get_page_args('status', 'phone')
+    if page_args is not None:
+        return paged_response(list_drivers, page_args)
+    drivers = get_all_drivers(records=True)
     return jsonify(drivers)
 
 
@@ -796,7 +977,10 @@ def delete_driver_api(driver_id):
 # Vehicles (Cars)
 @app.route("/api/vehicles", methods=["GET"])
 def api_vehicles():
-    vehicles = get_all_cars()
+    page_args = get_page_args('status', 'car_type')
+    if page_args is not None:
+        return paged_response(list_cars, page_args)
+    vehicles = get_all_cars(records=True)
     return jsonify(vehicles)
 
 @app.route("/api/vehicles", methods=["POST"])
@@ -820,10 +1004,66 @@ def delete_vehicle_api(car_id):
         return jsonify({"message": "Vehicle deleted successfully"}), 200
     return jsonify({"error": "Vehicle not found or failed to delete"}), 404
 
+# Bulk imports
+def run_bulk_import(entity, extra_values=()):
+    """
+    Validates a CSV or JSON upload (request body, or a multipart "file")
+    and inserts the valid rows in batches. `?dry_run=1` only validates.
+    """
+    upload = request.files.get('file')
+    body = upload.read() if upload else request.get_data()
+    content_type = upload.mimetype if upload else request.content_type
+    started = time.perf_counter()
+    try:
+        rows = parse_payload(body, content_type)
+    except (ImportPayloadError, UnicodeDecodeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    valid, errors = validate_rows(rows, entity)
+    inserted, chunks = 0, 0
+    if valid and request.args.get('dry_run') not in ('1', 'true'):
+        valid = [(row_number, values + tuple(extra_values)) for row_number, values in valid]
+        inserted, insert_errors, chunks = bulk_insert(entity, valid)
+        errors.extend(insert_errors)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "received": len(rows),
+        "valid": len(valid),
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": sorted(errors, key=lambda error: error['row']),
+        "chunks": chunks,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows_per_second": round(inserted / elapsed, 1) if elapsed and inserted else 0.0,
+    }
+    if request.args.get('dry_run') in ('1', 'true'):
+        return jsonify(result), 200
+    return jsonify(result), 201 if inserted else 400
+
+@app.route("/api/vehicles/bulk", methods=["POST"])
+@owner_login_required
+def bulk_add_vehicles_api():
+    return run_bulk_import('cars')
+
+@app.route("/api/drivers/bulk", methods=["POST"])
+@owner_login_required
+def bulk_add_drivers_api():
+    return run_bulk_import('drivers')
+
+@app.route("/api/customers/bulk", methods=["POST"])
+@owner_login_required
+def bulk_add_customers_api():
+    # Hashing is deliberately slow, so the shared placeholder password is hashed once per import.
+    return run_bulk_import('users', (generate_password_hash("default_customer_password"),))
+
 # Bookings (Rides)
 @app.route("/api/bookings", methods=["GET"])
 def api_bookings():
-    bookings = get_all_rides()
+    page_args = get_page_args('status', 'start_from', 'start_to', 'phone', 'car_type')
+    if page_args is not None:
+        return paged_response(list_rides, page_args)
+    bookings = get_all_rides(records=True)
     return jsonify(bookings)
 
 @app.route("/api/bookings", methods=["POST"])
@@ -942,7 +1182,7 @@ def api_manual_booking():
     if not route:
         return jsonify({"error": "Could not find a route for the given locations."}), 400
 
-    distance_value = float(route["distance"].split()[0])
+    distance_value = route_distance_m(route) / 1000
     pricing = get_all_pricing()
     car_rate = 12.0 
     for p in pricing:
@@ -951,50 +1191,44 @@ def api_manual_booking():
             break
     fare = round(distance_value * car_rate, 2)
 
-    duration_minutes = float(route['duration'].split()[0])
-    estimated_end_time = booking_datetime + timedelta(minutes=duration_minutes)
+    estimated_end_time = booking_datetime + timedelta(seconds=route_duration_s(route) or 0)
 
     driver = None
     car = None
     ride_status = 'prebooked' 
 
-    current_time_plus_2_hours = datetime.now() + timedelta(hours=2)
-
-    if booking_datetime <= current_time_plus_2_hours:
-        if get_setting('auto_assignment_enabled'): 
-            driver, car = get_available_driver_and_car(car_type, session.get("start_time"), session.get("end_time"))
-        else:
-            driver, car = None, None 
-        if driver and car:
-            ride_status = 'ongoing'
-        else:
-            print(f"Manual booking for {booking_datetime_str}: No immediate driver/car available for {car_type}. Will be prebooked.")
-            driver_id_for_db = None
-            car_id_for_db = None
-            return jsonify({"error": f"No immediate driver/car available for {car_type}. Booking saved as pre-booked. Driver will be assigned closer to ride time."}), 400 # Indicate pre-booked scenario
-    else:
-        driver_id_for_db = None
-        car_id_for_db = None
-
-    driver_id_for_db = driver['id'] if driver else None
-    car_id_for_db = car['id'] if car else None
-
-    ride_id = add_ride(
+    ride_fields = dict(
         user_phone=user_phone,
         pickup=pickup,
         destination=destination,
         distance=route['distance'],
         duration=route['duration'],
+        distance_m=route_distance_m(route),
+        duration_s=route_duration_s(route),
         fare=fare,
-        car_id=car_id_for_db,
-        driver_id=driver_id_for_db,
-        status=ride_status,
         payment_status='pending', 
         start_time=booking_datetime_str,
         end_time=estimated_end_time.strftime('%Y-%m-%d %H:%M:%S'),
-        car_type=data.get('car_type')
+        car_type=data.get('car_type'),
+        pickup_lat=route.get('start_lat'),
+        pickup_lng=route.get('start_lng')
     )
 
+    current_time_plus_2_hours = datetime.now() + timedelta(hours=2)
+
+    if booking_datetime <= current_time_plus_2_hours:
+        ride_id = None
+        if get_setting('auto_assignment_enabled'): 
+            # Picks and claims the driver and car in the same transaction as the insert.
+            ride_id, driver, car = add_ride_with_available_driver(estimated_end_time, status='ongoing', **ride_fields)
+        if driver and car:
+            ride_status = 'ongoing'
+        else:
+            print(f"Manual booking for {booking_datetime_str}: No immediate driver/car available for {car_type}. Will be prebooked.")
+            return jsonify({"error": f"No immediate driver/car available for {car_type}. Booking saved as pre-booked. Driver will be assigned closer to ride time."}), 400 # Indicate pre-booked scenario
+    else:
+        ride_id = add_ride(car_id=None, driver_id=None, status=ride_status, **ride_fields)
+
     if ride_id:
         if ride_status == 'ongoing':
             send_message(user_phone,
@@ -1169,51 +1403,218 @@ def send_bulk_message():
     return jsonify({"message": response_message}), 200
 
 
-def assign_prebooked_rides_periodically():
+def notify_prebooked_assignment(ride, driver, car):
+    """Tells the customer and the driver about a pre-booked ride that just got its driver."""
+    start_time = ride['start_time']
+    if isinstance(start_time, str):
+        start_time = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
+
+    print(f"Assigned driver {driver['name']} ({driver['phone']}) and car {car['model']} ({car['car_number']}) to ride {ride['id']}")
+
+    send_message(ride['user_phone'],
+                 f"🎉 Your pre-booked ride (ID: {ride['id']}) is confirmed!\n"
+                 f"Driver: {driver['name']}\n"
+                 f"Phone: {driver['phone']}\n"
+                 f"Car: {car['model']} ({car['car_number']})\n"
+                 f"Your ride starts at {start_time.strftime('%I:%M %p on %b %d')}.")
+
+    ride_id = ride['id']
+    body_text = (
+        f"📍 New Pre-Booked Ride! (ID: {ride_id})\n\n"
+        f"➡️ From: {ride['pickup']}\n"
+        f"⬅️ To: {ride['destination']}\n"
+        f"👤 Customer: {ride['user_phone']}\n"
+        f"⏰ Scheduled for: {start_time.strftime('%I:%M %p')}"
+    )
+    buttons = [{"id": f"start_pickup_{ride_id}", "title": "Start Towards Pickup"}]
+    send_button_message(driver['phone'], body_text, buttons)
+
+def assign_prebooked_rides_greedily(rides_to_assign):
+    """One ride at a time, in row order, each taking the best driver left."""
+    for ride in rides_to_assign:
+        print(f"Attempting to assign driver for pre-booked ride ID: {ride['id']}")
+        duration_s = ride.get('duration_s') or 30 * 60
+        start_time = ride['start_time']
+        if isinstance(start_time, str):
+            start_time = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
+        estimated_end_time = start_time + timedelta(seconds=duration_s)
+
+        driver, car = assign_available_driver(ride, ride["end_time"] or estimated_end_time)
+
+        if driver and car:
+            notify_prebooked_assignment(ride, driver, car)
+        else:
+            print(f"Could not find available driver/car for pre-booked ride {ride['id']} at {ride['start_time']}. Will retry later.")
+
+def assign_prebooked_rides_in_batch(rides_to_assign):
+    """Every ride in the window at once, as a min-cost matching applied in one transaction."""
+    assigned, unassigned = assign_rides_batch(rides_to_assign)
+    for ride, driver, car, distance_km in assigned:
+        print(f"Batch-assigned ride {ride['id']} (pickup {distance_km:.1f} km away).")
+        notify_prebooked_assignment(ride, driver, car)
+    for ride in unassigned:
+        print(f"Could not find available driver/car for pre-booked ride {ride['id']} at {ride['start_time']}. Will retry later.")
+
+# Assignment deadlines of prebooked rides (start time minus the lead time).
+# Only the leader process (see background_leader below) runs the worker.
+# Its queue is fed by add_ride/update_ride through the ride listener and
+# rebuilt from the database on election and when auto-assignment is
+# switched on. Every ASSIGNMENT_RESYNC_SECONDS it also reads the
+# prebooked rides booked or edited since the last look (by other
+# workers), never the whole set. The same worker runs the hourly
+# location-history partition maintenance.
+assignment_scheduler = DeadlineScheduler()
+RESYNC_KEY = 'resync'
+# Re-read edits this far back, covering clock skew between workers and
+# transactions that committed after the last resync read.
+RESYNC_OVERLAP = timedelta(seconds=60)
+_resync_state = {"last_id": 0, "since": None}
+LOCATION_HISTORY_KEY = 'location_history'
+
+def schedule_ride_assignment(ride_id, status, start_time):
+    if not background_leader.is_leader():
+        return
+    if status != 'prebooked' or not start_time:
+        assignment_scheduler.cancel(ride_id)
+        return
+    assignment_scheduler.schedule(ride_id, as_datetime(start_time) - ASSIGNMENT_LEAD_TIME)
+
+add_ride_listener(schedule_ride_assignment)
+
+def rebuild_assignment_schedule():
+    """
+    Queues every unassigned prebooked ride that has not started yet and is
+    not queued already (a queued ride may be waiting on a retry, which
+    must not be reset to its original deadline). Returns how many were
+    added, or None on a database error.
+    """
+    started = datetime.now().replace(microsecond=0)  # updated_at has whole seconds
+    rides = get_prebooked_rides_for_assignment()
+    if rides is None:
+        return None
+    _resync_state["last_id"] = max([ride['id'] for ride in rides] + [_resync_state["last_id"]])
+    _resync_state["since"] = started
+    rides = [ride for ride in rides if ride.get('driver_id') is None and ride['start_time'] and as_datetime(ride['start_time']) > started
+             and ride['id'] not in assignment_scheduler]
+    for ride in rides:
+        schedule_ride_assignment(ride['id'], ride['status'], ride['start_time'])
+    return len(rides)
+
+def resync_assignment_schedule():
+    """
+    Queues the prebooked rides booked or edited since the last resync (a
+    full rebuild the first time). An edited ride gets its new deadline; one
+    already queued and merely seen again in the overlap keeps its own
+    (possibly a retry). Returns how many were queued, or None on a database error.
+    """
+    since = _resync_state["since"]
+    if since is None:
+        return rebuild_assignment_schedule()
+    started = datetime.now().replace(microsecond=0)  # updated_at has whole seconds
+    rides = get_prebooked_rides_changed_since(_resync_state["last_id"], since - RESYNC_OVERLAP)
+    if rides is None:
+        return None
+    queued = 0
+    for ride in rides:
+        new = ride['id'] > _resync_state["last_id"]
+        edited = ride.get('updated_at') is not None and as_datetime(ride['updated_at']) >= since
+        if ride.get('driver_id') is not None or not ride['start_time'] or as_datetime(ride['start_time']) <= started:
+            continue
+        if ride['id'] in assignment_scheduler and not (new or edited):
+            continue
+        schedule_ride_assignment(ride['id'], ride['status'], ride['start_time'])
+        queued += 1
+    _resync_state["last_id"] = max([ride['id'] for ride in rides] + [_resync_state["last_id"]])
+    _resync_state["since"] = started
+    return queued
+
+def assign_due_rides(ride_ids):
+    """Assigns the given rides if they are still prebooked and unassigned; requeues the ones left over."""
+    now = datetime.now()
+    rides = get_prebooked_rides_for_assignment(ride_ids=ride_ids)
+    if rides is None:
+        for ride_id in ride_ids:
+            assignment_scheduler.schedule(ride_id, now + timedelta(seconds=ASSIGNMENT_RETRY_SECONDS))
+        return
+    rides_to_assign = []
+    for ride in rides:
+        if ride.get('driver_id') is not None:
+            continue
+        # Queued before another worker moved the ride later: wait for its new deadline.
+        due_at = as_datetime(ride['start_time']) - ASSIGNMENT_LEAD_TIME if ride['start_time'] else now
+        if due_at > now:
+            assignment_scheduler.schedule(ride['id'], due_at)
+            continue
+        rides_to_assign.append(ride)
+    if not rides_to_assign:
+        return
+    print(f"Assignment due for ride(s): {', '.join(str(ride['id']) for ride in rides_to_assign)}")
+
+    if PREBOOKED_ASSIGNMENT_STRATEGY == 'greedy':
+        assign_prebooked_rides_greedily(rides_to_assign)
+    else:
+        assign_prebooked_rides_in_batch(rides_to_assign)
+
+    still_open = get_prebooked_rides_for_assignment(ride_ids=[ride['id'] for ride in rides_to_assign]) or []
+    retry_at = datetime.now() + timedelta(seconds=ASSIGNMENT_RETRY_SECONDS)
+    for ride in still_open:
+        if ride.get('driver_id') is None and as_datetime(ride['start_time']) > now:
+            assignment_scheduler.schedule(ride['id'], retry_at)
+
+def run_assignment_scheduler():
+    """Sleeps until the next assignment deadline (or a new booking) instead of polling. Runs on the leader only."""
+    _resync_state["since"] = None  # a new leader starts from a full rebuild
+    assignment_scheduler.schedule(RESYNC_KEY, datetime.now())
+    assignment_scheduler.schedule(LOCATION_HISTORY_KEY, datetime.now())
     while True:
+        ride_ids = assignment_scheduler.wait_due()
+        if not background_leader.is_leader():
+            return
+        if LOCATION_HISTORY_KEY in ride_ids:
+            ride_ids.remove(LOCATION_HISTORY_KEY)
+            maintain_location_history()
+            assignment_scheduler.schedule(LOCATION_HISTORY_KEY, datetime.now() + timedelta(seconds=LOCATION_HISTORY_MAINTENANCE_SECONDS))
+        if RESYNC_KEY in ride_ids:
+            ride_ids.remove(RESYNC_KEY)
+            resync_assignment_schedule()
+            assignment_scheduler.schedule(RESYNC_KEY, datetime.now() + timedelta(seconds=ASSIGNMENT_RESYNC_SECONDS))
+        if not ride_ids:
+            continue
         if not get_setting('auto_assignment_enabled'):
-            print("Auto-assignment is OFF. Skipping assignment check.")
-            time.sleep(60) 
+            print("Auto-assignment is OFF. Deferring due rides.")
+            retry_at = datetime.now() + timedelta(seconds=ASSIGNMENT_RETRY_SECONDS)
+            for ride_id in ride_ids:
+                assignment_scheduler.schedule(ride_id, retry_at)
             continue
-        print("Auto-assignment is ON. Checking for rides to assign...")
-        now = datetime.now()
-        two_hours_from_now = now + timedelta(hours=2)
-        rides_to_assign = get_prebooked_rides_for_assignment(now, two_hours_from_now)
-
-        for ride in rides_to_assign:
-            print(f"Attempting to assign driver for pre-booked ride ID: {ride['id']}")
-            duration_minutes = float(ride['duration'].split()[0]) if 'duration' in ride and ride['duration'] else 30 
-            estimated_end_time = datetime.strptime(ride['start_time'], '%Y-%m-%d %H:%M:%S') + timedelta(minutes=duration_minutes)
-
-            driver, car = get_available_driver_and_car(ride["car_type"], ride["start_time"], ride["end_time"])
-
-
-            if driver and car:
-                assign_driver_to_ride(ride['id'], driver['id'], car['id'])
-
-                print(f"Assigned driver {driver['name']} ({driver['phone']}) and car {car['model']} ({car['car_number']}) to ride {ride['id']}")
-
-                send_message(ride['user_phone'],
-                             f"🎉 Your pre-booked ride (ID: {ride['id']}) is confirmed!\n"
-                             f"Driver: {driver['name']}\n"
-                             f"Phone: {driver['phone']}\n"
-                             f"Car: {car['model']} ({car['car_number']})\n"
-                             f"Your ride starts at {datetime.strptime(ride['start_time'], '%Y-%m-%d %H:%M:%S').strftime('%I:%M %p on %b %d')}.")
-
-                ride_id = ride['id']
-                body_text = (
-                    f"📍 New Pre-Booked Ride! (ID: {ride_id})\n\n"
-                    f"➡️ From: {ride['pickup']}\n"
-                    f"⬅️ To: {ride['destination']}\n"
-                    f"👤 Customer: {ride['user_phone']}\n"
-                    f"⏰ Scheduled for: {datetime.strptime(ride['start_time'], '%Y-%m-%d %H:%M:%S').strftime('%I:%M %p')}"
-                )
-                buttons = [{"id": f"start_pickup_{ride_id}", "title": "Start Towards Pickup"}]
-                send_button_message(driver['phone'], body_text, buttons)
-            else:
-                print(f"Could not find available driver/car for pre-booked ride {ride['id']} at {ride['start_time']}. Will retry later.")
+        try:
+            assign_due_rides(ride_ids)
+        except Exception:
+            traceback.print_exc()
 
-        time.sleep(300)
+_assignment_thread = None
+
+def on_background_leader_elected():
+    global _assignment_thread
+    assignment_scheduler.resume()
+    if _assignment_thread is None or not _assignment_thread.is_alive():
+        _assignment_thread = threading.Thread(target=run_assignment_scheduler, name="assignment-scheduler", daemon=True)
+        _assignment_thread.start()
+
+def on_background_leader_demoted():
+    assignment_scheduler.stop()
+
+# Exactly one process across all gunicorn workers and nodes holds this
+# lock and runs the background jobs; the others take over within a
+# heartbeat or two if it dies.
+background_leader = LeaderElection(
+    'dhanvanth_travels_background_jobs', connect_dedicated,
+    on_background_leader_elected, on_background_leader_demoted, LEADER_HEARTBEAT_SECONDS
+)
+
+def start_background_jobs():
+    """Joins the leader election for the background jobs; cheap to call on every request (see LeaderElection.start)."""
+    if BACKGROUND_JOBS_ENABLED:
+        background_leader.start()
 
 def send_button_message(to, body_text, buttons):
     """
@@ -1252,11 +1653,13 @@ def can_send_freeform(user_phone):
     Returns True if we can send a free-form message (inside 24h window),
     otherwise requires a template.
     """
-    session_data = get_chat_session(user_phone) 
+    session_data = get_chat_session(user_phone)
     if not session_data or not session_data.get("last_interaction"):
-        return False 
+        return False
     try:
-        last_time = datetime.fromisoformat(session_data["last_interaction"])
+        last_time = session_data["last_interaction"]
+        if isinstance(last_time, str):
+            last_time = datetime.fromisoformat(last_time)
         return (datetime.utcnow() - last_time).total_seconds() <= 24 * 3600
     except Exception:
         return False
@@ -1414,13 +1817,20 @@ def webhook():
 
             driver = get_driver_by_phone(phone)
             if driver:
+                if msg.get('type') == 'location':
+                    location = msg.get('location', {})
+                    update_driver_location(driver['id'], location.get('latitude'), location.get('longitude'), msg.get('timestamp'))
+                    return "ok", 200
+
                 driver_intent = payload or text
                 
                 if driver_intent.startswith("start_pickup_"):
                     ride_id = extract_ride_id(driver_intent)
                     update_ride_status_and_time(ride_id, 'enroute_pickup', 'enroute_to_pickup_time', datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S'))
                     ride = get_ride_by_id(ride_id)
-                    send_message(ride['user_phone'], f"🚗 Your driver, {driver['name']}, is on the way!")
+                    eta = get_driver_eta(driver['id'], ride.get('pickup_lat'), ride.get('pickup_lng'))
+                    eta_text = f" Estimated arrival in about {eta['eta_minutes']} min." if eta else ""
+                    send_message(ride['user_phone'], f"🚗 Your driver, {driver['name']}, is on the way!{eta_text}")
                     send_button_message(driver['phone'], "✅ Great! Please notify the user when you have arrived.", [{"id": f"reached_pickup_{ride_id}", "title": "I Have Arrived"}])
                 
                 elif driver_intent.startswith("reached_pickup_"):
@@ -1451,8 +1861,12 @@ def webhook():
                 
                 return "ok", 200
 
+            # Customers only: driver pings and button taps must not create or dirty a chat session each.
+            touch_chat_session(phone)
             user = get_user(phone)
-            session = get_chat_session(phone) or {"state": "awaiting_intent"}
+            session = get_chat_session(phone) or {}
+            if not session.get("state"):
+                session["state"] = "awaiting_intent"
 
             if not user:
                 if session.get("state") not in ["awaiting_new_user_name", "awaiting_new_user_email", "awaiting_email_otp"]:
@@ -1490,7 +1904,7 @@ def webhook():
                     elif str(session.get("otp")) == user_otp:
                         add_user(phone=phone, name=session["new_user_name"], email=session["new_user_email"], password_hash=generate_password_hash("default_password_from_bot"))
                         send_message(phone, "✅ Verification successful! Your account is now registered.")
-                        session = {"state": "awaiting_intent"}
+                        session = {"state": "awaiting_intent", "last_interaction": session.get("last_interaction")}
                         send_button_message(phone, "What would you like to do next?", [{"id": "book_ride", "title": "Book Ride"}, {"id": "check_booking", "title": "My Booking"}, {"id": "fare_info", "title": "Fare Info"}])
                     else:
                         send_message(phone, "That code is incorrect. Please check your email and try again.")
@@ -1585,12 +1999,14 @@ def webhook():
                     send_message(phone, "Sorry, pricing is not available for that car type.")
                 else:
                     route = get_route_details(session.get("pickup"), session.get("destination"))
-                    if 'error' in route:
-                        send_message(phone, route['error'])
+                    if not route:
+                        send_message(phone, "Sorry, I couldn't find a route between those locations.")
                     else:
-                        distance_value = float(route["distance"].split()[0])
+                        distance_value = round(route_distance_m(route) / 1000, 2)
                         fare = round(distance_value * float(pricing['price_per_km']), 2)
-                        session.update({"car_type": car_type, "route_distance": distance_value, "route_duration": route.get('duration'), "fare": fare, "state": "awaiting_confirmation"})
+                        session.update({"car_type": car_type, "route_distance": distance_value, "route_duration": route.get('duration'), "fare": fare,
+                                        "route_distance_m": route_distance_m(route), "route_duration_s": route_duration_s(route),
+                                        "pickup_lat": route.get('start_lat'), "pickup_lng": route.get('start_lng'), "state": "awaiting_confirmation"})
                         confirmation_text = f"Great! Here are your ride details:\n\n🚗 **Vehicle Type:** {car_type.title()}\n🛣️ **Route:** {session.get('pickup')} -> {session.get('destination')}\n📏 **Distance:** {route.get('distance')}\n⏱️ **Duration:** {route.get('duration')}\n💰 **Estimated Fare:** ₹{fare:.2f}\n\nPlease confirm to proceed."
                         send_message(phone, confirmation_text)
                         send_button_message(phone, "✅ Confirm booking?", [{"id": "final_confirm_ride", "title": "Confirm"}])
@@ -1603,13 +2019,14 @@ def webhook():
                 cutoff_time = (now_in_ist.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).replace(hour=4)
                 is_immediate_ride = booking_datetime < cutoff_time
 
-                ride_status, driver_id_for_db, car_id_for_db = "prebooked", None, None
+                ride_fields = dict(user_phone=phone, pickup=session["pickup"], destination=session["destination"], distance=f'{session["route_distance"]} km', duration=session["route_duration"], distance_m=session.get("route_distance_m"), duration_s=session.get("route_duration_s"), fare=session["fare"], payment_status="pending", start_time=booking_datetime.strftime('%Y-%m-%d %H:%M:%S'), end_time=None, car_type=session.get("car_type"), pickup_lat=session.get("pickup_lat"), pickup_lng=session.get("pickup_lng"))
+                ride_id = None
                 
                 if is_immediate_ride:
                     if is_auto_assign_enabled:
-                        driver, car = get_available_driver_and_car(session.get("car_type"), session.get("start_time"), (booking_datetime + timedelta(minutes=60)).strftime("%Y-%m-%d %H:%M:%S"))
+                        # Picks and claims the driver and car in the same transaction as the insert.
+                        ride_id, driver, car = add_ride_with_available_driver(booking_datetime + timedelta(minutes=60), status="assigned", **ride_fields)
                         if driver and car:
-                            ride_status, driver_id_for_db, car_id_for_db = "assigned", driver['id'], car['id']
                             session.update({'confirmation_type': 'IMMEDIATE_ASSIGNED', 'assigned_driver_details': driver, 'assigned_car_details': car})
                         else:
                             send_message(phone, "We're sorry, but all of our cabs are currently busy. Please try again later.")
@@ -1621,9 +2038,8 @@ def webhook():
                 else:
                     session['confirmation_type'] = 'FUTURE_PREBOOKING'
                 
-                final_car_id = car_id_for_db if car_id_for_db is not None else session.get("specific_car_id")
-
-                ride_id = add_ride(user_phone=phone, pickup=session["pickup"], destination=session["destination"], distance=f'{session["route_distance"]} km', duration=session["route_duration"], fare=session["fare"], car_id=final_car_id, driver_id=driver_id_for_db, status=ride_status, payment_status="pending", start_time=booking_datetime.strftime('%Y-%m-%d %H:%M:%S'), end_time=None, car_type=session.get("car_type"))
+                if ride_id is None:
+                    ride_id = add_ride(car_id=session.get("specific_car_id"), driver_id=None, status="prebooked", **ride_fields)
                 
                 total_fare = float(session['fare']) * 1.05
                 session.update({"upi_string": generate_upi_string(total_fare, ride_id), "ride_id": ride_id, "invoice_total": total_fare, "state": "awaiting_payment_option"})
@@ -1649,9 +2065,7 @@ def webhook():
             send_message(phone, "Oops! An error occurred on our end. Please try again or contact support.")
             return "ok", 200
 
-if __name__ == "__main__":
-    assignment_thread = threading.Thread(target=assign_prebooked_rides_periodically)
-    assignment_thread.daemon = True 
-    assignment_thread.start()
+start_background_jobs()
 
+if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)), debug=True)
\ No newline at end of file
@@ -1,6 +1,25 @@
+import os
+import json
+import atexit
+import base64
+import queue
+import threading
+import time
+from contextlib import contextmanager
 import mysql.connector
 from mysql.connector import errorcode
-from datetime import datetime
+from datetime import datetime, timedelta
+from utils.cache import TTLCache
+from utils.query_stats import query_stats
+from utils.records import to_records
+from utils.session_store import WriteBackSessionStore
+from utils.route_metrics import parse_distance_m, parse_duration_s
+from utils.dispatch import DriverIndex
+from utils.matching import plan_assignments
+from utils.availability import ReservationCalendar, ride_window
+from utils.location_ingest import LocationBuffer
+from utils.eta import estimate_eta
+from utils import sqlite_backend
 
 db_config = {
     'host': '34.72.197.29',
@@ -9,20 +28,397 @@ db_config = {
     'database': 'cab_booking_db'
 }
 
-def connect():
-    """Establishes a connection to the MySQL database."""
+# "mysql" (production) or "sqlite" (an embedded file database for local
+# development and benchmarks; see utils/sqlite_backend.py).
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cab_booking.sqlite3"))
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT", 10))
+POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DASHBOARD_STATS_TTL_SECONDS = int(os.getenv("DASHBOARD_STATS_TTL", 10))
+SETTINGS_CACHE_TTL_SECONDS = int(os.getenv("SETTINGS_CACHE_TTL", 30))
+OWNER_CACHE_TTL_SECONDS = int(os.getenv("OWNER_CACHE_TTL", 60))
+BULK_IMPORT_CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", 500))
+ARCHIVE_AFTER_DAYS = int(os.getenv("RIDE_ARCHIVE_AFTER_DAYS", 90))
+ARCHIVE_BATCH_SIZE = int(os.getenv("RIDE_ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_STATUSES = tuple(s.strip() for s in os.getenv("RIDE_ARCHIVE_STATUSES", "completed,cancelled").split(",") if s.strip())
+CHAT_SESSION_CACHE_ENABLED = os.getenv("CHAT_SESSION_CACHE", "1").lower() not in ("0", "false", "no")
+CHAT_SESSION_CACHE_SIZE = int(os.getenv("CHAT_SESSION_CACHE_SIZE", 5000))
+CHAT_SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL", 900))
+CHAT_SESSION_FLUSH_SECONDS = float(os.getenv("CHAT_SESSION_FLUSH_INTERVAL", 2))
+DISPATCH_CELL_KM = float(os.getenv("DISPATCH_CELL_KM", 1.0))
+DISPATCH_CANDIDATES = int(os.getenv("DISPATCH_CANDIDATES", 5))
+DISPATCH_MAX_KM = float(os.getenv("DISPATCH_MAX_KM", 25))
+DISPATCH_INDEX_REFRESH_SECONDS = int(os.getenv("DISPATCH_INDEX_REFRESH", 300))
+# Turnaround kept free around every booked ride, and the length assumed for rides without an end or duration.
+AVAILABILITY_BUFFER_MINUTES = int(os.getenv("AVAILABILITY_BUFFER_MINUTES", 15))
+DEFAULT_RIDE_MINUTES = int(os.getenv("DEFAULT_RIDE_MINUTES", 60))
+AVAILABILITY_REFRESH_SECONDS = int(os.getenv("AVAILABILITY_REFRESH", 300))
+# Candidates tried when a concurrent booking claims the driver or car we picked first.
+CLAIM_ATTEMPTS = int(os.getenv("CLAIM_ATTEMPTS", 5))
+LOCATION_BUFFER_ENABLED = os.getenv("LOCATION_BUFFER", "1").lower() not in ("0", "false", "no")
+LOCATION_FLUSH_SECONDS = float(os.getenv("LOCATION_FLUSH_INTERVAL", 2))
+LOCATION_MAX_PENDING = int(os.getenv("LOCATION_MAX_PENDING", 5000))
+LOCATION_HISTORY_RETENTION_DAYS = int(os.getenv("LOCATION_HISTORY_RETENTION_DAYS", 7))
+LOCATION_HISTORY_DAYS_AHEAD = 3
+# How far back the location history is read to estimate a driver's speed for ETAs.
+ETA_TRACK_MINUTES = int(os.getenv("ETA_TRACK_MINUTES", 10))
+
+# Read replicas: comma-separated "host[:port]" list sharing db_config's credentials.
+REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+REPLICA_MAX_LAG_SECONDS = int(os.getenv("DB_REPLICA_MAX_LAG", 5))
+REPLICA_LAG_CHECK_SECONDS = int(os.getenv("DB_REPLICA_LAG_CHECK", 5))
+REPLICA_RETRY_SECONDS = int(os.getenv("DB_REPLICA_RETRY", 30))
+READ_YOUR_WRITES_SECONDS = int(os.getenv("DB_READ_YOUR_WRITES", 5))
+
+
+def _connect_mysql(config):
+    return mysql.connector.connect(**config, connection_timeout=10, autocommit=True)
+
+def _connect_sqlite(config):
+    return sqlite_backend.connect(config['path'])
+
+BACKENDS = {
+    'mysql': (_connect_mysql, db_config),
+    'sqlite': (_connect_sqlite, {'path': SQLITE_PATH}),
+}
+if DB_BACKEND not in BACKENDS:
+    raise ValueError(f"Unknown DB_BACKEND {DB_BACKEND!r}; expected one of {', '.join(BACKENDS)}")
+
+def is_sqlite():
+    return DB_BACKEND == 'sqlite'
+
+
+class PooledConnection:
+    """
+    Wraps a pooled MySQL connection. Calling close() hands the connection back
+    to the pool instead of closing the socket, so existing callers keep working.
+    """
+
+    def __init__(self, pool, conn, created_at, replica=None):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self.replica = replica
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise mysql.connector.errors.InterfaceError("Connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn, self._created_at)
+
+    def invalidate(self):
+        """Closes the underlying socket instead of reusing it, e.g. after an error left the connection in an unknown state."""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.discard(conn)
+
+
+class ConnectionPool:
+    """
+    A thread-safe connection pool shared by request threads and the
+    background workers. Connections are health-checked on checkout and
+    recycled once they are older than `recycle` seconds. `connector`
+    opens a new connection from `config` (MySQL unless told otherwise).
+    """
+
+    def __init__(self, config, size=POOL_SIZE, timeout=POOL_TIMEOUT_SECONDS, recycle=POOL_RECYCLE_SECONDS, connector=_connect_mysql):
+        self.config = config
+        self.connector = connector
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "connections_created": 0,
+            "connections_recycled": 0,
+            "health_check_failures": 0,
+            "checkout_timeouts": 0,
+            "in_use": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _new_connection(self):
+        conn = self.connector(self.config)
+        with self._lock:
+            self._stats["connections_created"] += 1
+        return conn, time.monotonic()
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+
+    def acquire(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["checkout_timeouts"] += 1
+            raise mysql.connector.errors.PoolError(f"No connection available within {self.timeout}s (pool size {self.size})")
+
+        try:
+            conn, created_at = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        return PooledConnection(self, conn, created_at)
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, created_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_connection()
+
+            if time.monotonic() - created_at > self.recycle:
+                self._close_quietly(conn)
+                with self._lock:
+                    self._stats["connections_recycled"] += 1
+                continue
+
+            try:
+                conn.ping(reconnect=False)
+                return conn, created_at
+            except mysql.connector.Error:
+                self._close_quietly(conn)
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+
+    def release(self, conn, created_at):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put((conn, created_at))
+        except mysql.connector.Error:
+            self._close_quietly(conn)
+        finally:
+            self._checked_in()
+
+    def discard(self, conn):
+        self._close_quietly(conn)
+        self._checked_in()
+
+    def _checked_in(self):
+        with self._lock:
+            self._stats["in_use"] -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        stats["wait_seconds_avg"] = stats["wait_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+
+class Replica:
+    """A read replica with its own pool, plus health and lag bookkeeping."""
+
+    def __init__(self, host_spec):
+        host, _, port = host_spec.partition(':')
+        config = {**db_config, 'host': host}
+        if port:
+            config['port'] = int(port)
+        self.name = host_spec
+        self.pool = ConnectionPool(config)
+        self._lock = threading.Lock()
+        self.down_until = 0.0
+        self.lag_seconds = None
+        self.lag_checked_at = 0.0
+        self.reads = 0
+        self.failed_reads = 0
+        self.failures = 0
+
+    def is_available(self):
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self, reason):
+        with self._lock:
+            self.failures += 1
+            self.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        print(f"⚠️ Replica {self.name} unavailable ({reason}); reading from primary for {REPLICA_RETRY_SECONDS}s.")
+
+    def count_failed_read(self):
+        with self._lock:
+            self.failed_reads += 1
+
+    def _check_lag(self, conn):
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:
+                cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone()
+        finally:
+            cursor.close()
+        if not status:
+            # Not configured as a replica (e.g. a stand-in instance): nothing to lag behind.
+            return 0
+        return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+
+    def acquire(self):
+        """Returns a replica connection, or None if this replica is down or lagging."""
+        if not self.is_available():
+            return None
+        try:
+            conn = self.pool.acquire()
+        except mysql.connector.Error as err:
+            self.mark_down(err)
+            return None
+
+        if time.monotonic() - self.lag_checked_at > REPLICA_LAG_CHECK_SECONDS:
+            try:
+                self.lag_seconds = self._check_lag(conn)
+                self.lag_checked_at = time.monotonic()
+            except mysql.connector.Error as err:
+                conn.invalidate()
+                self.mark_down(err)
+                return None
+        if self.lag_seconds is None or self.lag_seconds > REPLICA_MAX_LAG_SECONDS:
+            conn.close()
+            self.mark_down(f"replication lag {self.lag_seconds}s")
+            return None
+
+        conn.replica = self
+        with self._lock:
+            self.reads += 1
+        return conn
+
+    def stats(self):
+        return {
+            "available": self.is_available(),
+            "lag_seconds": self.lag_seconds,
+            "reads": self.reads,
+            "failed_reads": self.failed_reads,
+            "failures": self.failures,
+            "pool": self.pool.stats(),
+        }
+
+
+_pool = None
+_replicas = []
+_pool_pid = None
+_pool_lock = threading.Lock()
+_replica_cursor = 0
+_routing = threading.local()
+
+def _ensure_pools():
+    """Creates this process's pools, recreating them after a fork (e.g. gunicorn workers)."""
+    global _pool, _replicas, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                connector, config = BACKENDS[DB_BACKEND]
+                _pool = ConnectionPool(config, connector=connector)
+                # Replicas are MySQL servers; the embedded backend has none.
+                _replicas = [Replica(host) for host in REPLICA_HOSTS] if DB_BACKEND == 'mysql' else []
+                _pool_pid = os.getpid()
+
+def get_pool():
+    _ensure_pools()
+    return _pool
+
+def get_pool_stats():
+    return get_pool().stats()
+
+def get_replica_stats():
+    _ensure_pools()
+    return {replica.name: replica.stats() for replica in _replicas}
+
+def begin_request():
+    """Resets per-request routing state and query counters; called at the start of every web request."""
+    _routing.last_write_at = None
+    query_stats.begin_request()
+
+def get_query_stats(limit=50):
+    return query_stats.snapshot(limit)
+
+def mark_write():
+    """Pins this thread's reads to the primary for a moment so it reads its own writes."""
+    _routing.last_write_at = time.monotonic()
+
+def _reads_pinned_to_primary():
+    last_write_at = getattr(_routing, 'last_write_at', None)
+    return last_write_at is not None and time.monotonic() - last_write_at < READ_YOUR_WRITES_SECONDS
+
+def _connect_replica():
+    global _replica_cursor
+    _ensure_pools()
+    if not _replicas or _reads_pinned_to_primary():
+        return None
+    with _pool_lock:
+        start = _replica_cursor
+        _replica_cursor += 1
+    for offset in range(len(_replicas)):
+        conn = _replicas[(start + offset) % len(_replicas)].acquire()
+        if conn is not None:
+            return conn
+    return None
+
+def connect_dedicated():
+    """A connection of its own, outside the pool, for session-scoped state such as named locks. Close it when done."""
+    connector, config = BACKENDS[DB_BACKEND]
+    return connector(config)
+
+def connect(read_only=False):
+    """
+    Checks out a connection from the pool. Call close() on it to return it.
+    With read_only=True the connection may come from a healthy read replica.
+    """
+    if read_only:
+        conn = _connect_replica()
+        if conn is not None:
+            return conn
     try:
-        return mysql.connector.connect(**db_config, connection_timeout=10)
+        return get_pool().acquire()
     except mysql.connector.Error as err:
         print(f"MySQL Connection Error: {err}")
         raise err
 
-def execute_query(query, params=None, fetch=None, many=False, commit=False):
-    """A helper function to execute database queries safely."""
+def is_read_query(query):
+    statement = query.lstrip().upper()
+    return statement.startswith("SELECT") and "FOR UPDATE" not in statement and "LOCK IN SHARE MODE" not in statement
+
+def execute_query(query, params=None, fetch=None, many=False, commit=False, read_only=None, records=False):
+    """
+    A helper function to execute database queries safely. Plain SELECTs are
+    routed to a read replica when one is configured (read_only=None means
+    "decide from the query"; pass False to force the primary). Every call is
+    timed and recorded in query_stats. With records=True rows come back as
+    compact slot-based records (utils.records) instead of dicts.
+    """
+    if read_only is None:
+        read_only = not commit and not many and is_read_query(query)
     conn = None
+    cursor = None
+    started = time.perf_counter()
+    acquire_ms = 0.0
+    rows = 0
+    failed = False
+    retried = False
     try:
-        conn = connect()
-        cursor = conn.cursor(dictionary=True, buffered=True)
+        conn = connect(read_only=read_only)
+        acquire_ms = (time.perf_counter() - started) * 1000
+        cursor = conn.cursor(dictionary=not records, buffered=True)
         
         if many:
             cursor.executemany(query, params)
@@ -31,20 +427,276 @@ def execute_query(query, params=None, fetch=None, many=False, commit=False):
         
         if commit:
             conn.commit()
+            mark_write()
+            rows = cursor.rowcount
             return cursor.lastrowid if "INSERT" in query.upper() else cursor.rowcount
         
         if fetch == 'one':
-            return cursor.fetchone()
+            result = cursor.fetchone()
+            rows = 1 if result else 0
+            if records and result is not None:
+                result = to_records(cursor.column_names, [result])[0]
+            return result
         elif fetch == 'all':
-            return cursor.fetchall()
+            result = cursor.fetchall()
+            rows = len(result)
+            if records:
+                result = to_records(cursor.column_names, result)
+            return result
             
     except mysql.connector.Error as err:
+        failed = True
+        if conn is not None and conn.replica is not None:
+            # Replica trouble never fails a read: retry it on the primary. Only the
+            # retry is recorded in query_stats, so the read counts once; the
+            # replica keeps its own count of failed reads.
+            conn.replica.count_failed_read()
+            if isinstance(err, (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError)):
+                conn.replica.mark_down(err)
+            conn.invalidate()
+            conn = None
+            retried = True
+            return execute_query(query, params, fetch=fetch, many=many, commit=commit, read_only=False, records=records)
         print(f"MySQL Query Error: {err}")
         return None
     finally:
-        if conn and conn.is_connected():
-            cursor.close()
+        if cursor is not None:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+        if conn is not None:
             conn.close()
+        if not retried:
+            query_stats.record(query, (time.perf_counter() - started) * 1000, acquire_ms, rows, error=failed)
+
+class InstrumentedCursor:
+    """Cursor proxy that records each statement run inside transaction() in query_stats."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _timed(self, method, query, params):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = method(query, params)
+            failed = False
+            return result
+        finally:
+            rows = self._cursor.rowcount if not failed else 0
+            query_stats.record(query, (time.perf_counter() - started) * 1000, rows=max(rows, 0), error=failed)
+
+    def execute(self, query, params=()):
+        return self._timed(self._cursor.execute, query, params)
+
+    def executemany(self, query, seq_params):
+        return self._timed(self._cursor.executemany, query, seq_params)
+
+@contextmanager
+def transaction():
+    """
+    Runs a block of statements as one atomic transaction on a single pooled
+    connection. Yields a dictionary cursor; commits on success and rolls back
+    if the block raises.
+    """
+    conn = connect()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        conn.start_transaction()
+        yield InstrumentedCursor(cursor)
+        conn.commit()
+        mark_write()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
+        conn.close()
+
+def lock_driver_and_car(cursor, driver_id=None, car_id=None):
+    """Takes row locks on a driver and car (always in that order, to avoid deadlocks)."""
+    driver, car = None, None
+    if driver_id:
+        cursor.execute("SELECT * FROM drivers WHERE id=%s FOR UPDATE", (driver_id,))
+        driver = cursor.fetchone()
+    if car_id:
+        cursor.execute("SELECT * FROM cars WHERE id=%s FOR UPDATE", (car_id,))
+        car = cursor.fetchone()
+    return driver, car
+
+class ClaimLost(Exception):
+    """A driver, car or ride was taken by a concurrent request between being picked and being claimed."""
+
+    def __init__(self, kind, row_id, booked_ride=None):
+        super().__init__(f"{kind} {row_id} was claimed by another booking")
+        self.kind = kind
+        self.row_id = row_id
+        self.booked_ride = booked_ride  # the other ride holding it, when the claim lost to an overlapping booking
+
+_claim_stats = {"claims": 0, "conflicts": 0, "exhausted": 0}
+_claim_stats_lock = threading.Lock()
+
+def _count_claim(outcome):
+    # Request threads claim concurrently; a bare += on the dict can lose updates.
+    with _claim_stats_lock:
+        _claim_stats[outcome] += 1
+
+def _overlapping_booking(cursor, ride_id, driver_id, car_id, window):
+    """
+    ('driver' or 'car', other ride id) when another unfinished ride holds
+    it within `window` (plus the turnaround buffer), else None.
+    """
+    if window is None:
+        return None
+    cursor.execute("""
+        SELECT id, driver_id, car_id, start_time, end_time, duration_s FROM rides
+        WHERE (driver_id = %s OR car_id = %s) AND id <> %s AND status NOT IN ('completed', 'cancelled')
+    """, (driver_id, car_id, ride_id or 0))
+    buffer = timedelta(minutes=AVAILABILITY_BUFFER_MINUTES)
+    start, end = window
+    for row in cursor.fetchall():
+        other = booking_window(row['start_time'], row['end_time'], row['duration_s'])
+        if other and other[0] < end + buffer and other[1] > start - buffer:
+            return ('driver' if row['driver_id'] == driver_id else 'car'), row['id']
+    return None
+
+def claim_driver_and_car(cursor, ride_id, driver_id, car_id, window, take_now=True, held=()):
+    """
+    Claims a free driver and car inside the caller's transaction, or raises
+    ClaimLost (which rolls the transaction back). With take_now both are
+    marked busy by compare-and-set UPDATEs (`WHERE status='free'`, checked
+    by rowcount); otherwise (a ride later in the day) their rows are only
+    locked and must still be free. `held` names what the ride already has
+    ('driver', 'car'), which needs no claim, only marking busy with
+    take_now. Either way the rows stay locked until commit, so the check
+    for other bookings in `window` cannot race another claim of the same
+    driver or car.
+    """
+    rows = (('driver', 'drivers', driver_id), ('car', 'cars', car_id))
+    if take_now:
+        for kind, table, row_id in rows:
+            if kind in held:
+                cursor.execute(f"UPDATE {table} SET status='busy' WHERE id=%s", (row_id,))
+                continue
+            cursor.execute(f"UPDATE {table} SET status='busy' WHERE id=%s AND status='free'", (row_id,))
+            if cursor.rowcount != 1:
+                raise ClaimLost(kind, row_id)
+    else:
+        locked = dict(zip(('driver', 'car'), lock_driver_and_car(cursor, driver_id, car_id)))
+        for kind, _, row_id in rows:
+            if kind not in held and (not locked[kind] or locked[kind]['status'] != 'free'):
+                raise ClaimLost(kind, row_id)
+    conflict = _overlapping_booking(cursor, ride_id, driver_id, car_id, window)
+    if conflict:
+        kind, booked_ride = conflict
+        raise ClaimLost(kind, driver_id if kind == 'driver' else car_id, booked_ride)
+
+def claim_ride(cursor, ride_id, driver_id, car_id, status):
+    """Gives an unassigned ride its driver and car; raises ClaimLost if someone assigned it first."""
+    cursor.execute("UPDATE rides SET driver_id=%s, car_id=%s, status=%s WHERE id=%s AND driver_id IS NULL",
+                   (driver_id, car_id, status, ride_id))
+    if cursor.rowcount != 1:
+        raise ClaimLost('ride', ride_id)
+
+def _claim_lost(lost, skip_drivers, skip_cars):
+    """Records a lost claim and excludes the taken driver or car from the next pick."""
+    _count_claim("conflicts")
+    if lost.kind == 'driver':
+        skip_drivers.add(lost.row_id)
+        refresh_dispatch_drivers(lost.row_id)
+    elif lost.kind == 'car':
+        skip_cars.add(lost.row_id)
+
+def get_claim_stats():
+    with _claim_stats_lock:
+        return dict(_claim_stats)
+
+# ---- KEYSET PAGINATION ----
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Returns (sort_value, row_id) from an opaque page cursor; raises ValueError if malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return sort_value, int(row_id)
+    except (ValueError, TypeError, json.JSONDecodeError) as err:
+        raise ValueError("Invalid page cursor") from err
+
+def _keyset_condition(sort_column, id_column, order, sort_value, row_id):
+    """
+    WHERE fragment selecting rows strictly after (sort_value, row_id) in the
+    given order. MySQL sorts NULLs first ascending and last descending, so a
+    NULL sort value needs its own branch.
+    """
+    if sort_column == id_column:
+        op = '<' if order == 'desc' else '>'
+        return f"{id_column} {op} %s", [row_id]
+    if order == 'desc':
+        if sort_value is None:
+            return f"({sort_column} IS NULL AND {id_column} < %s)", [row_id]
+        return (f"({sort_column} < %s OR ({sort_column} = %s AND {id_column} < %s) OR {sort_column} IS NULL)",
+                [sort_value, sort_value, row_id])
+    if sort_value is None:
+        return f"(({sort_column} IS NULL AND {id_column} > %s) OR {sort_column} IS NOT NULL)", [row_id]
+    return (f"({sort_column} > %s OR ({sort_column} = %s AND {id_column} > %s))",
+            [sort_value, sort_value, row_id])
+
+def keyset_page(base_query, conditions, params, sort_columns, id_column, sort='id', order='desc', cursor=None, limit=DEFAULT_PAGE_SIZE,
+                records=False):
+    """
+    Runs `base_query` (without WHERE/ORDER BY) as one keyset-paginated page.
+    `sort_columns` maps the public sort names to SQL columns; every page is
+    ordered by (sort column, id) so cursors are stable while rows are added.
+    Returns {"items": [...], "next_cursor": str or None}.
+    """
+    if sort not in sort_columns:
+        raise ValueError(f"Unsupported sort field: {sort}")
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Unsupported sort order: {order}")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    sort_column = sort_columns[sort]
+    sort_alias = sort_column.split('.')[-1]
+    conditions, params = list(conditions), list(params)
+
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        condition, condition_params = _keyset_condition(sort_column, id_column, order, sort_value, row_id)
+        conditions.append(condition)
+        params.extend(condition_params)
+
+    query = base_query
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    direction = order.upper()
+    if sort_column == id_column:
+        query += f" ORDER BY {id_column} {direction}"
+    else:
+        query += f" ORDER BY {sort_column} {direction}, {id_column} {direction}"
+    query += " LIMIT %s"
+    params.append(limit + 1)
+
+    rows = execute_query(query, tuple(params), fetch='all', records=records)
+    if rows is None:
+        return None
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[sort_alias], last['id'])
+    return {"items": rows, "next_cursor": next_cursor}
 
 # ---- USER ----
 def get_user(phone):
@@ -52,16 +704,28 @@ def get_user(phone):
 
 def add_user(phone, name, password_hash, email):
     query = "INSERT INTO users (phone, name, password_hash, email) VALUES (%s, %s, %s, %s)"
-    return execute_query(query, (phone, name, password_hash, email), commit=True)
+    user_id = execute_query(query, (phone, name, password_hash, email), commit=True)
+    invalidate_dashboard_stats()
+    return user_id
 
 def update_user(user_id, name, phone):
     return execute_query("UPDATE users SET name=%s, phone=%s WHERE id=%s", (name, phone, user_id), commit=True)
 
 def delete_user(user_id):
-    return execute_query("DELETE FROM users WHERE id=%s", (user_id,), commit=True)
+    result = execute_query("DELETE FROM users WHERE id=%s", (user_id,), commit=True)
+    invalidate_dashboard_stats()
+    return result
 
-def get_all_users():
-    return execute_query("SELECT id, phone, name, email FROM users", fetch='all')
+def get_all_users(records=False):
+    return execute_query("SELECT id, phone, name, email FROM users", fetch='all', records=records)
+
+def list_users(cursor=None, limit=DEFAULT_PAGE_SIZE, sort='id', order='desc', phone=None, records=False):
+    conditions, params = [], []
+    if phone:
+        conditions.append("phone LIKE %s")
+        params.append(f"{phone}%")
+    return keyset_page("SELECT id, phone, name, email FROM users", conditions, params,
+                       {'id': 'id', 'name': 'name'}, 'id', sort, order, cursor, limit, records)
 
 def update_user_name_by_phone(phone, name):
     return execute_query("UPDATE users SET name=%s WHERE phone=%s", (name, phone), commit=True)
@@ -77,23 +741,42 @@ def update_password_by_email(email, new_password_hash):
 def get_owner_by_email(email):
     return execute_query("SELECT * FROM owners WHERE email=%s", (email,), fetch='one')
 
+# Owner authorization runs on every dashboard request, so owner phones are
+# kept in a per-process set that owner writes invalidate.
+_owner_phones_cache = TTLCache(OWNER_CACHE_TTL_SECONDS)
+
+def _load_owner_phones():
+    rows = execute_query("SELECT phone FROM owners WHERE phone IS NOT NULL", fetch='all', read_only=False)
+    return frozenset(row['phone'] for row in rows) if rows is not None else None
+
+def get_owner_phones():
+    return _owner_phones_cache.get_or_load('owner_phones', _load_owner_phones) or frozenset()
+
+def is_owner_phone(phone):
+    return phone in get_owner_phones()
+
 def get_all_owner_phone_numbers():
-    rows = execute_query("SELECT phone FROM owners WHERE phone IS NOT NULL", fetch='all')
-    return [row['phone'] for row in rows] if rows else []
+    return list(get_owner_phones())
 
 def add_owner(email, phone, name, password_hash):
     query = "INSERT INTO owners (email, phone, name, password_hash) VALUES (%s, %s, %s, %s)"
-    return execute_query(query, (email, phone, name, password_hash), commit=True)
+    owner_id = execute_query(query, (email, phone, name, password_hash), commit=True)
+    _owner_phones_cache.invalidate()
+    return owner_id
 
 def get_all_owners():
     return execute_query("SELECT id, email, phone, name FROM owners", fetch='all')
 
 def update_owner(owner_id, email, phone, name):
     query = "UPDATE owners SET email=%s, phone=%s, name=%s WHERE id=%s"
-    return execute_query(query, (email, phone, name, owner_id), commit=True)
+    result = execute_query(query, (email, phone, name, owner_id), commit=True)
+    _owner_phones_cache.invalidate()
+    return result
 
 def delete_owner(owner_id):
-    return execute_query("DELETE FROM owners WHERE id=%s", (owner_id,), commit=True)
+    result = execute_query("DELETE FROM owners WHERE id=%s", (owner_id,), commit=True)
+    _owner_phones_cache.invalidate()
+    return result
 
 def get_owner_by_phone(phone):
     return execute_query("SELECT id, email, phone, name FROM owners WHERE phone=%s", (phone,), fetch='one')
@@ -108,21 +791,97 @@ def get_driver_by_id(driver_id):
 
 def add_driver(name, phone, car_id=None, status='free'):
     query = "INSERT INTO drivers (name, phone, car_id, status) VALUES (%s, %s, %s, %s)"
-    return execute_query(query, (name, phone, car_id, status), commit=True)
+    driver_id = execute_query(query, (name, phone, car_id, status), commit=True)
+    invalidate_dashboard_stats()
+    return driver_id
 
 def update_driver(driver_id, name, phone, car_id, status):
     query = "UPDATE drivers SET name=%s, phone=%s, car_id=%s, status=%s WHERE id=%s"
-    return execute_query(query, (name, phone, car_id, status, driver_id), commit=True)
+    result = execute_query(query, (name, phone, car_id, status, driver_id), commit=True)
+    invalidate_dashboard_stats()
+    refresh_dispatch_drivers(driver_id)
+    return result
+
+# Driver location pings are buffered (utils.location_ingest): the dispatch
+# index moves the driver at once, and the latest position of every driver
+# that moved is written to `drivers` every LOCATION_FLUSH_INTERVAL seconds
+# in one transaction. Each worker process buffers its own pings; set
+# LOCATION_BUFFER=0 to write every ping through.
+_LOCATION_FLUSH_CHUNK = 500
+
+def _location_time(recorded_at):
+    """A ping's epoch seconds as a DATETIME(3) value (default now), truncated so it compares exactly once stored."""
+    taken = datetime.fromtimestamp(recorded_at) if recorded_at is not None else datetime.now()
+    return taken.replace(microsecond=taken.microsecond // 1000 * 1000)
+
+def _write_driver_locations(batch):
+    """
+    Stores (driver_id, lat, lng, recorded_at) positions with one CASE update
+    per chunk, in one transaction. A driver whose stored position was taken
+    later (flushed by another worker, say) keeps it.
+    """
+    batch = sorted(batch)  # a fixed row order, so concurrent flushes cannot deadlock
+    with transaction() as cursor:
+        for start in range(0, len(batch), _LOCATION_FLUSH_CHUNK):
+            chunk = batch[start:start + _LOCATION_FLUSH_CHUNK]
+            cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+            taken = [value for driver_id, _, _, recorded_at in chunk for value in (driver_id, _location_time(recorded_at))]
+            params = [value for driver_id, lat, _, _ in chunk for value in (driver_id, lat)]
+            params += [value for driver_id, _, lng, _ in chunk for value in (driver_id, lng)]
+            params += taken
+            params += [driver_id for driver_id, _, _, _ in chunk]
+            params += taken
+            cursor.execute(f"""
+                UPDATE drivers SET last_latitude = CASE id {cases} END, last_longitude = CASE id {cases} END,
+                    last_location_at = CASE id {cases} END
+                WHERE id IN ({', '.join(['%s'] * len(chunk))})
+                AND (last_location_at IS NULL OR last_location_at <= CASE id {cases} END)
+            """, params)
+    # Drivers without a position were not in the index yet; read them in now that one is stored.
+    unindexed = [driver_id for driver_id, lat, lng, _ in batch if not _driver_index.move(driver_id, lat, lng)]
+    refresh_dispatch_drivers(*unindexed)
+    _append_location_history(batch)
+
+_driver_locations = LocationBuffer(
+    _write_driver_locations, flush_interval=LOCATION_FLUSH_SECONDS, max_pending=LOCATION_MAX_PENDING,
+    on_ping=lambda driver_id, lat, lng: _driver_index.move(driver_id, lat, lng)
+)
+atexit.register(_driver_locations.flush)
+
+def update_driver_location(driver_id, latitude, longitude, recorded_at=None):
+    """
+    Records a driver's position, taken at `recorded_at` (epoch seconds,
+    default now). Returns False for an invalid position or a ping older
+    than the last one accepted for the driver.
+    """
+    if LOCATION_BUFFER_ENABLED:
+        return _driver_locations.offer(int(driver_id), latitude, longitude, recorded_at)
+    try:
+        recorded_at = min(float(recorded_at), time.time()) if recorded_at is not None else None
+        _write_driver_locations([(int(driver_id), float(latitude), float(longitude), recorded_at)])
+    except (mysql.connector.Error, TypeError, ValueError) as err:
+        print(f"Error saving location of driver {driver_id}: {err}")
+        return False
+    return True
 
-def update_driver_location(driver_id, latitude, longitude):
-    query = "UPDATE drivers SET last_latitude=%s, last_longitude=%s WHERE id=%s"
-    return execute_query(query, (latitude, longitude, driver_id), commit=True)
+def flush_driver_locations():
+    return _driver_locations.flush()
+
+def get_location_ingest_stats():
+    stats = _driver_locations.stats()
+    stats["enabled"] = LOCATION_BUFFER_ENABLED
+    stats.update(_location_history_stats)
+    return stats
 
 def delete_driver(driver_id):
-    return execute_query("DELETE FROM drivers WHERE id=%s", (driver_id,), commit=True)
+    result = execute_query("DELETE FROM drivers WHERE id=%s", (driver_id,), commit=True)
+    invalidate_dashboard_stats()
+    _driver_index.remove(int(driver_id))
+    _driver_locations.forget(int(driver_id))
+    return result
 
 
-def get_all_drivers(status=None):
+def get_all_drivers(status=None, records=False):
     query = """
         SELECT 
             d.id, 
@@ -139,33 +898,67 @@ def get_all_drivers(status=None):
     if status:
         query += " WHERE d.status = %s"
         params.append(status)
-    return execute_query(query, params, fetch='all')
+    return execute_query(query, params, fetch='all', records=records)
+
+def list_drivers(cursor=None, limit=DEFAULT_PAGE_SIZE, sort='id', order='desc', status=None, phone=None, records=False):
+    query = """
+        SELECT d.id, d.name, d.phone, c.car_number AS car_number, d.status, d.car_id,
+               d.last_latitude, d.last_longitude
+        FROM drivers d LEFT JOIN cars c ON d.car_id = c.id
+    """
+    conditions, params = [], []
+    if status:
+        conditions.append("d.status = %s")
+        params.append(status)
+    if phone:
+        conditions.append("d.phone LIKE %s")
+        params.append(f"{phone}%")
+    return keyset_page(query, conditions, params, {'id': 'd.id', 'name': 'd.name'}, 'd.id', sort, order, cursor, limit, records)
 # ---- CAR ----
 def get_car_by_id(car_id):
     return execute_query("SELECT * FROM cars WHERE id=%s", (car_id,), fetch='one')
 
 def add_car(car_number, model, car_type, rate, status='free'):
     query = "INSERT INTO cars (car_number, model, type, rate, status) VALUES (%s, %s, %s, %s, %s)"
-    return execute_query(query, (car_number, model, car_type, rate, status), commit=True)
+    car_id = execute_query(query, (car_number, model, car_type, rate, status), commit=True)
+    invalidate_dashboard_stats()
+    return car_id
 
 def update_car(car_id, car_number, model, car_type, rate, status):
     query = "UPDATE cars SET car_number=%s, model=%s, type=%s, rate=%s, status=%s WHERE id=%s"
-    return execute_query(query, (car_number, model, car_type, rate, status, car_id), commit=True)
+    result = execute_query(query, (car_number, model, car_type, rate, status, car_id), commit=True)
+    invalidate_dashboard_stats()
+    invalidate_dispatch_index()
+    return result
 
 def delete_car(car_id):
-    return execute_query("DELETE FROM cars WHERE id=%s", (car_id,), commit=True)
+    result = execute_query("DELETE FROM cars WHERE id=%s", (car_id,), commit=True)
+    invalidate_dashboard_stats()
+    invalidate_dispatch_index()
+    return result
 
 def list_available_car_types():
     rows = execute_query("SELECT DISTINCT type FROM cars WHERE status='free'", fetch='all')
     return [row['type'] for row in rows] if rows else []
 
-def get_all_cars(status=None):
+def get_all_cars(status=None, records=False):
     query = "SELECT * FROM cars"
     params = []
     if status:
         query += " WHERE status = %s"
         params.append(status)
-    return execute_query(query, params, fetch='all')
+    return execute_query(query, params, fetch='all', records=records)
+
+def list_cars(cursor=None, limit=DEFAULT_PAGE_SIZE, sort='id', order='desc', status=None, car_type=None, records=False):
+    conditions, params = [], []
+    if car_type:
+        conditions.append("type = %s")
+        params.append(car_type)
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    return keyset_page("SELECT * FROM cars", conditions, params,
+                       {'id': 'id', 'rate': 'rate'}, 'id', sort, order, cursor, limit, records)
 
 
 def get_rate_for_car_type(car_type):
@@ -177,35 +970,466 @@ def get_rate_for_car_type(car_type):
     result = execute_query(query, (car_type,), fetch='one')
     
     return result['rate'] if result and result['rate'] is not None else None
-    
+
+# ---- BULK IMPORT ----
+BULK_IMPORT_COLUMNS = {
+    'cars': ('car_number', 'model', 'type', 'rate', 'status'),
+    'drivers': ('name', 'phone', 'car_id', 'status'),
+    'users': ('phone', 'name', 'email', 'password_hash'),
+}
+
+def _insert_rows_individually(query, chunk):
+    """Inserts a failed chunk one row at a time so only the offending rows are rejected."""
+    inserted, errors = 0, []
+    try:
+        with transaction() as cursor:
+            for row_number, values in chunk:
+                try:
+                    cursor.execute(query, values)
+                    inserted += 1
+                except mysql.connector.IntegrityError as err:
+                    errors.append({"row": row_number, "error": err.msg})
+    except mysql.connector.Error as err:
+        print(f"❌ Bulk import chunk failed: {err}")
+        return 0, [{"row": row_number, "error": str(err)} for row_number, _ in chunk]
+    return inserted, errors
+
+def bulk_insert(table, rows, chunk_size=BULK_IMPORT_CHUNK_SIZE):
+    """
+    Inserts validated (row_number, values) pairs into `table` with one
+    executemany per chunk, each chunk in its own transaction. If a chunk is
+    rejected (e.g. a duplicate phone) it is retried row by row. Returns
+    (inserted, errors, chunks).
+    """
+    columns = BULK_IMPORT_COLUMNS[table]
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    inserted, errors, chunks = 0, [], 0
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        chunks += 1
+        try:
+            with transaction() as cursor:
+                cursor.executemany(query, [values for _, values in chunk])
+            inserted += len(chunk)
+        except mysql.connector.Error:
+            chunk_inserted, chunk_errors = _insert_rows_individually(query, chunk)
+            inserted += chunk_inserted
+            errors.extend(chunk_errors)
+    if inserted:
+        invalidate_dashboard_stats()
+        invalidate_dispatch_index()
+    return inserted, errors, chunks
+
+# ---- AVAILABILITY ----
+# Reservation calendars (utils.availability) of every driver and car, built
+# from the rides that hold them and are not finished yet. `status='free'`
+# only says a driver is not on a trip right now; the calendars answer
+# "is this driver free for [start, end)", so a ride booked for later in
+# the day blocks its driver for that window even while they are idle.
+# Like the dispatch index, the calendars are loaded on first use, kept
+# current by the ride writes in this module, and reloaded every
+# AVAILABILITY_REFRESH seconds to pick up other processes' writes.
+_RESERVATION_QUERY = """
+    SELECT id, driver_id, car_id, start_time, end_time, duration_s FROM rides
+    WHERE status NOT IN ('completed', 'cancelled') AND (driver_id IS NOT NULL OR car_id IS NOT NULL)
+"""
+_driver_calendar = ReservationCalendar(timedelta(minutes=AVAILABILITY_BUFFER_MINUTES))
+_car_calendar = ReservationCalendar(timedelta(minutes=AVAILABILITY_BUFFER_MINUTES))
+_calendar_state = {"loaded_at": None, "loads": 0}
+_calendar_lock = threading.Lock()
+
+def booking_window(start_time, end_time=None, duration_s=None):
+    """The [start, end) a ride with these times occupies its driver and car, or None without a start."""
+    return ride_window(start_time, end_time, duration_s, DEFAULT_RIDE_MINUTES)
+
+def _reservations(row):
+    window = booking_window(row['start_time'], row['end_time'], row.get('duration_s'))
+    start, end = window if window else (None, None)
+    return (row['id'], row['driver_id'], start, end), (row['id'], row['car_id'], start, end)
+
+def _ensure_availability_calendar():
+    loaded_at = _calendar_state["loaded_at"]
+    if loaded_at is not None and time.monotonic() - loaded_at < AVAILABILITY_REFRESH_SECONDS:
+        return
+    with _calendar_lock:
+        loaded_at = _calendar_state["loaded_at"]
+        if loaded_at is not None and time.monotonic() - loaded_at < AVAILABILITY_REFRESH_SECONDS:
+            return
+        rows = execute_query(_RESERVATION_QUERY, fetch='all', read_only=False)
+        if rows is None:
+            return
+        bookings = [_reservations(row) for row in rows]
+        _driver_calendar.load(driver for driver, _ in bookings)
+        _car_calendar.load(car for _, car in bookings)
+        _calendar_state["loaded_at"] = time.monotonic()
+        _calendar_state["loads"] += 1
+
+def invalidate_availability_calendar():
+    """Forces a full reload on the next lookup (e.g. after bulk ride imports)."""
+    _calendar_state["loaded_at"] = None
+
+def refresh_ride_reservations(*ride_ids):
+    """Re-reads the given rides into the calendars after they are booked, assigned, edited or finished."""
+    ids = [int(ride_id) for ride_id in ride_ids if ride_id]
+    if not ids or _calendar_state["loaded_at"] is None:
+        return
+    placeholders = ", ".join(["%s"] * len(ids))
+    rows = execute_query(f"{_RESERVATION_QUERY} AND id IN ({placeholders})", ids, fetch='all', read_only=False)
+    if rows is None:
+        invalidate_availability_calendar()
+        return
+    for ride_id in set(ids) - {row['id'] for row in rows}:
+        _driver_calendar.release(ride_id)
+        _car_calendar.release(ride_id)
+    for row in rows:
+        driver, car = _reservations(row)
+        _driver_calendar.reserve(*driver)
+        _car_calendar.reserve(*car)
+
+def free_drivers_for(driver_ids, window, ignore_ride=None):
+    """The ids from `driver_ids` with nothing booked within `window` ((start, end), or None for no check)."""
+    if window is None:
+        return list(driver_ids)
+    _ensure_availability_calendar()
+    return _driver_calendar.free_among(driver_ids, *window, ignore_ride=ignore_ride)
+
+def free_cars_for(car_ids, window, ignore_ride=None):
+    if window is None:
+        return list(car_ids)
+    _ensure_availability_calendar()
+    return _car_calendar.free_among(car_ids, *window, ignore_ride=ignore_ride)
+
+def get_booking_conflicts(driver_id, car_id, window, ignore_ride=None):
+    """Ride ids already holding the driver or the car within `window`, for refusing a manual assignment."""
+    if window is None:
+        return []
+    _ensure_availability_calendar()
+    rides = set(_driver_calendar.conflicts(driver_id, *window)) if driver_id else set()
+    if car_id:
+        rides.update(_car_calendar.conflicts(car_id, *window))
+    rides.discard(ignore_ride)
+    return sorted(rides)
+
+def get_availability_stats():
+    loaded_at = _calendar_state["loaded_at"]
+    return {
+        "drivers": _driver_calendar.stats(),
+        "cars": _car_calendar.stats(),
+        "loads": _calendar_state["loads"],
+        "age_seconds": round(time.monotonic() - loaded_at, 1) if loaded_at is not None else None,
+    }
+
+# ---- DISPATCH ----
+# An in-memory grid of driver positions (utils.dispatch) answers "which free
+# drivers are nearest to this pickup". It is loaded from `drivers` on first
+# use, kept current by the location and status writes in this module, and
+# reloaded every DISPATCH_INDEX_REFRESH seconds to pick up writes made by
+# other worker processes. Candidates are re-checked against the database
+# before one is handed out, so a stale entry can cost a candidate, never
+# a double booking.
+_DISPATCH_DRIVER_QUERY = """
+    SELECT d.id, d.status, d.is_fixed, d.car_id, d.last_latitude, d.last_longitude,
+           c.type AS car_type, c.status AS car_status
+    FROM drivers d LEFT JOIN cars c ON d.car_id = c.id
+"""
+_driver_index = DriverIndex(DISPATCH_CELL_KM)
+_driver_index_state = {"loaded_at": None, "loads": 0}
+_driver_index_lock = threading.Lock()
+
+def _dispatch_entry(row):
+    """(driver_id, lat, lng, free, car_type) for the index; fixed drivers bring their own car."""
+    fixed = bool(row['is_fixed']) and row['car_id'] is not None
+    free = row['status'] == 'free' and (not fixed or row['car_status'] == 'free')
+    car_type = row['car_type'].lower() if fixed and row['car_type'] else None
+    return row['id'], row['last_latitude'], row['last_longitude'], free, car_type
+
+def _ensure_dispatch_index():
+    loaded_at = _driver_index_state["loaded_at"]
+    if loaded_at is not None and time.monotonic() - loaded_at < DISPATCH_INDEX_REFRESH_SECONDS:
+        return
+    with _driver_index_lock:
+        loaded_at = _driver_index_state["loaded_at"]
+        if loaded_at is not None and time.monotonic() - loaded_at < DISPATCH_INDEX_REFRESH_SECONDS:
+            return
+        rows = execute_query(_DISPATCH_DRIVER_QUERY, fetch='all', read_only=False)
+        if rows is None:
+            return
+        _driver_index.load(_dispatch_entry(row) for row in rows)
+        _driver_index_state["loaded_at"] = time.monotonic()
+        _driver_index_state["loads"] += 1
+
+def invalidate_dispatch_index():
+    """Forces a full reload on the next search (e.g. after car edits or bulk imports)."""
+    _driver_index_state["loaded_at"] = None
+
+def refresh_dispatch_drivers(*driver_ids):
+    """Re-reads the given drivers into the index after a status, car or location change."""
+    ids = [int(driver_id) for driver_id in driver_ids if driver_id]
+    if not ids or _driver_index_state["loaded_at"] is None:
+        return
+    placeholders = ", ".join(["%s"] * len(ids))
+    rows = execute_query(f"{_DISPATCH_DRIVER_QUERY} WHERE d.id IN ({placeholders})", ids, fetch='all', read_only=False)
+    if rows is None:
+        invalidate_dispatch_index()
+        return
+    for driver_id in set(ids) - {row['id'] for row in rows}:
+        _driver_index.remove(driver_id)
+    for row in rows:
+        _driver_index.set_driver(*_dispatch_entry(row))
+
+def get_nearest_drivers(pickup_lat, pickup_lng, car_type=None, k=DISPATCH_CANDIDATES, max_km=DISPATCH_MAX_KM):
+    """
+    The `k` free drivers nearest to the pickup that can serve `car_type`
+    (unfixed drivers, or fixed drivers whose own car is of that type), as
+    [{"driver_id", "distance_km"}] nearest first.
+    """
+    _ensure_dispatch_index()
+    wanted = car_type.lower() if car_type else None
+    accept = None if wanted is None else (lambda fixed_type: fixed_type is None or fixed_type == wanted)
+    return [
+        {"driver_id": driver_id, "distance_km": round(distance, 3)}
+        for distance, driver_id, _ in _driver_index.nearest(pickup_lat, pickup_lng, k, accept, max_km)
+    ]
+
+def get_nearest_available_driver(car_type, pickup_lat, pickup_lng, window=None, exclude_drivers=(), exclude_cars=()):
+    """
+    The nearest compatible driver that the database confirms is still free,
+    with their own car (fixed drivers) or a free car of `car_type`, and
+    with nothing booked within `window` (see free_drivers_for). Drivers and
+    cars in `exclude_*` (lost to a concurrent claim) are passed over.
+    Returns (driver, car), or (None, None). The driver dict carries `distance_km`.
+    """
+    candidates = get_nearest_drivers(pickup_lat, pickup_lng, car_type, k=DISPATCH_CANDIDATES + len(exclude_drivers))
+    candidates = [candidate for candidate in candidates if candidate['driver_id'] not in exclude_drivers]
+    if not candidates:
+        return None, None
+    ids = [candidate['driver_id'] for candidate in candidates]
+    placeholders = ", ".join(["%s"] * len(ids))
+    rows = execute_query(f"SELECT * FROM drivers WHERE id IN ({placeholders}) AND status = 'free'", ids, fetch='all', read_only=False) or []
+    drivers = {row['id']: row for row in rows}
+    stale = [driver_id for driver_id in ids if driver_id not in drivers]
+    if stale:
+        refresh_dispatch_drivers(*stale)
+    bookable = set(free_drivers_for(list(drivers), window))
+
+    pool_car = None
+    for candidate in candidates:
+        driver = drivers.get(candidate['driver_id'])
+        if driver is None or driver['id'] not in bookable:
+            continue
+        if driver.get('is_fixed') and driver.get('car_id') is not None:
+            car = execute_query(
+                "SELECT * FROM cars WHERE id = %s AND status = 'free' AND type = %s", (driver['car_id'], car_type),
+                fetch='one', read_only=False
+            )
+            if car and (car['id'] in exclude_cars or not free_cars_for([car['id']], window)):
+                car = None
+        else:
+            if pool_car is None:
+                cars = execute_query("""
+                    SELECT * FROM cars WHERE status = 'free' AND type = %s
+                    AND id NOT IN (SELECT car_id FROM drivers WHERE is_fixed = 1 AND car_id IS NOT NULL)
+                """, (car_type,), fetch='all', read_only=False) or []
+                free_ids = free_cars_for([car['id'] for car in cars if car['id'] not in exclude_cars], window)
+                pool_car = next((car for car in cars if car['id'] in free_ids), False)
+            car = pool_car or None
+        if car:
+            driver['distance_km'] = candidate['distance_km']
+            return driver, car
+    return None, None
+
+def get_dispatch_stats():
+    stats = _driver_index.stats()
+    loaded_at = _driver_index_state["loaded_at"]
+    stats["loads"] = _driver_index_state["loads"]
+    stats["age_seconds"] = round(time.monotonic() - loaded_at, 1) if loaded_at is not None else None
+    return stats
+
 # ---- RIDE ----
-def add_ride(user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time, car_type):
+# Callables run as callback(ride_id, status, start_time) after a ride is
+# booked or edited; the assignment scheduler in app.py uses this to learn
+# about new prebookings without polling.
+_ride_listeners = []
+
+def add_ride_listener(callback):
+    _ride_listeners.append(callback)
+
+def _notify_ride_listeners(ride_id, status, start_time):
+    for callback in _ride_listeners:
+        try:
+            callback(ride_id, status, start_time)
+        except Exception as e:
+            print(f"⚠️ Ride listener failed for ride {ride_id}: {e}")
+
+def add_ride(user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time, car_type,
+             distance_m=None, duration_s=None, pickup_lat=None, pickup_lng=None):
+    """
+    `distance`/`duration` are the display strings; `distance_m`/`duration_s`
+    are the numeric Directions values, parsed from the strings when not given.
+    `pickup_lat`/`pickup_lng` let the assignment worker dispatch the nearest driver.
+    A driver and car given with status 'ongoing' or 'assigned' are claimed
+    (see claim_driver_and_car); returns None if they were taken meanwhile.
+    """
+    try:
+        return _insert_ride(user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status,
+                            start_time, end_time, car_type, distance_m, duration_s, pickup_lat, pickup_lng)
+    except ClaimLost as lost:
+        print(f"Could not book ride for {user_phone}: {lost}")
+        return None
+
+def _insert_ride(user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time, car_type,
+                 distance_m=None, duration_s=None, pickup_lat=None, pickup_lng=None, window_end=None):
+    """add_ride(), raising ClaimLost instead of returning None when the driver or car is taken."""
     if start_time is None:
         start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if distance_m is None:
+        distance_m = parse_distance_m(distance)
+    if duration_s is None:
+        duration_s = parse_duration_s(duration)
     
     query = """
-        INSERT INTO rides (user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time, car_type)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO rides (user_phone, pickup, destination, distance, duration, distance_m, duration_s, fare, car_id, driver_id, status, payment_status, start_time, end_time, car_type,
+                           pickup_lat, pickup_lng, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     """
-    params = (user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time, car_type)
-    ride_id = execute_query(query, params, commit=True)
+    params = (user_phone, pickup, destination, distance, duration, distance_m, duration_s, fare, car_id, driver_id, status, payment_status, start_time, end_time, car_type,
+              pickup_lat, pickup_lng, datetime.now().replace(microsecond=0))
+
+    claims = status in ('ongoing', 'assigned') and driver_id and car_id
+    takes_resources = claims and status == 'ongoing'
+    if not claims and payment_status != 'paid':
+        ride_id = execute_query(query, params, commit=True)
+        invalidate_dashboard_stats()
+        if driver_id or car_id:
+            refresh_ride_reservations(ride_id)
+        if ride_id:
+            _notify_ride_listeners(ride_id, status, start_time)
+        return ride_id
 
-    if ride_id and status == 'ongoing' and driver_id and car_id:
-        execute_query("UPDATE drivers SET status='busy' WHERE id=%s", (driver_id,), commit=True)
-        execute_query("UPDATE cars SET status='busy' WHERE id=%s", (car_id,), commit=True)
-    return ride_id
+    try:
+        with transaction() as cursor:
+            if claims:
+                window = booking_window(start_time, window_end or end_time, duration_s)
+                claim_driver_and_car(cursor, None, driver_id, car_id, window, take_now=takes_resources)
+            cursor.execute(query, params)
+            ride_id = cursor.lastrowid
+            update_revenue_rollup(cursor, None, {'payment_status': payment_status, 'fare': fare, 'start_time': start_time})
+        invalidate_dashboard_stats()
+        if claims:
+            _count_claim("claims")
+            refresh_dispatch_drivers(driver_id)
+        if driver_id or car_id:
+            refresh_ride_reservations(ride_id)
+        _notify_ride_listeners(ride_id, status, start_time)
+        return ride_id
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (add_ride): {err}")
+        return None
 
-def update_ride(ride_id, user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time):
+def add_ride_with_available_driver(window_end, attempts=CLAIM_ATTEMPTS, **ride):
+    """
+    add_ride() with a driver and car picked by get_available_driver_and_car
+    for [start_time, window_end) and claimed in the same transaction as the
+    insert. When a concurrent booking claims the pick first, the next
+    candidate is tried, up to `attempts` times. `ride` holds add_ride's
+    keyword arguments except driver_id/car_id. Returns (ride_id, driver,
+    car), or (None, None, None) with nothing saved.
+    """
+    skip_drivers, skip_cars = set(), set()
+    for _ in range(attempts):
+        driver, car = get_available_driver_and_car(ride['car_type'], ride['start_time'], window_end,
+                                                   ride.get('pickup_lat'), ride.get('pickup_lng'), skip_drivers, skip_cars)
+        if not (driver and car):
+            return None, None, None
+        try:
+            ride_id = _insert_ride(**ride, driver_id=driver['id'], car_id=car['id'], window_end=window_end)
+        except ClaimLost as lost:
+            _claim_lost(lost, skip_drivers, skip_cars)
+            continue
+        return (ride_id, driver, car) if ride_id else (None, None, None)
+    _count_claim("exhausted")
+    return None, None, None
+
+def update_ride(ride_id, user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time,
+                distance_m=None, duration_s=None):
+    if distance_m is None:
+        distance_m = parse_distance_m(distance)
+    if duration_s is None:
+        duration_s = parse_duration_s(duration)
     query = """
-        UPDATE rides SET user_phone=%s, pickup=%s, destination=%s, distance=%s, duration=%s, 
-        fare=%s, car_id=%s, driver_id=%s, status=%s, payment_status=%s, start_time=%s, end_time=%s
+        UPDATE rides SET user_phone=%s, pickup=%s, destination=%s, distance=%s, duration=%s, distance_m=%s, duration_s=%s,
+        fare=%s, car_id=%s, driver_id=%s, status=%s, payment_status=%s, start_time=%s, end_time=%s, updated_at=%s
         WHERE id=%s
     """
-    params = (user_phone, pickup, destination, distance, duration, fare, car_id, driver_id, status, payment_status, start_time, end_time, ride_id)
-    return execute_query(query, params, commit=True)
+    params = (user_phone, pickup, destination, distance, duration, distance_m, duration_s, fare, car_id, driver_id, status, payment_status, start_time, end_time,
+              datetime.now().replace(microsecond=0), ride_id)
+    try:
+        with transaction() as cursor:
+            cursor.execute("SELECT fare, payment_status, start_time FROM rides WHERE id=%s FOR UPDATE", (ride_id,))
+            before = cursor.fetchone()
+            cursor.execute(query, params)
+            result = cursor.rowcount
+            if before:
+                update_revenue_rollup(cursor, before, {'payment_status': payment_status, 'fare': fare, 'start_time': start_time})
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (update_ride): {err}")
+        return None
+    invalidate_dashboard_stats()
+    refresh_ride_reservations(ride_id)
+    _notify_ride_listeners(ride_id, status, start_time)
+    return result
 
 def delete_ride(ride_id):
-    return execute_query("DELETE FROM rides WHERE id=%s", (ride_id,), commit=True)
+    try:
+        with transaction() as cursor:
+            cursor.execute("SELECT fare, payment_status, start_time FROM rides WHERE id=%s FOR UPDATE", (ride_id,))
+            before = cursor.fetchone()
+            cursor.execute("DELETE FROM rides WHERE id=%s", (ride_id,))
+            result = cursor.rowcount
+            if before:
+                update_revenue_rollup(cursor, before, None)
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (delete_ride): {err}")
+        return None
+    invalidate_dashboard_stats()
+    refresh_ride_reservations(ride_id)
+    return result
+
+ROUTE_METRICS_BACKFILL_BATCH = 1000
+
+def backfill_route_metrics(batch_size=ROUTE_METRICS_BACKFILL_BATCH):
+    """
+    Fills rides.distance_m/duration_s from the legacy text columns, in id
+    order and one short transaction per batch. Rows whose text cannot be
+    parsed are left NULL. Returns the number of rides updated.
+    """
+    updated, last_id = 0, 0
+    try:
+        while True:
+            with transaction() as cursor:
+                cursor.execute("""
+                    SELECT id, distance, duration FROM rides
+                    WHERE id > %s AND (distance_m IS NULL OR duration_s IS NULL)
+                    ORDER BY id LIMIT %s
+                """, (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    return updated
+                last_id = rows[-1]['id']
+                values = [
+                    (parse_distance_m(row['distance']), parse_duration_s(row['duration']), row['id'])
+                    for row in rows
+                ]
+                values = [value for value in values if value[0] is not None or value[1] is not None]
+                if values:
+                    cursor.executemany(
+                        "UPDATE rides SET distance_m=COALESCE(distance_m, %s), duration_s=COALESCE(duration_s, %s) WHERE id=%s",
+                        values
+                    )
+                    updated += len(values)
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (backfill_route_metrics): {err}")
+        return None
 
 def get_ride_by_id(ride_id):
     query = """
@@ -218,24 +1442,175 @@ def get_ride_by_id(ride_id):
         LEFT JOIN cars c ON r.car_id = c.id
         WHERE r.id = %s
     """
-    return execute_query(query, (ride_id,), fetch='one')
+    ride = execute_query(query, (ride_id,), fetch='one')
+    if ride is None:
+        ride = get_archived_ride_by_id(ride_id)
+    return ride
 
-def get_available_driver_and_car(car_type, start_time, end_time):
-    driver_query = "SELECT * FROM drivers WHERE status = 'free' AND is_fixed = 0 LIMIT 1"
-    car_query = "SELECT * FROM cars WHERE status = 'free' AND type = %s LIMIT 1"
-    
-    driver = execute_query(driver_query, fetch='one')
-    car = execute_query(car_query, (car_type,), fetch='one')
-    
+def get_available_driver_and_car(car_type, start_time, end_time, pickup_lat=None, pickup_lng=None, exclude_drivers=(), exclude_cars=()):
+    """
+    Picks a free driver and a free car of `car_type`, neither of which is
+    booked for another ride within [start_time, end_time). With pickup
+    coordinates the nearest compatible driver wins (see
+    get_nearest_available_driver); otherwise, or when no located driver is
+    in range, any free unfixed driver. This only reads: claim the pick with
+    claim_driver_and_car (add_ride and the assign functions do), since a
+    concurrent booking may pick the same pair.
+    """
+    window = booking_window(start_time, end_time)
+    if pickup_lat is not None and pickup_lng is not None:
+        driver, car = get_nearest_available_driver(car_type, pickup_lat, pickup_lng, window, exclude_drivers, exclude_cars)
+        if driver and car:
+            return driver, car
+
+    drivers = execute_query("SELECT * FROM drivers WHERE status = 'free' AND is_fixed = 0", fetch='all', read_only=False) or []
+    cars = execute_query("SELECT * FROM cars WHERE status = 'free' AND type = %s", (car_type,), fetch='all', read_only=False) or []
+    driver_ids = free_drivers_for([row['id'] for row in drivers if row['id'] not in exclude_drivers], window)
+    car_ids = free_cars_for([row['id'] for row in cars if row['id'] not in exclude_cars], window)
+
+    driver = next((row for row in drivers if row['id'] in driver_ids), None)
+    car = next((row for row in cars if row['id'] in car_ids), None)
     return driver, car
 
 def assign_driver_to_ride(ride_id, driver_id, car_id):
-    execute_query("UPDATE rides SET driver_id=%s, car_id=%s, status='ongoing' WHERE id=%s", (driver_id, car_id, ride_id), commit=True)
-    execute_query("UPDATE drivers SET status='busy' WHERE id=%s", (driver_id,), commit=True)
-    execute_query("UPDATE cars SET status='busy' WHERE id=%s", (car_id,), commit=True)
+    """
+    Gives an unassigned ride this driver and car, claiming both with
+    compare-and-set updates. Returns False when either is no longer free,
+    the ride was assigned meanwhile, or the database fails.
+    """
+    ride = get_ride_by_id(ride_id)
+    window = booking_window(ride['start_time'], ride.get('end_time'), ride.get('duration_s')) if ride else None
+    try:
+        with transaction() as cursor:
+            claim_driver_and_car(cursor, ride_id, driver_id, car_id, window)
+            claim_ride(cursor, ride_id, driver_id, car_id, 'ongoing')
+    except ClaimLost as lost:
+        _count_claim("conflicts")
+        print(f"Could not assign ride {ride_id}: {lost}")
+        return False
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (assign_driver_to_ride): {err}")
+        return False
+    _count_claim("claims")
+    invalidate_dashboard_stats()
+    refresh_dispatch_drivers(driver_id)
+    refresh_ride_reservations(ride_id)
     return True
 
-def get_all_rides(status=None):
+def assign_available_driver(ride, window_end=None, attempts=CLAIM_ATTEMPTS):
+    """
+    Picks and claims a driver and car for an unassigned ride row, moving on
+    to the next candidate when a concurrent booking claims the pick first.
+    Returns (driver, car), or (None, None).
+    """
+    window = booking_window(ride['start_time'], window_end or ride.get('end_time'), ride.get('duration_s'))
+    skip_drivers, skip_cars = set(), set()
+    start, end = window if window else (ride['start_time'], None)
+    for _ in range(attempts):
+        driver, car = get_available_driver_and_car(ride['car_type'], start, end, ride.get('pickup_lat'), ride.get('pickup_lng'),
+                                                   skip_drivers, skip_cars)
+        if not (driver and car):
+            return None, None
+        try:
+            with transaction() as cursor:
+                claim_driver_and_car(cursor, ride['id'], driver['id'], car['id'], window)
+                claim_ride(cursor, ride['id'], driver['id'], car['id'], 'ongoing')
+        except ClaimLost as lost:
+            if lost.kind == 'ride':
+                return None, None
+            _claim_lost(lost, skip_drivers, skip_cars)
+            continue
+        except mysql.connector.Error as err:
+            print(f"MySQL Transaction Error (assign_available_driver): {err}")
+            return None, None
+        _count_claim("claims")
+        invalidate_dashboard_stats()
+        refresh_dispatch_drivers(driver['id'])
+        refresh_ride_reservations(ride['id'])
+        return driver, car
+    _count_claim("exhausted")
+    return None, None
+
+def get_assignment_resources():
+    """
+    Free drivers (fixed ones with their free car's type as `car_type`) and
+    free cars nobody is fixed to, for batch assignment.
+    """
+    drivers = execute_query("""
+        SELECT d.*, c.type AS car_type FROM drivers d LEFT JOIN cars c ON d.car_id = c.id
+        WHERE d.status = 'free' AND (d.is_fixed = 0 OR d.car_id IS NULL OR c.status = 'free')
+    """, fetch='all', read_only=False)
+    cars = execute_query("""
+        SELECT * FROM cars WHERE status = 'free'
+        AND id NOT IN (SELECT car_id FROM drivers WHERE is_fixed = 1 AND car_id IS NOT NULL)
+    """, fetch='all', read_only=False)
+    return drivers, cars
+
+def assign_rides_batch(rides):
+    """
+    Matches `rides` (prebooked ride rows) to free drivers and cars that
+    are not booked elsewhere during the ride, with a min-cost matching on
+    pickup distance (utils.matching), and applies the
+    whole plan in one transaction. Pairs whose ride, driver or car changed
+    since planning, or whose driver or car another ride now holds within
+    the window, are skipped, never half-applied. Returns (assigned,
+    unassigned): assigned is a list of (ride, driver, car, distance_km)
+    with full rows, unassigned the rides left for a later round.
+    """
+    if not rides:
+        return [], []
+    drivers, cars = get_assignment_resources()
+    if drivers is None or cars is None:
+        return [], list(rides)
+    windows = {ride['id']: booking_window(ride['start_time'], ride.get('end_time'), ride.get('duration_s')) for ride in rides}
+    plan, unassigned = plan_assignments(
+        rides, drivers, cars,
+        driver_free=lambda ride, driver: bool(free_drivers_for([driver['id']], windows[ride['id']])),
+        car_free=lambda ride, car: bool(free_cars_for([car['id']], windows[ride['id']]))
+    )
+    if not plan:
+        return [], unassigned
+
+    ride_ids = sorted(ride['id'] for ride, _, _, _ in plan)
+    driver_ids = sorted(driver['id'] for _, driver, _, _ in plan)
+    car_ids = sorted(car['id'] for _, _, car, _ in plan)
+    assigned = []
+    try:
+        with transaction() as cursor:
+            def locked(table, ids, condition):
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"SELECT * FROM {table} WHERE id IN ({placeholders}) AND {condition} FOR UPDATE", ids)
+                return {row['id']: row for row in cursor.fetchall()}
+
+            # Same lock order as the single-ride paths (claim_driver_and_car, then
+            # claim_ride): drivers, then cars, then rides.
+            free_drivers = locked('drivers', driver_ids, "status = 'free'")
+            free_cars = locked('cars', car_ids, "status = 'free'")
+            open_rides = locked('rides', ride_ids, "status = 'prebooked' AND driver_id IS NULL")
+            for ride, driver, car, distance_km in plan:
+                if ride['id'] not in open_rides or driver['id'] not in free_drivers or car['id'] not in free_cars:
+                    unassigned.append(ride)
+                    continue
+                # The calendar used for planning can miss rides other workers booked since
+                # its last reload; the rides table, read under the locks, cannot.
+                if _overlapping_booking(cursor, ride['id'], driver['id'], car['id'], windows[ride['id']]):
+                    _count_claim("conflicts")
+                    unassigned.append(ride)
+                    continue
+                cursor.execute("UPDATE rides SET driver_id=%s, car_id=%s, status='ongoing' WHERE id=%s", (driver['id'], car['id'], ride['id']))
+                cursor.execute("UPDATE drivers SET status='busy' WHERE id=%s", (driver['id'],))
+                cursor.execute("UPDATE cars SET status='busy' WHERE id=%s", (car['id'],))
+                assigned.append((ride, free_drivers[driver['id']], free_cars[car['id']], distance_km))
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (assign_rides_batch): {err}")
+        return [], list(rides)
+    if assigned:
+        invalidate_dashboard_stats()
+        refresh_dispatch_drivers(*(driver['id'] for _, driver, _, _ in assigned))
+        refresh_ride_reservations(*(ride['id'] for ride, _, _, _ in assigned))
+    return assigned, unassigned
+
+def get_all_rides(status=None, records=False):
     query = """
         SELECT
             r.id, u.name AS customer_name, d.name AS driver_name, r.pickup, r.destination,
@@ -250,13 +1625,73 @@ def get_all_rides(status=None):
     if status:
         query += " WHERE r.status = %s"
         params.append(status)
-    return execute_query(query, params, fetch='all')
+    return execute_query(query, params, fetch='all', records=records)
 
-
-
-def get_prebooked_rides_for_assignment():
-    """Fetches all prebooked rides, regardless of time."""
-    return execute_query("SELECT * FROM rides WHERE status='prebooked'", fetch='all')
+def list_rides(cursor=None, limit=DEFAULT_PAGE_SIZE, sort='start_time', order='desc', status=None,
+               start_from=None, start_to=None, phone=None, car_type=None, records=False):
+    """One keyset page of rides with status, start-time range, phone-prefix and car-type filters pushed into SQL."""
+    query = """
+        SELECT
+            r.id, u.name AS customer_name, d.name AS driver_name, r.pickup, r.destination,
+            r.distance, r.duration, r.fare, r.status, r.payment_status, r.start_time, r.end_time,
+            c.model AS car_model, c.car_number, r.user_phone, r.driver_id, r.car_id, r.car_type,
+            r.distance_m, r.duration_s
+        FROM rides r
+        LEFT JOIN users u ON r.user_phone = u.phone
+        LEFT JOIN drivers d ON r.driver_id = d.id
+        LEFT JOIN cars c ON r.car_id = c.id
+    """
+    conditions, params = [], []
+    if status:
+        conditions.append("r.status = %s")
+        params.append(status)
+    if start_from:
+        conditions.append("r.start_time >= %s")
+        params.append(start_from)
+    if start_to:
+        conditions.append("r.start_time < %s")
+        params.append(start_to)
+    if phone:
+        conditions.append("r.user_phone LIKE %s")
+        params.append(f"{phone}%")
+    if car_type:
+        conditions.append("r.car_type = %s")
+        params.append(car_type)
+    return keyset_page(query, conditions, params,
+                       {'id': 'r.id', 'start_time': 'r.start_time', 'fare': 'r.fare'}, 'r.id',
+                       sort, order, cursor, limit, records)
+
+
+
+def get_prebooked_rides_for_assignment(window_start=None, window_end=None, ride_ids=None):
+    """
+    Fetches prebooked rides, optionally only those starting within
+    [window_start, window_end] and/or only the given `ride_ids`.
+    """
+    query = "SELECT * FROM rides WHERE status='prebooked'"
+    params = []
+    if window_start is not None and window_end is not None:
+        query += " AND start_time BETWEEN %s AND %s"
+        params.extend([window_start, window_end])
+    if ride_ids is not None:
+        if not ride_ids:
+            return []
+        query += f" AND id IN ({', '.join(['%s'] * len(ride_ids))})"
+        params.extend(ride_ids)
+    # A just-booked ride may not have reached a replica yet.
+    return execute_query(query, params, fetch='all', read_only=None if ride_ids is None else False)
+
+def get_prebooked_rides_changed_since(after_id, since):
+    """
+    Prebooked rides with an id above `after_id` (booked since) or an
+    updated_at from `since` on (edited since), read from the primary. Each
+    branch is a range scan on (status, id) or (status, updated_at).
+    """
+    return execute_query("""
+        SELECT * FROM rides WHERE status = 'prebooked' AND id > %s
+        UNION
+        SELECT * FROM rides WHERE status = 'prebooked' AND updated_at >= %s
+    """, (after_id, since), fetch='all', read_only=False)
 
 def get_rides_by_user_phone(user_phone=None, status=None, unassigned_only=False):
     query = """
@@ -286,7 +1721,11 @@ def get_rides_by_user_phone(user_phone=None, status=None, unassigned_only=False)
     if user_phone:
         query += " LIMIT 2"
     
-    return execute_query(query, tuple(params), fetch='all')
+    rides = execute_query(query, tuple(params), fetch='all')
+    if user_phone and rides is not None and len(rides) < 2 and not unassigned_only:
+        # Customers with little recent activity still see their last trips once they are archived.
+        rides += get_archived_rides_by_user_phone(user_phone, status, limit=2 - len(rides))
+    return rides
 
 def update_ride_status_and_time(ride_id, new_status, timestamp_column, timestamp_value):
     valid_columns = ['enroute_to_pickup_time', 'at_pickup_time', 'trip_start_time', 'end_time']
@@ -294,17 +1733,31 @@ def update_ride_status_and_time(ride_id, new_status, timestamp_column, timestamp
         raise ValueError("Invalid timestamp column name")
     
     query = f"UPDATE rides SET status=%s, {timestamp_column}=%s WHERE id=%s"
-    return execute_query(query, (new_status, timestamp_value, ride_id), commit=True)
+    result = execute_query(query, (new_status, timestamp_value, ride_id), commit=True)
+    invalidate_dashboard_stats()
+    return result
 
 def complete_ride_and_free_resources(ride_id, end_time):
-    ride = get_ride_by_id(ride_id)
-    if ride:
-        execute_query("UPDATE rides SET status='completed', end_time=%s WHERE id=%s", (end_time, ride_id), commit=True)
+    try:
+        with transaction() as cursor:
+            cursor.execute("SELECT driver_id, car_id FROM rides WHERE id=%s FOR UPDATE", (ride_id,))
+            ride = cursor.fetchone()
+            if not ride:
+                return True
+            lock_driver_and_car(cursor, ride.get('driver_id'), ride.get('car_id'))
+            cursor.execute("UPDATE rides SET status='completed', end_time=%s WHERE id=%s", (end_time, ride_id))
+            if ride.get('driver_id'):
+                cursor.execute("UPDATE drivers SET status='free' WHERE id=%s", (ride['driver_id'],))
+            if ride.get('car_id'):
+                cursor.execute("UPDATE cars SET status='free' WHERE id=%s", (ride['car_id'],))
+        invalidate_dashboard_stats()
         if ride.get('driver_id'):
-            execute_query("UPDATE drivers SET status='free' WHERE id=%s", (ride['driver_id'],), commit=True)
-        if ride.get('car_id'):
-            execute_query("UPDATE cars SET status='free' WHERE id=%s", (ride['car_id'],), commit=True)
-    return True
+            refresh_dispatch_drivers(ride['driver_id'])
+        refresh_ride_reservations(ride_id)
+        return True
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (complete_ride_and_free_resources): {err}")
+        return False
 
 def complete_ride(ride_id):
     """Original function name restored for compatibility. Marks ride as complete and frees resources."""
@@ -313,7 +1766,19 @@ def complete_ride(ride_id):
 
 # ---- PAYMENT & COUPON ----
 def update_payment_status(ride_id, status):
-    return execute_query("UPDATE rides SET payment_status = %s WHERE id = %s", (status, ride_id), commit=True)
+    try:
+        with transaction() as cursor:
+            cursor.execute("SELECT fare, payment_status, start_time FROM rides WHERE id=%s FOR UPDATE", (ride_id,))
+            before = cursor.fetchone()
+            cursor.execute("UPDATE rides SET payment_status = %s WHERE id = %s", (status, ride_id))
+            result = cursor.rowcount
+            if before:
+                update_revenue_rollup(cursor, before, {**before, 'payment_status': status})
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (update_payment_status): {err}")
+        return None
+    invalidate_dashboard_stats()
+    return result
 
 def get_latest_ride_id_by_phone(phone):
     result = execute_query("SELECT id FROM rides WHERE user_phone = %s ORDER BY id DESC LIMIT 1", (phone,), fetch='one')
@@ -338,16 +1803,68 @@ def mark_coupon_used(code):
     return execute_query("UPDATE coupons SET used = 1 WHERE code = %s", (code,), commit=True)
 
 # ---- DASHBOARD & STATS ----
+_dashboard_stats_cache = TTLCache(DASHBOARD_STATS_TTL_SECONDS)
+
+def _compute_dashboard_stats():
+    query = """
+        SELECT
+            (SELECT COUNT(*) FROM users) AS total_customers,
+            d.total_drivers, d.drivers_on_ride,
+            c.total_vehicles, c.vehicles_on_ride,
+            r.total_bookings, r.ongoing_rides, r.pre_bookings, r.payment_pendings, r.completed_distance_km,
+            (SELECT COALESCE(SUM(revenue), 0) FROM revenue_rollup WHERE period_type='yearly') AS revenue
+        FROM
+            (SELECT
+                COUNT(*) AS total_bookings,
+                COUNT(CASE WHEN status='ongoing' THEN 1 END) AS ongoing_rides,
+                COUNT(CASE WHEN status='prebooked' THEN 1 END) AS pre_bookings,
+                COUNT(CASE WHEN payment_status='pending' THEN 1 END) AS payment_pendings,
+                COALESCE(SUM(CASE WHEN status='completed' THEN distance_m END), 0) / 1000.0 AS completed_distance_km
+             FROM (
+                SELECT status, payment_status, distance_m FROM rides
+                UNION ALL
+                SELECT status, payment_status, distance_m FROM rides_archive
+             ) all_rides) r,
+            (SELECT COUNT(*) AS total_drivers, COUNT(CASE WHEN status='busy' THEN 1 END) AS drivers_on_ride FROM drivers) d,
+            (SELECT COUNT(*) AS total_vehicles, COUNT(CASE WHEN status='busy' THEN 1 END) AS vehicles_on_ride FROM cars) c
+    """
+    # From the primary: the cache is refilled right after a write invalidates it, before a replica may have caught up.
+    return execute_query(query, fetch='one', read_only=False)
+
+def get_dashboard_stats():
+    """
+    Returns every dashboard counter from one aggregate query. Every ride
+    counter (bookings, pending payments, completed distance, ...) covers
+    live and archived rides alike, as do count_rides and
+    count_pending_payments. The result is cached for DASHBOARD_STATS_TTL
+    seconds and dropped on ride/driver/car writes.
+    """
+    stats = _dashboard_stats_cache.get_or_load('dashboard_stats', _compute_dashboard_stats)
+    if stats is None:
+        return {
+            "total_customers": 0, "total_drivers": 0, "total_vehicles": 0,
+            "ongoing_rides": 0, "vehicles_on_ride": 0, "drivers_on_ride": 0,
+            "total_bookings": 0, "pre_bookings": 0, "revenue": 0, "payment_pendings": 0,
+            "completed_distance_km": 0
+        }
+    return dict(stats)
+
+def invalidate_dashboard_stats():
+    _dashboard_stats_cache.invalidate('dashboard_stats')
+
 def count_users():
     result = execute_query("SELECT COUNT(*) as count FROM users", fetch='one')
     return result['count'] if result else 0
 
 def count_rides(status=None):
-    query = "SELECT COUNT(*) as count FROM rides"
+    # Live and archived rides in one statement, so a ride being archived is never counted twice or missed.
+    query = "SELECT (SELECT COUNT(*) FROM rides{where}) + (SELECT COUNT(*) FROM rides_archive{where}) as count"
     params = []
     if status:
-        query += " WHERE status = %s"
-        params.append(status)
+        query = query.format(where=" WHERE status = %s")
+        params = [status, status]
+    else:
+        query = query.format(where="")
     result = execute_query(query, params, fetch='one')
     return result['count'] if result else 0
 
@@ -368,37 +1885,455 @@ def count_drivers_on_ride():
     return result['count'] if result else 0
     
 def calculate_revenue():
-    result = execute_query("SELECT SUM(fare) as total FROM rides WHERE payment_status='paid'", fetch='one')
+    # The rollup covers live and archived rides alike.
+    result = execute_query("SELECT SUM(revenue) as total FROM revenue_rollup WHERE period_type='yearly'", fetch='one')
     return result['total'] if result and result['total'] else 0
 
 def count_pending_payments():
-    result = execute_query("SELECT COUNT(*) as count FROM rides WHERE payment_status='pending'", fetch='one')
+    # An unpaid ride stays pending after it is archived.
+    result = execute_query("""
+        SELECT (SELECT COUNT(*) FROM rides WHERE payment_status='pending')
+             + (SELECT COUNT(*) FROM rides_archive WHERE payment_status='pending') as count
+    """, fetch='one')
     return result['count'] if result else 0
 
+# ---- REVENUE ROLLUP ----
+# Paid-ride revenue is pre-aggregated per period bucket in `revenue_rollup`
+# and kept current by every write that changes a ride's fare, payment
+# status or start time, so the trend chart never scans `rides`.
+REVENUE_PERIOD_FORMATS = {
+    'daily': '%Y-%m-%d',
+    'weekly': '%Y-%u',
+    'monthly': '%Y-%m',
+    'yearly': '%Y',
+}
+
+def _apply_revenue_delta(cursor, start_time, fare, sign):
+    """Adds (sign=1) or removes (sign=-1) one paid ride from every period bucket."""
+    if start_time is None or fare is None:
+        return
+    values = []
+    params = []
+    for period_type, label_format in REVENUE_PERIOD_FORMATS.items():
+        values.append("(%s, DATE_FORMAT(%s, %s), %s, %s)")
+        params.extend([period_type, start_time, label_format, sign * fare, sign])
+    cursor.execute(f"""
+        INSERT INTO revenue_rollup (period_type, period_label, revenue, paid_rides)
+        VALUES {", ".join(values)}
+        ON DUPLICATE KEY UPDATE
+            revenue = revenue + VALUES(revenue),
+            paid_rides = paid_rides + VALUES(paid_rides)
+    """, params)
+
+def _fare_value(fare):
+    # A NULL fare stays None: it is left out of the rollup, unlike a fare of 0.
+    return None if fare is None else float(fare)
+
+def update_revenue_rollup(cursor, before, after):
+    """
+    Moves a ride's contribution in the rollup from its `before` state to its
+    `after` state (dicts with fare, payment_status, start_time; None when the
+    ride did not exist / no longer exists). Must run in the same transaction
+    as the ride write.
+    """
+    was_paid = bool(before) and before.get('payment_status') == 'paid'
+    is_paid = bool(after) and after.get('payment_status') == 'paid'
+    if was_paid and is_paid and str(before['start_time']) == str(after['start_time']) \
+            and _fare_value(before['fare']) == _fare_value(after['fare']):
+        return
+    if was_paid:
+        _apply_revenue_delta(cursor, before['start_time'], before['fare'], -1)
+    if is_paid:
+        _apply_revenue_delta(cursor, after['start_time'], after['fare'], 1)
+
+def rebuild_revenue_rollup():
+    """Recomputes the whole rollup from ride history, live and archived (backfill / repair)."""
+    try:
+        with transaction() as cursor:
+            cursor.execute("SHOW TABLES LIKE 'rides_archive'")
+            source = "rides"
+            if cursor.fetchall():
+                source = """(
+                    SELECT fare, payment_status, start_time FROM rides
+                    UNION ALL
+                    SELECT fare, payment_status, start_time FROM rides_archive
+                ) r"""
+            cursor.execute("DELETE FROM revenue_rollup")
+            for period_type, label_format in REVENUE_PERIOD_FORMATS.items():
+                cursor.execute(f"""
+                    INSERT INTO revenue_rollup (period_type, period_label, revenue, paid_rides)
+                    SELECT %s, DATE_FORMAT(start_time, %s), SUM(fare), COUNT(*)
+                    FROM {source} WHERE payment_status='paid' AND start_time IS NOT NULL
+                    GROUP BY 2
+                """, (period_type, label_format))
+            cursor.execute("SELECT COUNT(*) AS count FROM revenue_rollup")
+            return cursor.fetchone()['count']
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (rebuild_revenue_rollup): {err}")
+        return None
+
 def get_revenue_by_period(period='monthly'):
-    if period == 'weekly':
-        label_format = "DATE_FORMAT(start_time, '%Y-%u')"
-    elif period == 'yearly':
-        label_format = "DATE_FORMAT(start_time, '%Y')"
-    else:
-        label_format = "DATE_FORMAT(start_time, '%Y-%m')"
+    period_type = period if period in REVENUE_PERIOD_FORMATS else 'monthly'
+    query = """
+        SELECT period_label, revenue FROM revenue_rollup
+        WHERE period_type = %s AND paid_rides > 0
+        ORDER BY period_label
+    """
+    return execute_query(query, (period_type,), fetch='all')
+    
+# ---- RIDE ARCHIVE ----
+# Completed and cancelled rides older than RIDE_ARCHIVE_AFTER_DAYS are moved
+# from `rides` into `rides_archive`, which is range-partitioned by month of
+# start_time, so the live table (and every hot query on it) stays small.
+# Lookups by id, a customer's recent trips, revenue and exports read both.
+RIDE_COLUMNS = (
+    'id', 'user_phone', 'car_type', 'pickup', 'destination', 'distance', 'duration', 'distance_m', 'duration_s',
+    'fare', 'start_time', 'end_time', 'driver_id', 'car_id', 'payment_status', 'status',
+    'enroute_to_pickup_time', 'at_pickup_time', 'trip_start_time', 'pickup_lat', 'pickup_lng'
+)
+ARCHIVE_PARTITION_PREFIX = 'p'
+
+def _month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _next_month(value):
+    return (value.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def ensure_archive_partitions(oldest, newest):
+    """
+    Splits the catch-all p_future partition of rides_archive so there is one
+    monthly partition per month up to `newest`. Runs DDL, so it must not be
+    called inside a transaction. Returns the names of the partitions added.
+    SQLite has no partitioning, so there it does nothing.
+    """
+    if is_sqlite():
+        return []
+    conn = connect()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("""
+            SELECT partition_name AS name FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = 'rides_archive' AND partition_name IS NOT NULL
+        """)
+        monthly = sorted(row['name'] for row in cursor.fetchall() if row['name'][1:].isdigit())
+        month = _next_month(datetime.strptime(monthly[-1][1:], '%Y%m')) if monthly else _month_start(oldest)
+        added = []
+        while month <= newest:
+            added.append((f"{ARCHIVE_PARTITION_PREFIX}{month:%Y%m}", _next_month(month)))
+            month = _next_month(month)
+        if added:
+            partitions = ", ".join(f"PARTITION {name} VALUES LESS THAN ('{bound:%Y-%m-%d}')" for name, bound in added)
+            cursor.execute(f"""
+                ALTER TABLE rides_archive REORGANIZE PARTITION p_future INTO
+                ({partitions}, PARTITION p_future VALUES LESS THAN (MAXVALUE))
+            """)
+            print(f"  Added archive partitions {added[0][0]}..{added[-1][0]}.")
+        return [name for name, _ in added]
+    finally:
+        cursor.close()
+        conn.close()
+
+def archive_rides(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, pause_seconds=0.0):
+    """
+    Moves finished rides that started more than `older_than_days` ago into
+    rides_archive, `batch_size` rides per transaction (copy, then delete).
+    The revenue rollup is unaffected because archived rides still count.
+    Returns the number of rides moved, or None on error.
+    """
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    status_placeholders = ", ".join(["%s"] * len(ARCHIVE_STATUSES))
+    eligible = f"status IN ({status_placeholders}) AND start_time < %s"
+    params = (*ARCHIVE_STATUSES, cutoff)
+    columns = ", ".join(RIDE_COLUMNS)
+    moved = 0
+    try:
+        bounds = execute_query(f"SELECT MIN(start_time) AS oldest, MAX(start_time) AS newest FROM rides WHERE {eligible}",
+                               params, fetch='one', read_only=False)
+        if not bounds or bounds['oldest'] is None:
+            return 0
+        ensure_archive_partitions(bounds['oldest'], bounds['newest'])
+
+        while True:
+            with transaction() as cursor:
+                cursor.execute(f"SELECT id FROM rides WHERE {eligible} ORDER BY id LIMIT %s FOR UPDATE", (*params, batch_size))
+                ids = [row['id'] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                id_placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"""
+                    INSERT INTO rides_archive ({columns}, archived_at)
+                    SELECT {columns}, NOW() FROM rides WHERE id IN ({id_placeholders})
+                """, ids)
+                cursor.execute(f"DELETE FROM rides WHERE id IN ({id_placeholders})", ids)
+            moved += len(ids)
+            if pause_seconds:
+                # Gives replicas a moment to catch up between batches.
+                time.sleep(pause_seconds)
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (archive_rides): {err}")
+        return None
+    finally:
+        if moved:
+            invalidate_dashboard_stats()
+    return moved
+
+def get_archived_ride_by_id(ride_id):
+    query = """
+        SELECT
+            r.*, u.name AS customer_name, d.name AS driver_name,
+            c.model AS car_model, c.car_number, 1 AS archived
+        FROM rides_archive r
+        LEFT JOIN users u ON r.user_phone = u.phone
+        LEFT JOIN drivers d ON r.driver_id = d.id
+        LEFT JOIN cars c ON r.car_id = c.id
+        WHERE r.id = %s
+    """
+    return execute_query(query, (ride_id,), fetch='one')
+
+def get_archived_rides_by_user_phone(user_phone, status=None, limit=2):
+    query = """
+        SELECT r.*, d.name as driver_name, c.model as car_model, u.name as customer_name, 1 AS archived
+        FROM rides_archive r
+        LEFT JOIN users u ON r.user_phone = u.phone
+        LEFT JOIN drivers d ON r.driver_id = d.id
+        LEFT JOIN cars c ON r.car_id = c.id
+        WHERE r.user_phone = %s
+    """
+    params = [user_phone]
+    if status:
+        query += " AND r.status = %s"
+        params.append(status)
+    query += " ORDER BY r.start_time DESC LIMIT %s"
+    params.append(limit)
+    return execute_query(query, tuple(params), fetch='all') or []
+
+def get_archived_ride_count(status=None):
+    """
+    Archived rides (optionally with one status). Not cached: archival runs in
+    a separate cron process, so a cache here would never be invalidated.
+    """
+    if status and status not in ARCHIVE_STATUSES:
+        return 0
+    query = "SELECT COUNT(*) AS count FROM rides_archive"
+    params = ()
+    if status:
+        query += " WHERE status = %s"
+        params = (status,)
+    result = execute_query(query, params, fetch='one')
+    return result['count'] if result else 0
+
+# ---- LOCATION HISTORY ----
+# Every location flush also appends the flushed positions (one per driver
+# that moved) to driver_location_history, which is range-partitioned by
+# day of recorded_at. Retention drops whole partitions older than
+# LOCATION_HISTORY_RETENTION_DAYS instead of deleting rows. History is
+# best-effort: a failed append is counted and skipped, never retried, so
+# it cannot hold up the live positions in `drivers`.
+LOCATION_HISTORY_PARTITION_PREFIX = 'd'
+_location_history_stats = {"history_rows": 0, "history_errors": 0}
+
+def _append_location_history(batch):
+    rows = [
+        (driver_id, datetime.fromtimestamp(recorded_at).replace(microsecond=0) if recorded_at else datetime.now().replace(microsecond=0), lat, lng)
+        for driver_id, lat, lng, recorded_at in batch
+    ]
+    try:
+        with transaction() as cursor:
+            for start in range(0, len(rows), _LOCATION_FLUSH_CHUNK):
+                chunk = rows[start:start + _LOCATION_FLUSH_CHUNK]
+                cursor.execute(f"""
+                    INSERT IGNORE INTO driver_location_history (driver_id, recorded_at, latitude, longitude)
+                    VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))}
+                """, [value for row in chunk for value in row])
+    except mysql.connector.Error as err:
+        _location_history_stats["history_errors"] += 1
+        print(f"MySQL Transaction Error (location history): {err}")
+        return
+    _location_history_stats["history_rows"] += len(rows)
+
+def maintain_location_history(retention_days=LOCATION_HISTORY_RETENTION_DAYS, days_ahead=LOCATION_HISTORY_DAYS_AHEAD):
+    """
+    Adds daily partitions to driver_location_history up to `days_ahead`
+    days from now and drops those wholly older than `retention_days`. On
+    SQLite (no partitions) old rows are deleted instead. Runs DDL, so it
+    must not be called inside a transaction. Returns {"added", "dropped",
+    "deleted"}, or None on error.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    cutoff = today - timedelta(days=retention_days)
+    if is_sqlite():
+        deleted = execute_query("DELETE FROM driver_location_history WHERE recorded_at < %s", (cutoff,), commit=True)
+        return None if deleted is None else {"added": [], "dropped": [], "deleted": deleted}
+
+    conn = connect()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute("""
+            SELECT partition_name AS name FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = 'driver_location_history' AND partition_name IS NOT NULL
+        """)
+        daily = sorted(row['name'] for row in cursor.fetchall() if row['name'][1:].isdigit())
+        # A partition is named after its day and holds rows before the next day;
+        # the first one also holds anything older.
+        day = datetime.strptime(daily[-1][1:], '%Y%m%d') + timedelta(days=1) if daily else cutoff
+        added = []
+        while day <= today + timedelta(days=days_ahead):
+            added.append(f"{LOCATION_HISTORY_PARTITION_PREFIX}{day:%Y%m%d}")
+            day += timedelta(days=1)
+        if added:
+            partitions = ", ".join(
+                f"PARTITION {name} VALUES LESS THAN ('{datetime.strptime(name[1:], '%Y%m%d') + timedelta(days=1):%Y-%m-%d}')"
+                for name in added
+            )
+            cursor.execute(f"""
+                ALTER TABLE driver_location_history REORGANIZE PARTITION p_future INTO
+                ({partitions}, PARTITION p_future VALUES LESS THAN (MAXVALUE))
+            """)
+        expired = [name for name in daily + added if datetime.strptime(name[1:], '%Y%m%d') + timedelta(days=1) <= cutoff]
+        if expired:
+            cursor.execute(f"ALTER TABLE driver_location_history DROP PARTITION {', '.join(expired)}")
+        if added or expired:
+            print(f"🗂️ Location history partitions: added {len(added)}, dropped {len(expired)}.")
+        return {"added": added, "dropped": expired, "deleted": None}
+    except mysql.connector.Error as err:
+        print(f"MySQL Error (maintain_location_history): {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_driver_track(driver_id, minutes=ETA_TRACK_MINUTES):
+    """
+    The driver's positions over the last `minutes` as (epoch seconds, lat,
+    lng) in time order, ending with their newest unflushed ping if this
+    process has one.
+    """
+    since = datetime.now() - timedelta(minutes=minutes)
+    rows = execute_query("""
+        SELECT recorded_at, latitude, longitude FROM driver_location_history
+        WHERE driver_id = %s AND recorded_at >= %s ORDER BY recorded_at
+    """, (driver_id, since), fetch='all') or []
+    track = [(row['recorded_at'].timestamp(), float(row['latitude']), float(row['longitude'])) for row in rows]
+    latest = _driver_locations.position(int(driver_id))
+    if latest is not None and (not track or latest[2] > track[-1][0]):
+        track.append((latest[2], latest[0], latest[1]))
+    return track
+
+def get_driver_eta(driver_id, pickup_lat, pickup_lng):
+    """
+    The driver's ETA to the pickup from their recent track (see
+    utils.eta.estimate_eta), falling back to their last stored position at
+    a default speed. None when the driver or the pickup has no position.
+    """
+    track = get_driver_track(driver_id)
+    if not track:
+        driver = get_driver_by_id(driver_id)
+        if not driver or driver['last_latitude'] is None or driver['last_longitude'] is None:
+            return None
+        track = [(time.time(), float(driver['last_latitude']), float(driver['last_longitude']))]
+    return estimate_eta(track, pickup_lat, pickup_lng)
+
+# ---- EXPORT ----
+EXPORT_FETCH_SIZE = 500
+RIDE_EXPORT_COLUMNS = [
+    'ride_id', 'start_time', 'end_time', 'status', 'user_phone', 'customer_name', 'customer_email',
+    'pickup', 'destination', 'distance', 'duration', 'distance_m', 'duration_s', 'car_type', 'driver_id', 'car_id',
+    'fare', 'payment_status'
+]
+
+def _stream_rows(query, params, fetch_size, record_name):
+    conn = connect(read_only=True)
+    cursor = conn.cursor()
+    finished = False
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from to_records(cursor.column_names, rows, record_name)
+        finished = True
+    finally:
+        if finished:
+            cursor.close()
+            conn.close()
+        else:
+            # Unread rows are still on the socket; don't hand it back to the pool.
+            conn.invalidate()
+
+def iter_ride_export_rows(status=None, start_from=None, start_to=None, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Yields rides joined with customer and payment details through an
+    unbuffered server-side cursor, `fetch_size` rows at a time, so memory
+    stays flat however large the export is. Live and archived rides are
+    read in one UNION ALL statement, in id order, so a consistent snapshot
+    is exported even while the archival cron moves rides between them.
+    """
+    conditions, params = [], []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if start_from:
+        conditions.append("start_time >= %s")
+        params.append(start_from)
+    if start_to:
+        conditions.append("start_time < %s")
+        params.append(start_to)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    columns = ("id, start_time, end_time, status, user_phone, pickup, destination, distance, duration, "
+               "distance_m, duration_s, car_type, driver_id, car_id, fare, payment_status")
 
     query = f"""
-        SELECT {label_format} AS period_label, SUM(fare) AS revenue
-        FROM rides WHERE payment_status='paid' AND start_time IS NOT NULL
-        GROUP BY period_label ORDER BY period_label
+        SELECT
+            r.id AS ride_id, r.start_time, r.end_time, r.status, r.user_phone,
+            u.name AS customer_name, u.email AS customer_email,
+            r.pickup, r.destination, r.distance, r.duration, r.distance_m, r.duration_s, r.car_type,
+            r.driver_id, r.car_id, r.fare, r.payment_status
+        FROM (
+            SELECT {columns} FROM rides_archive{where}
+            UNION ALL
+            SELECT {columns} FROM rides{where}
+        ) r
+        LEFT JOIN users u ON r.user_phone = u.phone
+        ORDER BY r.id
     """
-    return execute_query(query, fetch='all')
-    
+    yield from _stream_rows(query, tuple(params) * 2, fetch_size, 'RideExportRow')
+
 # ---- SETTINGS & CONTENT ----
+# Settings and site content are read on hot paths (every booking, every
+# assignment loop, the public site) but change rarely. Values are cached
+# per process, dropped on write, and expire after SETTINGS_CACHE_TTL so
+# other gunicorn workers pick up changes.
+SETTING_TYPES = {
+    'auto_assignment_enabled': bool,
+    'assignment_mode': str,
+}
+
+_settings_cache = TTLCache(SETTINGS_CACHE_TTL_SECONDS)
+_site_content_cache = TTLCache(SETTINGS_CACHE_TTL_SECONDS)
+
+def _parse_setting(key, raw):
+    setting_type = SETTING_TYPES.get(key)
+    if setting_type is bool or (setting_type is None and raw.lower() in ['true', 'false']):
+        return raw.lower() in ['true', '1', 'yes', 'on']
+    if setting_type in (int, float):
+        try:
+            return setting_type(raw)
+        except ValueError:
+            return None
+    return raw
+
+def _load_setting(key):
+    # fetch='all' tells a missing row ([]) apart from a failed query (None),
+    # so missing keys are cached too and failures are not.
+    rows = execute_query("SELECT value FROM settings WHERE `key_name`=%s", (key,), fetch='all', read_only=False)
+    if rows is None:
+        return None
+    return (_parse_setting(key, rows[0]['value']) if rows else None,)
+
 def get_setting(key):
-    result = execute_query("SELECT value FROM settings WHERE `key_name`=%s", (key,), fetch='one')
-    if result:
-        val = result['value']
-        if val.lower() in ['true', 'false']:
-            return val.lower() == 'true'
-        return val
-    return None
+    cached = _settings_cache.get_or_load(key, lambda: _load_setting(key))
+    return cached[0] if cached else None
 
 def set_setting(key, value):
     if isinstance(value, bool):
@@ -408,11 +2343,19 @@ def set_setting(key, value):
         VALUES (%s, %s)
         ON DUPLICATE KEY UPDATE value = VALUES(value)
     """
-    return execute_query(query, (key, value), commit=True)
+    result = execute_query(query, (key, value), commit=True)
+    _settings_cache.invalidate(key)
+    return result
+
+def _load_site_content(key):
+    rows = execute_query("SELECT value FROM site_content WHERE key_name=%s", (key,), fetch='all', read_only=False)
+    if rows is None:
+        return None
+    return rows[0]['value'] if rows else ""
 
 def get_site_content(key):
-    result = execute_query("SELECT value FROM site_content WHERE key_name=%s", (key,), fetch='one')
-    return result['value'] if result else ""
+    content = _site_content_cache.get_or_load(key, lambda: _load_site_content(key))
+    return content if content is not None else ""
 
 def set_site_content(key, value):
     query = """
@@ -420,50 +2363,78 @@ def set_site_content(key, value):
         VALUES (%s, %s)
         ON DUPLICATE KEY UPDATE value = VALUES(value)
     """
-    return execute_query(query, (key, value), commit=True)
+    result = execute_query(query, (key, value), commit=True)
+    _site_content_cache.invalidate(key)
+    return result
+
+def get_cache_stats():
+    return {
+        "dashboard_stats": _dashboard_stats_cache.stats(),
+        "settings": _settings_cache.stats(),
+        "site_content": _site_content_cache.stats(),
+        "owner_phones": _owner_phones_cache.stats(),
+        "chat_sessions": _chat_sessions.stats(),
+    }
 
 # ---- CHAT SESSION ----
-def get_chat_session(phone):
-    return execute_query("SELECT * FROM chat_sessions WHERE phone=%s", (phone,), fetch='one')
+# The webhook reads the session on every inbound message and saves it at the
+# end, and send_message reads it again for the 24h free-form check. Sessions
+# are kept in a per-process write-back cache: saves that change `state` are
+# written at once, other changes are batched every CHAT_SESSION_FLUSH_INTERVAL
+# seconds, and only the changed columns are written. With several worker
+# processes, route each phone to one worker or set CHAT_SESSION_CACHE=0.
+CHAT_SESSION_COLUMNS = (
+    'state', 'new_user_name', 'new_user_email', 'booking_date', 'pickup', 'destination',
+    'car_type', 'route_distance', 'route_duration', 'fare', 'ride_status', 'start_time',
+    'end_time', 'ride_id', 'upi_string', 'invoice_total', 'otp', 'otp_timestamp', 'last_interaction',
+    'pickup_lat', 'pickup_lng'
+)
+
+def _load_chat_session(phone):
+    return execute_query("SELECT * FROM chat_sessions WHERE phone=%s", (phone,), fetch='one', read_only=False)
+
+def _write_chat_sessions(changes):
+    """Upserts (phone, {column: value}) changes, one executemany per distinct column set. Raises on failure."""
+    groups = {}
+    for phone, changed in changes:
+        groups.setdefault(tuple(changed), []).append((phone, *changed.values()))
+    with transaction() as cursor:
+        for columns, rows in groups.items():
+            cursor.executemany(f"""
+                INSERT INTO chat_sessions (phone, {', '.join(columns)})
+                VALUES ({', '.join(['%s'] * (len(columns) + 1))})
+                ON DUPLICATE KEY UPDATE {', '.join(f'{column}=VALUES({column})' for column in columns)}
+            """, rows)
+
+_chat_sessions = WriteBackSessionStore(
+    _load_chat_session, _write_chat_sessions, CHAT_SESSION_COLUMNS,
+    capacity=CHAT_SESSION_CACHE_SIZE, ttl=CHAT_SESSION_TTL_SECONDS, flush_interval=CHAT_SESSION_FLUSH_SECONDS
+)
+atexit.register(_chat_sessions.flush)
 
+def get_chat_session(phone):
+    if not CHAT_SESSION_CACHE_ENABLED:
+        return _load_chat_session(phone)
+    return _chat_sessions.get(phone)
 
 def save_chat_session(phone, data):
-    query = """
-        INSERT INTO chat_sessions (
-            phone, state, new_user_name, new_user_email, booking_date, pickup, destination, 
-            car_type, route_distance, route_duration, fare, ride_status, start_time, 
-            end_time, ride_id, upi_string, invoice_total, otp, otp_timestamp
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            state=VALUES(state),
-            new_user_name=VALUES(new_user_name),
-            new_user_email=VALUES(new_user_email),
-            booking_date=VALUES(booking_date),
-            pickup=VALUES(pickup),
-            destination=VALUES(destination),
-            car_type=VALUES(car_type),
-            route_distance=VALUES(route_distance),
-            route_duration=VALUES(route_duration),
-            fare=VALUES(fare),
-            ride_status=VALUES(ride_status),
-            start_time=VALUES(start_time),
-            end_time=VALUES(end_time),
-            ride_id=VALUES(ride_id),
-            upi_string=VALUES(upi_string),
-            invoice_total=VALUES(invoice_total),
-            otp=VALUES(otp),
-            otp_timestamp=VALUES(otp_timestamp);
-    """
-    params = (
-        phone, data.get("state"), data.get("new_user_name"), data.get("new_user_email"),
-        data.get("booking_date"), data.get("pickup"), data.get("destination"), 
-        data.get("car_type"), data.get("route_distance"), data.get("route_duration"), 
-        data.get("fare"), data.get("ride_status"), data.get("start_time"), 
-        data.get("end_time"), data.get("ride_id"), data.get("upi_string"), 
-        data.get("invoice_total"), data.get("otp"), data.get("otp_timestamp")
-    )
-    return execute_query(query, params, commit=True)
+    if not CHAT_SESSION_CACHE_ENABLED:
+        try:
+            _write_chat_sessions([(phone, {column: data.get(column) for column in CHAT_SESSION_COLUMNS})])
+        except mysql.connector.Error as err:
+            print(f"MySQL Transaction Error (save_chat_session): {err}")
+            return None
+        return True
+    return _chat_sessions.save(phone, data)
+
+def touch_chat_session(phone):
+    """Records an inbound message from `phone`, which opens WhatsApp's 24h free-form reply window."""
+    session = get_chat_session(phone) or {}
+    session['last_interaction'] = datetime.utcnow()
+    save_chat_session(phone, session)
+
+def flush_chat_sessions():
+    _chat_sessions.flush()
 
 # ---- PLACEHOLDERS ----
 def get_all_locations():
@@ -504,16 +2475,67 @@ def delete_pricing(pricing_id):
     return execute_query("DELETE FROM pricing WHERE id=%s", (pricing_id,), commit=True)
 
 def manually_assign_driver(driver_id, car_id, ride_id):
-    """Assigns a driver and car to a ride, checking for fixed-driver constraints."""
-    driver = execute_query("SELECT is_fixed, car_id FROM drivers WHERE id = %s", (driver_id,), fetch='one')
-
-    if driver and driver.get("is_fixed") and driver.get("car_id") is not None and driver.get("car_id") != int(car_id):
-        return {"error": "This driver is permanently assigned to another car."}
+    """
+    Assigns a driver and car to a ride, checking for fixed-driver
+    constraints and overlapping bookings. A driver or car the ride already
+    has is kept without a new claim; one it gives up is freed in the same
+    transaction. Both are only marked busy once the ride is due.
+    """
+    driver_id, car_id, ride_id = int(driver_id), int(car_id), int(ride_id)
+    current = execute_query("SELECT driver_id, car_id FROM rides WHERE id = %s", (ride_id,), fetch='one', read_only=False)
+    if not current:
+        return {"error": "Ride not found."}
+    old_driver = current['driver_id'] if current['driver_id'] != driver_id else None
+    old_car = current['car_id'] if current['car_id'] != car_id else None
+    try:
+        with transaction() as cursor:
+            # Drivers, then cars, then the ride: the lock order of every other claim path.
+            locked = {}
+            for table, ids in (('drivers', (driver_id, old_driver)), ('cars', (car_id, old_car))):
+                for row_id in sorted(row_id for row_id in ids if row_id):
+                    cursor.execute(f"SELECT * FROM {table} WHERE id = %s FOR UPDATE", (row_id,))
+                    locked[table, row_id] = cursor.fetchone()
+            cursor.execute("SELECT driver_id, car_id, start_time, end_time, duration_s FROM rides WHERE id = %s FOR UPDATE", (ride_id,))
+            ride = cursor.fetchone()
+            if not ride:
+                return {"error": "Ride not found."}
+            if (ride['driver_id'], ride['car_id']) != (current['driver_id'], current['car_id']):
+                raise ClaimLost('ride', ride_id)
+
+            driver = locked['drivers', driver_id]
+            if driver and driver.get("is_fixed") and driver.get("car_id") is not None and driver.get("car_id") != car_id:
+                return {"error": "This driver is permanently assigned to another car."}
+
+            window = booking_window(ride['start_time'], ride['end_time'], ride['duration_s'])
+            held = tuple(kind for kind, row_id in (('driver', driver_id), ('car', car_id)) if row_id == ride[f'{kind}_id'])
+            take_now = window is None or window[0] <= datetime.now()
+            claim_driver_and_car(cursor, ride_id, driver_id, car_id, window, take_now=take_now, held=held)
+            cursor.execute("UPDATE rides SET driver_id = %s, car_id = %s, status = 'assigned' WHERE id = %s", (driver_id, car_id, ride_id))
+            cursor.execute("UPDATE drivers SET car_id = %s WHERE id = %s", (car_id, driver_id))
+            # Whatever the ride gave up goes back to free, unless another ride under way still holds it.
+            for table, column, row_id in (('drivers', 'driver_id', old_driver), ('cars', 'car_id', old_car)):
+                if row_id:
+                    cursor.execute(f"""
+                        UPDATE {table} SET status = 'free' WHERE id = %s AND NOT EXISTS (
+                            SELECT 1 FROM rides WHERE {column} = %s AND id <> %s
+                            AND status IN ('ongoing', 'assigned') AND start_time <= NOW()
+                        )
+                    """, (row_id, row_id, ride_id))
+    except ClaimLost as lost:
+        _count_claim("conflicts")
+        if lost.kind == 'ride':
+            return {"error": "The ride was reassigned meanwhile; reload it and try again."}
+        if lost.booked_ride:
+            return {"error": f"The {lost.kind} is already booked around that time (ride {lost.booked_ride})."}
+        return {"error": f"The {lost.kind} is no longer free; pick another one."}
+    except mysql.connector.Error as err:
+        print(f"MySQL Transaction Error (manually_assign_driver): {err}")
+        return {"error": "Could not assign the driver. Please try again."}
 
-    execute_query("UPDATE rides SET driver_id = %s, car_id = %s, status = 'assigned' WHERE id = %s", (driver_id, car_id, ride_id), commit=True)
-    execute_query("UPDATE drivers SET status = 'busy', car_id = %s WHERE id = %s", (car_id, driver_id), commit=True)
-    execute_query("UPDATE cars SET status = 'busy' WHERE id = %s", (car_id,), commit=True)
-    
+    _count_claim("claims")
+    invalidate_dashboard_stats()
+    refresh_dispatch_drivers(driver_id, old_driver)
+    refresh_ride_reservations(ride_id)
     return {"success": True}
 
 def get_available_cars_by_type(car_type):
@@ -1,20 +1,17 @@
 import mysql.connector
 from werkzeug.security import generate_password_hash
+from db import connect, DB_BACKEND
 
-db_config = {
-    'host': '34.72.197.29',
-    'user': 'Deepak',
-    'password': 'Deep@k80',
-    'database': 'cab_booking_db'
-}
-
+# Uses the same backend as the app: MySQL by default, or the embedded
+# SQLite file with DB_BACKEND=sqlite.
 try:
-    conn = mysql.connector.connect(**db_config)
+    conn = connect()
     cursor = conn.cursor()
-    print("✅ Successfully connected to MySQL database.")
+    print(f"✅ Successfully connected to the {DB_BACKEND} database.")
     tables_to_drop = [
         'rides', 'chat_sessions', 'drivers', 'users', 'owners',
-        'cars', 'coupons', 'settings', 'site_content','locations','pricing'
+        'cars', 'coupons', 'settings', 'site_content','locations','pricing',
+        'schema_migrations', 'revenue_rollup', 'rides_archive', 'driver_location_history'
     ]
     for table in tables_to_drop:
         cursor.execute(f"DROP TABLE IF EXISTS {table}")
@@ -238,11 +235,15 @@ try:
 
     conn.commit()
 
+    # Bring the fresh schema up to the latest version (indexes etc.).
+    from migrations import apply_migrations
+    apply_migrations()
+
 except mysql.connector.Error as err:
-    print(f"❌ MySQL Error: {err}")
+    print(f"❌ Database Error: {err}")
 
 finally:
     if 'conn' in locals() and conn.is_connected():
         cursor.close()
         conn.close()
-        print("✅ Database initialized and MySQL connection closed.")
\ No newline at end of file
+        print("✅ Database initialized and connection closed.")
\ No newline at end of file
@@ -0,0 +1,315 @@
+"""
+Maintenance commands for the cab booking database.
+
+    python manage.py migrate            # apply pending schema migrations
+    python manage.py migration-status   # list migrations and when they ran
+    python manage.py check-indexes      # EXPLAIN hot queries, report index usage
+    python manage.py backfill-revenue   # rebuild the revenue rollup from ride history
+    python manage.py bench-rows         # compare dict rows and records on the ride listing
+    python manage.py archive-rides      # move old finished rides into rides_archive
+    python manage.py prune-locations    # add/drop driver location history partitions
+    python manage.py bench              # seed random data, run a mixed read/write workload
+    python manage.py stress-claims      # race concurrent bookings, check no driver or car is double-booked
+
+For a throwaway benchmark database use the embedded backend:
+DB_BACKEND=sqlite python init_db.py && DB_BACKEND=sqlite python manage.py bench
+"""
+import argparse
+import sys
+
+
+def cmd_migrate(args):
+    from migrations import apply_migrations
+    apply_migrations()
+
+def cmd_migration_status(args):
+    from migrations import migration_status
+    for version, description, applied_at in migration_status():
+        state = f"applied {applied_at}" if applied_at else "pending"
+        print(f"{version:04d}  {state:<30} {description}")
+
+def cmd_check_indexes(args):
+    from migrations import check_index_usage
+    results = check_index_usage()
+    for result in results:
+        mark = "✅" if result['ok'] else "❌"
+        print(f"{mark} {result['query']:<40} key={result['key']} expected={','.join(result['expected'])}")
+    return 0 if all(result['ok'] for result in results) else 1
+
+def cmd_backfill_revenue(args):
+    from db import rebuild_revenue_rollup
+    buckets = rebuild_revenue_rollup()
+    if buckets is None:
+        print("❌ Revenue backfill failed.")
+        return 1
+    print(f"✅ Revenue rollup rebuilt ({buckets} buckets).")
+
+def cmd_archive_rides(args):
+    from db import archive_rides, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+    days = args.days if args.days is not None else ARCHIVE_AFTER_DAYS
+    moved = archive_rides(days, args.batch_size or ARCHIVE_BATCH_SIZE, args.pause)
+    if moved is None:
+        print("❌ Ride archival failed.")
+        return 1
+    print(f"✅ Archived {moved} ride(s) older than {days} days.")
+
+def cmd_prune_locations(args):
+    from db import maintain_location_history, LOCATION_HISTORY_RETENTION_DAYS
+    days = args.days if args.days is not None else LOCATION_HISTORY_RETENTION_DAYS
+    result = maintain_location_history(days)
+    if result is None:
+        print("❌ Location history maintenance failed.")
+        return 1
+    if result["deleted"] is not None:
+        print(f"✅ Deleted {result['deleted']} location points older than {days} days.")
+    else:
+        print(f"✅ Added {len(result['added'])} and dropped {len(result['dropped'])} daily partitions (keeping {days} days).")
+
+def cmd_bench_rows(args):
+    import time
+    import tracemalloc
+    from db import get_all_rides
+    for label, records in (("dict cursor", False), ("records", True)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        rows = get_all_rides(records=records)
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if rows is None:
+            print("❌ Could not load rides.")
+            return 1
+        per_row = current / len(rows) if rows else 0
+        print(f"{label:<12} {len(rows)} rows  held {current / 1024:.0f} KiB ({per_row:.0f} B/row)  "
+              f"peak {peak / 1024:.0f} KiB  {elapsed * 1000:.0f} ms")
+        del rows
+
+
+# Relative weights of the operations in the bench workload.
+BENCH_MIX = {
+    'book_ride': 10,
+    'pay_ride': 10,
+    'ride_by_id': 25,
+    'customer_history': 20,
+    'ride_listing': 15,
+    'dashboard': 5,
+    'chat_session': 15,
+}
+
+def _bench_seed(rng, tag, customers, drivers, rides):
+    """Inserts random customers, cars, drivers and finished rides. Returns (phones, ride ids)."""
+    from datetime import datetime, timedelta
+    from db import bulk_insert, execute_query
+    phones = [f"8{tag}{i:06d}" for i in range(customers)]
+    bulk_insert('users', [(i, (phone, f"Bench {i}", f"bench{tag}.{i}@example.com", "-")) for i, phone in enumerate(phones)])
+    bulk_insert('cars', [(i, (f"BN{tag}{i:04d}", "Bench car", rng.choice(('sedan', 'suv', 'compact')), 12, 'free'))
+                         for i in range(drivers)])
+    bulk_insert('drivers', [(i, (f"Driver {i}", f"7{tag}{i:06d}", None, 'free')) for i in range(drivers)])
+    now = datetime.now().replace(microsecond=0)
+    rows = []
+    for _ in range(rides):
+        km = rng.randint(2, 40)
+        start = now - timedelta(minutes=rng.randint(0, 60 * 24 * 60))
+        rows.append((rng.choice(phones), 'sedan', 'Bench pickup', 'Bench drop', f"{km} km", f"{km * 3} mins",
+                     km * 1000, km * 180, km * 12, start, start + timedelta(minutes=km * 3), 'pending', 'completed'))
+    execute_query("""
+        INSERT INTO rides (user_phone, car_type, pickup, destination, distance, duration, distance_m, duration_s,
+                           fare, start_time, end_time, payment_status, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, rows, many=True, commit=True)
+    found = execute_query("SELECT id FROM rides WHERE user_phone LIKE %s", (f"8{tag}%",), fetch='all') or []
+    return phones, [row['id'] for row in found]
+
+def _bench_operations(rng, phones, ride_ids):
+    import db
+    from datetime import datetime
+
+    def book_ride():
+        ride_id = db.add_ride(rng.choice(phones), 'Bench pickup', 'Bench drop', '12 km', '30 mins', 144, None, None,
+                              'prebooked', 'pending', datetime.now().replace(microsecond=0), None, 'sedan')
+        if ride_id:
+            ride_ids.append(ride_id)
+
+    def chat_session():
+        phone = rng.choice(phones)
+        session = db.get_chat_session(phone) or {}
+        session['state'] = rng.choice(('awaiting_intent', 'awaiting_pickup', 'awaiting_drop'))
+        db.save_chat_session(phone, session)
+
+    return {
+        'book_ride': book_ride,
+        'pay_ride': lambda: db.update_payment_status(rng.choice(ride_ids), rng.choice(('paid', 'pending'))),
+        'ride_by_id': lambda: db.get_ride_by_id(rng.choice(ride_ids)),
+        'customer_history': lambda: db.get_rides_by_user_phone(rng.choice(phones)),
+        'ride_listing': lambda: db.list_rides(limit=50, records=True),
+        'dashboard': db._compute_dashboard_stats,
+        'chat_session': chat_session,
+    }
+
+def cmd_bench(args):
+    import random
+    import threading
+    import time
+    import db
+    if db.DB_BACKEND != 'sqlite' and not args.allow_mysql:
+        print("❌ bench writes random rows. Run it with DB_BACKEND=sqlite, or pass --allow-mysql for a scratch MySQL database.")
+        return 1
+
+    rng = random.Random(args.seed)
+    tag = f"{rng.randint(0, 99999):05d}"
+    started = time.perf_counter()
+    phones, ride_ids = _bench_seed(rng, tag, args.customers, args.drivers, args.rides)
+    if not ride_ids:
+        print("❌ Seeding failed; is the schema in place (python init_db.py)?")
+        return 1
+    print(f"Seeded {len(phones)} customers, {args.drivers} drivers/cars, {len(ride_ids)} rides "
+          f"on {db.DB_BACKEND} in {time.perf_counter() - started:.1f}s.")
+
+    names, weights = list(BENCH_MIX), list(BENCH_MIX.values())
+    timings = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(seed):
+        worker_rng = random.Random(seed)
+        operations = _bench_operations(worker_rng, phones, ride_ids)
+        while time.perf_counter() < deadline:
+            name = worker_rng.choices(names, weights)[0]
+            op_started = time.perf_counter()
+            failed = False
+            try:
+                operations[name]()
+            except Exception as e:
+                print(f"⚠️ {name}: {e}")
+                failed = True
+            elapsed_ms = (time.perf_counter() - op_started) * 1000
+            with lock:
+                timings[name].append(elapsed_ms)
+                errors[name] += failed
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.flush_chat_sessions()
+
+    def percentile(values, fraction):
+        return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+    total = sum(len(values) for values in timings.values())
+    print(f"{total} operations in {args.duration:.0f}s with {args.threads} thread(s): {total / args.duration:.0f} ops/s")
+    print(f"{'operation':<18} {'ops':>7} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for name in names:
+        values = sorted(timings[name])
+        print(f"{name:<18} {len(values):>7} {len(values) / args.duration:>8.0f} "
+              f"{percentile(values, 0.5):>8.2f} {percentile(values, 0.95):>8.2f} {errors[name]:>7}")
+
+def cmd_stress_claims(args):
+    import random
+    import threading
+    import time
+    from datetime import datetime, timedelta
+    import db
+    if db.DB_BACKEND != 'sqlite' and not args.allow_mysql:
+        print("❌ stress-claims writes random rows. Run it with DB_BACKEND=sqlite, or pass --allow-mysql for a scratch MySQL database.")
+        return 1
+
+    rng = random.Random(args.seed)
+    tag = f"{rng.randint(0, 99999):05d}"
+    car_type = f"stress{tag}"
+    db.bulk_insert('cars', [(i, (f"SC{tag}{i:04d}", "Stress car", car_type, 4, 'free')) for i in range(args.drivers)])
+    db.bulk_insert('drivers', [(i, (f"Stress driver {i}", f"6{tag}{i:06d}", None, 'free')) for i in range(args.drivers)])
+    phone = f"5{tag}000000"
+    print(f"Seeded {args.drivers} drivers and {args.drivers} '{car_type}' cars; "
+          f"{args.threads} threads racing for {args.bookings} immediate bookings.")
+
+    outcomes = {"booked": 0, "no_driver": 0}
+    lock = threading.Lock()
+    remaining = iter(range(args.bookings))
+    gate = threading.Barrier(args.threads)
+
+    def worker():
+        gate.wait()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = datetime.now().replace(microsecond=0)
+            ride_id, _, _ = db.add_ride_with_available_driver(
+                start + timedelta(minutes=60), status='ongoing', user_phone=phone, pickup='Stress pickup',
+                destination='Stress drop', distance='5 km', duration='15 mins', fare=100, payment_status='pending',
+                start_time=start, end_time=None, car_type=car_type)
+            with lock:
+                outcomes["booked" if ride_id else "no_driver"] += 1
+
+    stats_before = db.get_claim_stats()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stats = {key: value - stats_before[key] for key, value in db.get_claim_stats().items()}
+
+    rides = db.execute_query("SELECT driver_id, car_id FROM rides WHERE user_phone = %s AND status = 'ongoing'",
+                             (phone,), fetch='all', read_only=False) or []
+    driver_ids = [ride['driver_id'] for ride in rides]
+    car_ids = [ride['car_id'] for ride in rides]
+    double_drivers = len(driver_ids) - len(set(driver_ids))
+    double_cars = len(car_ids) - len(set(car_ids))
+    busy_cars = db.execute_query("SELECT COUNT(*) AS n FROM cars WHERE type = %s AND status = 'busy'",
+                                 (car_type,), fetch='one', read_only=False)['n']
+
+    print(f"{args.bookings} booking attempts in {elapsed:.2f}s: {args.bookings / elapsed:.0f} attempts/s")
+    print(f"  booked {outcomes['booked']}, no driver left {outcomes['no_driver']}, "
+          f"lost claims retried {stats['conflicts']}, retries exhausted {stats['exhausted']}")
+    print(f"  rides per driver > 1: {double_drivers}, rides per car > 1: {double_cars}, "
+          f"busy cars {busy_cars} for {len(rides)} rides")
+    ok = not double_drivers and not double_cars and busy_cars == len(rides) == outcomes["booked"]
+    print("✅ No driver or car was booked twice." if ok else "❌ Double booking detected.")
+    return 0 if ok else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dhanvanth Travels database maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("migrate", help="Apply pending schema migrations").set_defaults(func=cmd_migrate)
+    subparsers.add_parser("migration-status", help="Show applied and pending migrations").set_defaults(func=cmd_migration_status)
+    subparsers.add_parser("check-indexes", help="Check that hot queries use their indexes").set_defaults(func=cmd_check_indexes)
+    subparsers.add_parser("backfill-revenue", help="Rebuild the revenue rollup from ride history").set_defaults(func=cmd_backfill_revenue)
+    archive = subparsers.add_parser("archive-rides", help="Move finished rides older than --days into rides_archive")
+    archive.add_argument("--days", type=int, default=None, help="Archive rides that started more than this many days ago (default RIDE_ARCHIVE_AFTER_DAYS)")
+    archive.add_argument("--batch-size", type=int, default=None, help="Rides moved per transaction")
+    archive.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    archive.set_defaults(func=cmd_archive_rides)
+    prune = subparsers.add_parser("prune-locations", help="Add upcoming and drop expired driver location history partitions")
+    prune.add_argument("--days", type=int, default=None, help="Days of history to keep (default LOCATION_HISTORY_RETENTION_DAYS)")
+    prune.set_defaults(func=cmd_prune_locations)
+    subparsers.add_parser("bench-rows", help="Compare memory of dict rows and records on the ride listing").set_defaults(func=cmd_bench_rows)
+    bench = subparsers.add_parser("bench", help="Seed random data and run a mixed read/write workload")
+    bench.add_argument("--customers", type=int, default=500, help="Customers to seed")
+    bench.add_argument("--drivers", type=int, default=50, help="Drivers (and cars) to seed")
+    bench.add_argument("--rides", type=int, default=20000, help="Finished rides to seed")
+    bench.add_argument("--threads", type=int, default=4, help="Concurrent workers")
+    bench.add_argument("--duration", type=float, default=10.0, help="Seconds to run the workload")
+    bench.add_argument("--seed", type=int, default=42, help="Random seed")
+    bench.add_argument("--allow-mysql", action="store_true", help="Allow running against MySQL (writes random rows)")
+    bench.set_defaults(func=cmd_bench)
+    stress = subparsers.add_parser("stress-claims", help="Race concurrent bookings for too few drivers and check none is double-booked")
+    stress.add_argument("--drivers", type=int, default=20, help="Drivers (and cars) to seed")
+    stress.add_argument("--bookings", type=int, default=60, help="Immediate bookings to attempt")
+    stress.add_argument("--threads", type=int, default=8, help="Concurrent workers")
+    stress.add_argument("--seed", type=int, default=7, help="Random seed")
+    stress.add_argument("--allow-mysql", action="store_true", help="Allow running against MySQL (writes random rows)")
+    stress.set_defaults(func=cmd_stress_claims)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Forward-only schema migrations.
+
+Each migration is a (version, description, function) entry in MIGRATIONS.
+The function receives a dictionary cursor on an autocommit connection.
+Applied versions are recorded in `schema_migrations`, so running the
+migrations against a live database only applies what is new and never
+drops data. Add new migrations to the end of the list; never edit or
+reorder one that has already shipped.
+"""
+import re
+import mysql.connector
+from db import connect, is_sqlite
+
+MIGRATION_LOCK_NAME = 'cab_booking_schema_migrations'
+
+
+# ---- HELPERS ----
+def index_exists(cursor, table, index_name):
+    if is_sqlite():
+        cursor.execute(
+            "SELECT COUNT(*) AS count FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+            (table, index_name)
+        )
+        return cursor.fetchone()['count'] > 0
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index_name))
+    return cursor.fetchone()['count'] > 0
+
+def add_index(cursor, table, index_name, columns):
+    """Creates an index online (no table lock) unless it already exists."""
+    if index_exists(cursor, table, index_name):
+        print(f"  Index {index_name} already exists on {table}, skipping.")
+        return
+    cursor.execute(f"CREATE INDEX {index_name} ON {table} ({columns}) ALGORITHM=INPLACE LOCK=NONE")
+    print(f"  Created index {index_name} on {table}({columns}).")
+
+
+def column_exists(cursor, table, column):
+    if is_sqlite():
+        cursor.execute("SELECT COUNT(*) AS count FROM pragma_table_info(%s) WHERE name = %s", (table, column))
+        return cursor.fetchone()['count'] > 0
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()['count'] > 0
+
+def add_column(cursor, table, column, definition):
+    """Adds a nullable column unless it already exists (instant on MySQL 8, no table copy)."""
+    if column_exists(cursor, table, column):
+        print(f"  Column {table}.{column} already exists, skipping.")
+        return
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    print(f"  Added column {table}.{column}.")
+
+
+# ---- MIGRATIONS ----
+def _0001_hot_path_indexes(cursor):
+    add_index(cursor, 'rides', 'idx_rides_status', 'status')
+    add_index(cursor, 'rides', 'idx_rides_start_time', 'start_time')
+    add_index(cursor, 'rides', 'idx_rides_user_phone', 'user_phone')
+    add_index(cursor, 'drivers', 'idx_drivers_phone', 'phone')
+    add_index(cursor, 'drivers', 'idx_drivers_status', 'status')
+    add_index(cursor, 'cars', 'idx_cars_type_status', 'type, status')
+    add_index(cursor, 'coupons', 'idx_coupons_used', 'used')
+
+def _0002_revenue_rollup(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS revenue_rollup (
+            period_type VARCHAR(10) NOT NULL,
+            period_label VARCHAR(10) NOT NULL,
+            revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            paid_rides INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (period_type, period_label)
+        )
+    """)
+    from db import rebuild_revenue_rollup
+    buckets = rebuild_revenue_rollup()
+    if buckets is None:
+        raise RuntimeError("Backfilling revenue_rollup failed.")
+    print(f"  Backfilled {buckets} revenue bucket(s).")
+
+def _0003_numeric_route_metrics(cursor):
+    add_column(cursor, 'rides', 'distance_m', 'INT NULL AFTER duration')
+    add_column(cursor, 'rides', 'duration_s', 'INT NULL AFTER distance_m')
+    from db import backfill_route_metrics
+    updated = backfill_route_metrics()
+    if updated is None:
+        raise RuntimeError("Backfilling rides.distance_m/duration_s failed.")
+    print(f"  Backfilled route metrics for {updated} ride(s).")
+
+def _0004_chat_session_last_interaction(cursor):
+    add_column(cursor, 'chat_sessions', 'last_interaction', 'DATETIME NULL')
+
+def _0005_rides_archive(cursor):
+    # Mirrors `rides` without foreign keys (partitioned tables cannot have
+    # them); start_time is part of the key because it is the partition key.
+    # db.ensure_archive_partitions adds monthly partitions as rides arrive.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rides_archive (
+            id INT NOT NULL,
+            user_phone VARCHAR(20) NOT NULL,
+            car_type VARCHAR(50),
+            pickup TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            distance VARCHAR(50),
+            duration VARCHAR(50),
+            distance_m INT NULL,
+            duration_s INT NULL,
+            fare DECIMAL(10, 2) NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME,
+            driver_id INT,
+            car_id INT,
+            payment_status VARCHAR(50),
+            status VARCHAR(50),
+            enroute_to_pickup_time DATETIME,
+            at_pickup_time DATETIME,
+            trip_start_time DATETIME,
+            archived_at DATETIME NOT NULL,
+            PRIMARY KEY (id, start_time),
+            KEY idx_rides_archive_user_phone (user_phone, start_time),
+            KEY idx_rides_archive_status (status)
+        )
+        PARTITION BY RANGE COLUMNS (start_time) (
+            PARTITION p_old VALUES LESS THAN ('2000-01-01'),
+            PARTITION p_future VALUES LESS THAN (MAXVALUE)
+        )
+    """)
+
+def _0006_pickup_coordinates(cursor):
+    # Pickup coordinates from the Directions response, for nearest-driver dispatch.
+    for table in ('rides', 'rides_archive', 'chat_sessions'):
+        add_column(cursor, table, 'pickup_lat', 'DECIMAL(10, 8) NULL')
+        add_column(cursor, table, 'pickup_lng', 'DECIMAL(11, 8) NULL')
+
+def _0007_driver_location_history(cursor):
+    # Append-only driver positions, one row per driver per location flush.
+    # Range-partitioned by day of recorded_at (part of the key, as the
+    # partition key must be) so retention drops whole partitions;
+    # db.maintain_location_history adds and drops them.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS driver_location_history (
+            driver_id INT NOT NULL,
+            recorded_at DATETIME NOT NULL,
+            latitude DECIMAL(10, 8) NOT NULL,
+            longitude DECIMAL(11, 8) NOT NULL,
+            PRIMARY KEY (driver_id, recorded_at)
+        )
+        PARTITION BY RANGE COLUMNS (recorded_at) (
+            PARTITION p_old VALUES LESS THAN ('2000-01-01'),
+            PARTITION p_future VALUES LESS THAN (MAXVALUE)
+        )
+    """)
+
+def _0008_rides_updated_at(cursor):
+    # Set by add_ride/update_ride, so the assignment leader can re-read
+    # only the prebooked rides that changed since its last resync.
+    add_column(cursor, 'rides', 'updated_at', 'DATETIME NULL')
+    add_index(cursor, 'rides', 'idx_rides_status_updated_at', 'status, updated_at')
+
+
+def _0009_driver_last_location_at(cursor):
+    # When the stored position was taken, so a flush from another worker
+    # carrying an older fix cannot overwrite a newer one.
+    add_column(cursor, 'drivers', 'last_location_at', 'DATETIME(3) NULL')
+
+
+MIGRATIONS = [
+    (1, "Add indexes for hot-path filter columns", _0001_hot_path_indexes),
+    (2, "Add incrementally maintained revenue rollup table", _0002_revenue_rollup),
+    (3, "Add numeric rides.distance_m and rides.duration_s", _0003_numeric_route_metrics),
+    (4, "Track the last inbound message time on chat sessions", _0004_chat_session_last_interaction),
+    (5, "Add month-partitioned rides_archive table", _0005_rides_archive),
+    (6, "Store pickup coordinates on rides and chat sessions", _0006_pickup_coordinates),
+    (7, "Add day-partitioned driver_location_history table", _0007_driver_location_history),
+    (8, "Track when rides were last booked or edited", _0008_rides_updated_at),
+    (9, "Track when each driver's stored position was taken", _0009_driver_last_location_at),
+]
+
+
+# ---- RUNNER ----
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+    """)
+
+def get_applied_versions(cursor):
+    _ensure_migrations_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+def apply_migrations():
+    """Applies every pending migration in order. Returns the list of versions applied."""
+    conn = connect()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    applied_now = []
+    try:
+        # Serialise concurrent runs (e.g. several workers deploying at once).
+        cursor.execute("SELECT GET_LOCK(%s, 60) AS acquired", (MIGRATION_LOCK_NAME,))
+        if cursor.fetchone()['acquired'] != 1:
+            raise RuntimeError("Another process is applying migrations; try again shortly.")
+
+        try:
+            applied = get_applied_versions(cursor)
+            for version, description, migrate in MIGRATIONS:
+                if version in applied:
+                    continue
+                print(f"Applying migration {version:04d}: {description}")
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, NOW())",
+                    (version, description)
+                )
+                applied_now.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    if applied_now:
+        print(f"✅ Applied {len(applied_now)} migration(s).")
+    else:
+        print("✅ Schema is up to date.")
+    return applied_now
+
+def migration_status():
+    """Returns (version, description, applied_at or None) for every known migration."""
+    conn = connect()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        _ensure_migrations_table(cursor)
+        cursor.execute("SELECT version, applied_at FROM schema_migrations")
+        applied = {row['version']: row['applied_at'] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
+    return [(version, description, applied.get(version)) for version, description, _ in MIGRATIONS]
+
+
+# ---- INDEX USAGE CHECK ----
+# Representative hot queries from db.py and the index each one should use.
+EXPLAIN_CHECKS = [
+    ("get_prebooked_rides_for_assignment",
+     "SELECT * FROM rides WHERE status='prebooked' AND start_time BETWEEN %s AND %s",
+     ('2025-01-01 00:00:00', '2025-01-01 02:00:00'), {'idx_rides_status', 'idx_rides_start_time'}),
+    ("get_rides_by_user_phone",
+     "SELECT r.* FROM rides r WHERE r.user_phone = %s ORDER BY r.start_time DESC LIMIT 2",
+     ('918519879924',), {'idx_rides_user_phone'}),
+    ("count_rides(status)",
+     "SELECT COUNT(*) as count FROM rides WHERE status = %s",
+     ('ongoing',), {'idx_rides_status'}),
+    ("get_driver_by_phone",
+     "SELECT * FROM drivers WHERE phone=%s",
+     ('919550954674',), {'idx_drivers_phone'}),
+    ("get_all_drivers(status)",
+     "SELECT d.id FROM drivers d WHERE d.status = %s",
+     ('free',), {'idx_drivers_status'}),
+    ("get_available_driver_and_car (car)",
+     "SELECT * FROM cars WHERE status = 'free' AND type = %s LIMIT 1",
+     ('sedan',), {'idx_cars_type_status'}),
+    ("get_rate_for_car_type",
+     "SELECT MIN(rate) as rate FROM cars WHERE type = %s AND status = 'free'",
+     ('sedan',), {'idx_cars_type_status'}),
+    ("unused coupons",
+     "SELECT * FROM coupons WHERE used = 0",
+     (), {'idx_coupons_used'}),
+]
+
+_SQLITE_PLAN_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+def _explain(cursor, query, params):
+    """Returns (index names used, estimated rows or None) for a query's plan."""
+    if is_sqlite():
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        keys = {match.group(1) for row in cursor.fetchall() for match in [_SQLITE_PLAN_INDEX.search(row['detail'])] if match}
+        return keys, None
+    cursor.execute("EXPLAIN " + query, params)
+    plan = cursor.fetchall()
+    return {row.get('key') for row in plan if row.get('key')}, sum(row.get('rows') or 0 for row in plan)
+
+def check_index_usage():
+    """
+    Runs EXPLAIN for each hot query and reports which index the database picked.
+    Returns a list of dicts; `ok` is False when the expected index is not used.
+    Note that on very small tables the optimizer may prefer a full scan.
+    """
+    conn = connect()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    results = []
+    try:
+        for label, query, params, expected in EXPLAIN_CHECKS:
+            try:
+                keys, rows = _explain(cursor, query, params)
+            except mysql.connector.Error as err:
+                results.append({"query": label, "key": None, "expected": sorted(expected), "ok": False, "error": str(err)})
+                continue
+            results.append({
+                "query": label,
+                "key": ", ".join(sorted(keys)) or None,
+                "rows": rows,
+                "expected": sorted(expected),
+                "ok": bool(keys & expected),
+            })
+    finally:
+        cursor.close()
+        conn.close()
+    return results
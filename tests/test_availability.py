@@ -0,0 +1,99 @@
+"""
+Reservation calendar (utils.availability): buffer edges, the running
+maximum of end times, and reservations moving when a ride is re-saved.
+
+    python -m unittest discover tests
+"""
+import os
+import random
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.availability import ReservationCalendar, ride_window
+
+T0 = datetime(2025, 1, 1, 10, 0)
+BUFFER = timedelta(minutes=15)
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+class ConflictsTest(unittest.TestCase):
+    def setUp(self):
+        self.calendar = ReservationCalendar(BUFFER)
+        self.calendar.reserve(1, 'driver', at(0), at(60))
+
+    def test_buffer_edges(self):
+        # [10:00, 11:00) plus 15 minutes either side; windows are half-open.
+        self.assertEqual(self.calendar.conflicts('driver', at(75), at(90)), [])
+        self.assertEqual(self.calendar.conflicts('driver', at(74), at(90)), [1])
+        self.assertEqual(self.calendar.conflicts('driver', at(-60), at(-15)), [])
+        self.assertEqual(self.calendar.conflicts('driver', at(-60), at(-14)), [1])
+        self.assertTrue(self.calendar.is_free('driver', at(75), at(90)))
+        self.assertFalse(self.calendar.is_free('driver', at(-60), at(-14)))
+
+    def test_without_buffer(self):
+        calendar = ReservationCalendar()
+        calendar.reserve(1, 'driver', at(0), at(60))
+        self.assertTrue(calendar.is_free('driver', at(60), at(90)))
+        self.assertTrue(calendar.is_free('driver', at(-30), at(0)))
+        self.assertFalse(calendar.is_free('driver', at(59), at(90)))
+
+    def test_running_max_sees_a_long_earlier_reservation(self):
+        # Ride 2 starts last but ends first: only the running maximum of end
+        # times shows that ride 1 still covers the window after ride 2 ends.
+        self.calendar.reserve(2, 'driver', at(10), at(20))
+        self.calendar.reserve(3, 'driver', at(300), at(360))
+        self.assertFalse(self.calendar.is_free('driver', at(50), at(55)))
+        self.assertEqual(self.calendar.conflicts('driver', at(50), at(55)), [1])
+        self.calendar.release(1)
+        self.assertTrue(self.calendar.is_free('driver', at(50), at(55)))
+
+    def test_ignore_ride_only_skips_that_ride(self):
+        self.assertTrue(self.calendar.is_free('driver', at(0), at(60), ignore_ride=1))
+        self.calendar.reserve(2, 'driver', at(30), at(40))
+        self.assertFalse(self.calendar.is_free('driver', at(0), at(60), ignore_ride=1))
+
+    def test_reserving_again_moves_the_reservation(self):
+        self.calendar.reserve(1, 'driver', at(200), at(260))
+        self.assertEqual(len(self.calendar), 1)
+        self.assertTrue(self.calendar.is_free('driver', at(0), at(60)))
+        self.calendar.reserve(1, 'other driver', at(200), at(260))
+        self.assertTrue(self.calendar.is_free('driver', at(200), at(260)))
+        self.assertEqual(self.calendar.free_among(['driver', 'other driver'], at(200), at(260)), ['driver'])
+
+    def test_matches_a_full_scan(self):
+        rng = random.Random(3)
+        calendar = ReservationCalendar(BUFFER)
+        bookings = []
+        for ride_id in range(400):
+            start = at(rng.randint(0, 60 * 24))
+            bookings.append((ride_id, rng.randrange(5), start, start + timedelta(minutes=rng.randint(5, 180))))
+        calendar.load(bookings)
+        for ride_id in range(0, 400, 3):  # releases keep the running maximum right too
+            calendar.release(ride_id)
+        live = [booking for booking in bookings if booking[0] % 3]
+        for _ in range(300):
+            start = at(rng.randint(-60, 60 * 25))
+            end = start + timedelta(minutes=rng.randint(1, 120))
+            for resource in range(5):
+                expected = sorted(ride_id for ride_id, owner, begin, finish in live
+                                  if owner == resource and begin < end + BUFFER and finish > start - BUFFER)
+                self.assertEqual(sorted(calendar.conflicts(resource, start, end)), expected)
+                self.assertEqual(calendar.is_free(resource, start, end), not expected)
+
+
+class RideWindowTest(unittest.TestCase):
+    def test_end_falls_back_to_duration_then_default(self):
+        self.assertEqual(ride_window('2025-01-01 10:00:00', '2025-01-01 10:30:00'), (at(0), at(30)))
+        self.assertEqual(ride_window(at(0), None, 900), (at(0), at(15)))
+        self.assertEqual(ride_window(at(0), at(0), None, default_minutes=45), (at(0), at(45)))
+        self.assertIsNone(ride_window(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+TTL cache (utils.cache): expiry, invalidation during a load, and per-key
+load locking - concurrent misses on one key share a single load while a
+slow load never holds up misses on other keys.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_entries_expire(self):
+        cache = TTLCache(0.05)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))
+
+    def test_none_is_not_cached(self):
+        cache = TTLCache(60)
+        loads = []
+        for _ in range(2):
+            cache.get_or_load('a', lambda: loads.append(1))
+        self.assertEqual(len(loads), 2)
+
+    def test_load_racing_an_invalidate_is_discarded(self):
+        cache = TTLCache(60)
+
+        def loader():
+            cache.invalidate('a')  # a write lands while the old value is being read
+            return 'stale'
+
+        self.assertEqual(cache.get_or_load('a', loader), 'stale')
+        self.assertEqual(cache.get_or_load('a', lambda: 'fresh'), 'fresh')
+
+    def test_concurrent_misses_on_one_key_load_once(self):
+        cache = TTLCache(60)
+        loads, results = [], []
+        gate = threading.Barrier(8)
+
+        def loader():
+            loads.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        def worker():
+            gate.wait()
+            results.append(cache.get_or_load('a', loader))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(cache._load_locks, {})
+
+    def test_slow_load_does_not_block_other_keys(self):
+        cache = TTLCache(60)
+        loading, release = threading.Event(), threading.Event()
+        slow = threading.Thread(target=cache.get_or_load, args=('slow', lambda: loading.set() or (release.wait(5) and 'slow')))
+        slow.start()
+        loading.wait(5)
+        try:
+            started = time.monotonic()
+            self.assertEqual(cache.get_or_load('fast', lambda: 'fast'), 'fast')
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            release.set()
+            slow.join()
+        self.assertEqual(cache.get('slow'), 'slow')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Concurrency tests for driver and car claims, against a scratch MySQL
+database (SQLite runs every write transaction one at a time, so it cannot
+show race-freedom). They are skipped unless TEST_MYSQL_DATABASE is set;
+the schema in that database is dropped and recreated.
+
+    TEST_MYSQL_HOST=127.0.0.1 TEST_MYSQL_USER=root TEST_MYSQL_PASSWORD=... \
+    TEST_MYSQL_DATABASE=cab_booking_test python -m unittest discover tests
+"""
+import os
+import runpy
+import sys
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE = os.getenv("TEST_MYSQL_DATABASE")
+
+
+@unittest.skipUnless(TEST_DATABASE, "set TEST_MYSQL_DATABASE (and TEST_MYSQL_HOST/USER/PASSWORD) to a scratch MySQL database")
+class ClaimRaceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import db
+        if db.DB_BACKEND != 'mysql':
+            raise unittest.SkipTest("needs DB_BACKEND=mysql")
+        # The pool is created on first use, so pointing the config at the scratch database is enough.
+        db.db_config.update(
+            host=os.getenv("TEST_MYSQL_HOST", "127.0.0.1"), user=os.getenv("TEST_MYSQL_USER", "root"),
+            password=os.getenv("TEST_MYSQL_PASSWORD", ""), database=TEST_DATABASE
+        )
+        runpy.run_path(os.path.join(os.path.dirname(db.__file__), "init_db.py"))
+        cls.db = db
+
+    def race(self, threads, target):
+        gate = threading.Barrier(threads)
+        results, lock = [], threading.Lock()
+
+        def worker():
+            gate.wait()
+            result = target()
+            with lock:
+                results.append(result)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def test_stress_claims_never_double_books(self):
+        import manage
+        self.assertEqual(
+            manage.main(["stress-claims", "--allow-mysql", "--drivers", "20", "--bookings", "200", "--threads", "16"]), 0
+        )
+
+    def test_one_ride_is_assigned_once(self):
+        db = self.db
+        start = datetime.now().replace(microsecond=0) + timedelta(minutes=5)
+        ride_id = db.add_ride('918519879924', 'Race pickup', 'Race drop', '5 km', '15 mins', 100, None, None,
+                              'prebooked', 'pending', start, None, 'sedan')
+        ride = db.get_ride_by_id(ride_id)
+        results = self.race(8, lambda: db.assign_available_driver(dict(ride)))
+        winners = [driver for driver, car in results if driver]
+        self.assertEqual(len(winners), 1)
+        stored = db.execute_query("SELECT driver_id FROM rides WHERE id = %s", (ride_id,), fetch='one', read_only=False)
+        self.assertEqual(stored['driver_id'], winners[0]['id'])
+
+    def test_one_driver_and_car_go_to_one_ride(self):
+        db = self.db
+        driver_id = db.add_driver("Race driver", "6000000001")
+        car_id = db.add_car("RACE0001", "Race car", "racecar", 4)
+        start = datetime.now().replace(microsecond=0)
+        ride_ids = [
+            db.add_ride('918519879924', 'Race pickup', 'Race drop', '5 km', '15 mins', 100, None, None,
+                        'prebooked', 'pending', start, None, 'racecar')
+            for _ in range(8)
+        ]
+        pending = iter(ride_ids)
+        lock = threading.Lock()
+
+        def assign():
+            with lock:
+                ride_id = next(pending)
+            return db.assign_driver_to_ride(ride_id, driver_id, car_id)
+
+        self.assertEqual(sum(self.race(len(ride_ids), assign)), 1)
+        holders = db.execute_query("SELECT COUNT(*) AS n FROM rides WHERE driver_id = %s OR car_id = %s",
+                                   (driver_id, car_id), fetch='one', read_only=False)['n']
+        self.assertEqual(holders, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
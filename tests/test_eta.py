@@ -0,0 +1,66 @@
+"""
+Pickup ETAs (utils.eta): speed from the driver's track, clamping, and the
+default speed for a short or stationary track.
+
+    python -m unittest discover tests
+"""
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.dispatch import haversine_km
+from utils.eta import (DEFAULT_SPEED_KMH, MAX_SPEED_KMH, MIN_SPEED_KMH, ROAD_FACTOR, estimate_eta,
+                       track_speed_kmh)
+
+PICKUP = (12.9716, 77.5946)
+KM_PER_DEGREE_LAT = haversine_km(0, 0, 1, 0)
+
+
+def approach(speed_kmh, seconds, step=10, start_km=6.0):
+    """A track driving due south towards PICKUP at `speed_kmh`, one fix every `step` seconds."""
+    track = []
+    for t in range(0, seconds + 1, step):
+        km_left = start_km - speed_kmh * t / 3600
+        track.append((float(t), PICKUP[0] + km_left / KM_PER_DEGREE_LAT, PICKUP[1]))
+    return track
+
+
+class EtaTest(unittest.TestCase):
+    def test_speed_from_track(self):
+        self.assertAlmostEqual(track_speed_kmh(approach(30, 300)), 30, places=1)
+        eta = estimate_eta(approach(30, 300), *PICKUP)
+        self.assertEqual(eta["speed_source"], "track")
+        self.assertAlmostEqual(eta["speed_kmh"], 30, places=0)
+        expected_km = (6.0 - 30 * 300 / 3600) * ROAD_FACTOR
+        self.assertAlmostEqual(eta["distance_km"], expected_km, places=1)
+        self.assertEqual(eta["eta_minutes"], math.ceil(expected_km / eta["speed_kmh"] * 60))
+
+    def test_speed_is_clamped(self):
+        self.assertEqual(estimate_eta(approach(150, 120, step=5, start_km=10), *PICKUP)["speed_kmh"], MAX_SPEED_KMH)
+        crawl = estimate_eta(approach(3, 600, step=60), *PICKUP)
+        self.assertEqual((crawl["speed_kmh"], crawl["speed_source"]), (MIN_SPEED_KMH, "track"))
+
+    def test_short_track_falls_back_to_the_default_speed(self):
+        for track in (approach(30, 0), approach(30, 50, step=5)):  # one fix; under MIN_TRACK_SECONDS
+            self.assertIsNone(track_speed_kmh(track))
+            eta = estimate_eta(track, *PICKUP)
+            self.assertEqual((eta["speed_kmh"], eta["speed_source"]), (DEFAULT_SPEED_KMH, "default"))
+
+    def test_stationary_driver_falls_back_to_the_default_speed(self):
+        parked = [(float(t), 12.99, 77.59) for t in range(0, 600, 30)]
+        self.assertIsNone(track_speed_kmh(parked))
+        self.assertEqual(estimate_eta(parked, *PICKUP)["speed_source"], "default")
+
+    def test_at_the_pickup_is_at_least_a_minute(self):
+        self.assertEqual(estimate_eta([(0.0, PICKUP[0], PICKUP[1])], *PICKUP)["eta_minutes"], 1)
+
+    def test_without_position_or_pickup(self):
+        self.assertIsNone(estimate_eta([], *PICKUP))
+        self.assertIsNone(estimate_eta(approach(30, 300), None, PICKUP[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Buffered driver location pings (utils.location_ingest): coalescing, stale
+and future-dated fixes, rejected input, and re-queueing a failed flush.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.location_ingest import LocationBuffer
+
+
+class LocationBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.failing = False
+        # The flusher thread sleeps for the whole test; flushes are run by hand.
+        self.buffer = LocationBuffer(self.write, flush_interval=3600)
+
+    def write(self, batch):
+        if self.failing:
+            raise RuntimeError("database unavailable")
+        self.batches.append(sorted(batch))
+
+    def test_pings_coalesce_to_the_latest_per_driver(self):
+        now = time.time()
+        self.assertTrue(self.buffer.offer(1, 12.9, 77.5, now - 2))
+        self.assertTrue(self.buffer.offer(1, 12.91, 77.51, now - 1))
+        self.assertTrue(self.buffer.offer(2, 13.0, 77.6, now - 1))
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.batches, [[(1, 12.91, 77.51, now - 1), (2, 13.0, 77.6, now - 1)]])
+        self.assertEqual(self.buffer.stats()["coalesced"], 1)
+
+    def test_stale_ping_is_dropped(self):
+        now = time.time()
+        self.assertTrue(self.buffer.offer(1, 12.9, 77.5, now))
+        self.assertFalse(self.buffer.offer(1, 11.0, 76.0, now - 5))
+        self.assertEqual(self.buffer.position(1), (12.9, 77.5, now))
+        self.assertEqual(self.buffer.stats()["stale"], 1)
+
+    def test_future_dated_ping_is_clamped_to_now(self):
+        self.assertTrue(self.buffer.offer(1, 12.9, 77.5, time.time() + 1e6))
+        self.assertLessEqual(self.buffer.position(1)[2], time.time())
+        # A clock running ahead must not freeze the driver.
+        self.assertTrue(self.buffer.offer(1, 12.95, 77.55))
+        self.assertEqual(self.buffer.position(1)[:2], (12.95, 77.55))
+
+    def test_numeric_strings_are_accepted(self):
+        self.assertTrue(self.buffer.offer(1, "12.9", "77.5", str(time.time() - 1)))
+        self.assertEqual(self.buffer.position(1)[:2], (12.9, 77.5))
+
+    def test_bad_input_is_rejected(self):
+        now = time.time()
+        for lat, lng, recorded_at in ((12.9, 77.5, "2025-01-01T10:00:00"), (12.9, 77.5, float('nan')),
+                                      (12.9, 77.5, float('-inf')), (12.9, 77.5, [now]),
+                                      ("north", 77.5, now), (None, 77.5, now), (91, 77.5, now), (12.9, 181, now)):
+            self.assertFalse(self.buffer.offer(1, lat, lng, recorded_at), (lat, lng, recorded_at))
+        stats = self.buffer.stats()
+        self.assertEqual((stats["rejected"], stats["pings"], stats["pending"]), (8, 0, 0))
+
+    def test_failed_flush_is_requeued_unless_a_newer_ping_arrived(self):
+        now = time.time()
+        self.buffer.offer(1, 12.9, 77.5, now - 2)
+        self.buffer.offer(2, 13.0, 77.6, now - 2)
+        self.failing = True
+        self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.offer(1, 12.95, 77.55, now - 1)
+        self.failing = False
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.batches, [[(1, 12.95, 77.55, now - 1), (2, 13.0, 77.6, now - 2)]])
+        self.assertEqual(self.buffer.stats()["write_errors"], 1)
+
+    def test_on_ping_sees_every_accepted_ping(self):
+        seen = []
+        buffer = LocationBuffer(self.write, flush_interval=3600, on_ping=lambda *ping: seen.append(ping))
+        buffer.offer(1, 12.9, 77.5)
+        buffer.offer(1, 99, 77.5)
+        self.assertEqual(seen, [(1, 12.9, 77.5)])
+
+
+if __name__ == "__main__":
+    unittest.main()
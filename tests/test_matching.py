@@ -0,0 +1,107 @@
+"""
+Batch assignment planning (utils.matching): the Hungarian solver against
+brute force on small matrices, and the fixed-driver and pool-car rules of
+plan_assignments.
+
+    python -m unittest discover tests
+"""
+import itertools
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.matching import INFEASIBLE, plan_assignments, solve_assignment
+
+
+def best_by_brute_force(cost):
+    """(rides covered, total cost) of the best assignment, trying every one."""
+    n, m = len(cost), len(cost[0])
+    best = (0, 0.0)
+    for columns in itertools.product([None] + list(range(m)), repeat=n):
+        used = [j for j in columns if j is not None]
+        if len(used) != len(set(used)) or any(cost[i][j] == INFEASIBLE for i, j in enumerate(columns) if j is not None):
+            continue
+        candidate = (len(used), sum(cost[i][j] for i, j in enumerate(columns) if j is not None))
+        if candidate[0] > best[0] or (candidate[0] == best[0] and candidate[1] < best[1]):
+            best = candidate
+    return best
+
+
+def score(cost, columns):
+    return (sum(1 for j in columns if j is not None), sum(cost[i][j] for i, j in enumerate(columns) if j is not None))
+
+
+def ride(ride_id, car_type='sedan', lat=12.97, lng=77.59):
+    return {'id': ride_id, 'car_type': car_type, 'pickup_lat': lat, 'pickup_lng': lng}
+
+
+def driver(driver_id, lat, lng, car_id=None, car_type=None):
+    return {'id': driver_id, 'is_fixed': car_id is not None, 'car_id': car_id, 'car_type': car_type,
+            'last_latitude': lat, 'last_longitude': lng}
+
+
+class SolveAssignmentTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            n, m = rng.randint(1, 4), rng.randint(1, 4)
+            cost = [[INFEASIBLE if rng.random() < 0.3 else float(rng.randint(0, 20)) for _ in range(m)] for _ in range(n)]
+            columns = solve_assignment(cost)
+            used = [j for j in columns if j is not None]
+            self.assertEqual(len(used), len(set(used)), cost)
+            self.assertTrue(all(cost[i][j] != INFEASIBLE for i, j in enumerate(columns) if j is not None), cost)
+            covered, total = score(cost, columns)
+            best_covered, best_total = best_by_brute_force(cost)
+            self.assertEqual(covered, best_covered, cost)
+            self.assertAlmostEqual(total, best_total, msg=cost)
+
+    def test_covering_a_ride_beats_a_shorter_pickup(self):
+        # Ride 0 alone would take column 0; ride 1 can only use column 0.
+        self.assertEqual(solve_assignment([[1.0, 50.0], [2.0, INFEASIBLE]]), [1, 0])
+
+    def test_empty_and_infeasible(self):
+        self.assertEqual(solve_assignment([]), [])
+        self.assertEqual(solve_assignment([[INFEASIBLE, INFEASIBLE]]), [None])
+
+
+class PlanAssignmentsTest(unittest.TestCase):
+    def test_fixed_driver_only_serves_their_car_type(self):
+        rides = [ride(1, 'sedan')]
+        drivers = [driver(10, 12.97, 77.59, car_id=100, car_type='suv'), driver(11, 13.2, 77.8)]
+        plan, unassigned = plan_assignments(rides, drivers, [{'id': 200, 'type': 'sedan'}])
+        self.assertEqual([(r['id'], d['id'], c['id']) for r, d, c, _ in plan], [(1, 11, 200)])
+        self.assertEqual(unassigned, [])
+
+    def test_fixed_driver_brings_their_own_car(self):
+        plan, _ = plan_assignments([ride(1, 'suv')], [driver(10, 12.97, 77.59, car_id=100, car_type='SUV')], [])
+        self.assertEqual([(d['id'], c['id']) for _, d, c, _ in plan], [(10, 100)])
+
+    def test_pool_cars_are_a_shared_budget(self):
+        # Two sedan rides and two pool drivers, but one sedan: the ride with the cheaper pickup gets it.
+        rides = [ride(1, lat=12.97), ride(2, lat=13.30)]
+        drivers = [driver(10, 12.97, 77.59), driver(11, 13.31, 77.59)]
+        plan, unassigned = plan_assignments(rides, drivers, [{'id': 200, 'type': 'sedan'}])
+        self.assertEqual([(r['id'], c['id']) for r, _, c, _ in plan], [(1, 200)])
+        self.assertEqual([r['id'] for r in unassigned], [2])
+
+    def test_oversubscribed_type_falls_back_to_fixed_drivers(self):
+        rides = [ride(1, lat=12.97), ride(2, lat=13.30)]
+        drivers = [driver(10, 12.97, 77.59), driver(11, 13.31, 77.59, car_id=101, car_type='sedan')]
+        plan, unassigned = plan_assignments(rides, drivers, [{'id': 200, 'type': 'sedan'}])
+        self.assertEqual(sorted((r['id'], d['id'], c['id']) for r, d, c, _ in plan), [(1, 10, 200), (2, 11, 101)])
+        self.assertEqual(unassigned, [])
+
+    def test_busy_drivers_and_cars_are_skipped(self):
+        rides = [ride(1)]
+        drivers = [driver(10, 12.97, 77.59), driver(11, 13.2, 77.8)]
+        cars = [{'id': 200, 'type': 'sedan'}, {'id': 201, 'type': 'sedan'}]
+        plan, _ = plan_assignments(rides, drivers, cars, driver_free=lambda r, d: d['id'] != 10,
+                                   car_free=lambda r, c: c['id'] != 200)
+        self.assertEqual([(d['id'], c['id']) for _, d, c, _ in plan], [(11, 201)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+Read replica routing in db.execute_query, against stand-in connections (no
+MySQL server needed): reads go to a replica, a thread's reads stay on the
+primary for a moment after it writes, and a lagging or failing replica
+sends reads back to the primary.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+
+import db
+
+
+class StandInServer:
+    """Answers every SELECT with the server's name; `lag` is what SHOW REPLICA STATUS reports."""
+
+    def __init__(self, name, lag=None):
+        self.name = name
+        self.lag = lag
+        self.fail = False
+        self.queries = []
+
+    def connect(self, config):
+        return StandInConnection(self)
+
+
+class StandInConnection:
+    in_transaction = False
+
+    def __init__(self, server):
+        self.server = server
+
+    def cursor(self, dictionary=False, buffered=False):
+        return StandInCursor(self.server)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StandInCursor:
+    rowcount = 1
+    lastrowid = 1
+    column_names = ('server',)
+
+    def __init__(self, server):
+        self.server = server
+        self.rows = []
+
+    def execute(self, query, params=()):
+        if query.startswith("SHOW REPLICA STATUS"):
+            self.rows = [{'Seconds_Behind_Source': self.server.lag}]
+            return
+        if self.server.fail:
+            raise mysql.connector.errors.OperationalError("Lost connection to MySQL server during query")
+        self.server.queries.append(query)
+        self.rows = [{'server': self.server.name}]
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        pass
+
+
+class ReplicaRoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.primary = StandInServer("primary")
+        self.replica_server = StandInServer("replica", lag=0)
+        replica = db.Replica("replica")
+        replica.pool = db.ConnectionPool({}, size=2, connector=self.replica_server.connect)
+        self.replica = replica
+
+        saved = {name: getattr(db, name) for name in ('_pool', '_replicas', '_pool_pid')}
+        self.addCleanup(lambda: [setattr(db, name, value) for name, value in saved.items()])
+        db._pool = db.ConnectionPool({}, size=2, connector=self.primary.connect)
+        db._replicas = [replica]
+        db._pool_pid = os.getpid()
+        db.begin_request()
+        self.addCleanup(db.begin_request)
+
+    def read(self):
+        return db.execute_query("SELECT 1", fetch='one')['server']
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.read(), "replica")
+        self.assertEqual(db.execute_query("SELECT 1", fetch='one', read_only=False)['server'], "primary")
+        self.assertEqual(self.replica.reads, 1)
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        db.execute_query("UPDATE rides SET status = 'ongoing' WHERE id = 1", commit=True)
+        self.assertEqual(self.read(), "primary")
+
+        # Only for READ_YOUR_WRITES_SECONDS ...
+        with mock.patch.object(db, 'READ_YOUR_WRITES_SECONDS', 0):
+            self.assertEqual(self.read(), "replica")
+        # ... and only for this request.
+        db.begin_request()
+        self.assertEqual(self.read(), "replica")
+
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        self.replica_server.lag = db.REPLICA_MAX_LAG_SECONDS + 1
+        self.assertEqual(self.read(), "primary")
+        self.assertFalse(self.replica.is_available())
+        self.assertEqual(self.replica.failures, 1)
+        self.assertEqual(self.replica.pool.stats()["in_use"], 0)
+
+    def test_stopped_replica_falls_back_to_the_primary(self):
+        # With replication stopped SHOW REPLICA STATUS reports a NULL lag.
+        self.replica_server.lag = None
+        self.assertEqual(self.read(), "primary")
+        self.assertFalse(self.replica.is_available())
+
+    def test_failed_replica_read_is_retried_on_the_primary(self):
+        self.replica_server.fail = True
+        self.assertEqual(self.read(), "primary")
+        self.assertEqual(db.query_stats.request_summary()[0], 1)  # one logical query, counted once
+        self.assertEqual(self.replica.stats()["failed_reads"], 1)
+        self.assertFalse(self.replica.is_available())
+        self.assertEqual(self.replica.pool.stats()["in_use"], 0)
+        self.assertEqual(db._pool.stats()["in_use"], 0)
+
+        # The replica is skipped until REPLICA_RETRY_SECONDS have passed, then tried again.
+        self.replica_server.fail = False
+        self.assertEqual(self.read(), "primary")
+        self.replica.down_until = 0.0
+        self.assertEqual(self.read(), "replica")
+
+    def test_dashboard_stats_load_from_the_primary(self):
+        db.invalidate_dashboard_stats()
+        self.addCleanup(db.invalidate_dashboard_stats)
+        db.get_dashboard_stats()
+        self.assertEqual(self.replica_server.queries, [])
+        self.assertEqual(len(self.primary.queries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
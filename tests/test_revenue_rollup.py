@@ -0,0 +1,71 @@
+"""
+Incremental revenue rollup (db.update_revenue_rollup) against a recording
+cursor: which paid-ride contributions are added or removed when a ride's
+payment status, fare or start time changes.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+START = datetime(2025, 3, 14, 9, 30)
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.deltas = []
+
+    def execute(self, query, params=()):
+        # One row per period bucket, all with the same (revenue, paid_rides) delta.
+        self.deltas.append((params[3], params[4]))
+
+
+def ride(payment_status='paid', fare=100, start_time=START):
+    return {'payment_status': payment_status, 'fare': fare, 'start_time': start_time}
+
+
+class RevenueRollupTest(unittest.TestCase):
+    def deltas(self, before, after):
+        cursor = RecordingCursor()
+        db.update_revenue_rollup(cursor, before, after)
+        return cursor.deltas
+
+    def test_paying_adds_the_fare(self):
+        self.assertEqual(self.deltas(ride('pending'), ride('paid')), [(100, 1)])
+        self.assertEqual(self.deltas(None, ride('paid')), [(100, 1)])
+
+    def test_unpaying_or_deleting_removes_it(self):
+        self.assertEqual(self.deltas(ride('paid'), ride('pending')), [(-100, -1)])
+        self.assertEqual(self.deltas(ride('paid'), None), [(-100, -1)])
+
+    def test_unpaid_rides_never_touch_the_rollup(self):
+        self.assertEqual(self.deltas(ride('pending'), ride('pending', fare=250)), [])
+        self.assertEqual(self.deltas(None, ride('pending')), [])
+
+    def test_unchanged_paid_ride_is_skipped(self):
+        self.assertEqual(self.deltas(ride(fare=Decimal('100.00')), ride(fare='100')), [])
+        self.assertEqual(self.deltas(ride(), ride(start_time='2025-03-14 09:30:00')), [])
+
+    def test_fare_edit_moves_the_difference(self):
+        self.assertEqual(self.deltas(ride(fare=100), ride(fare=120)), [(-100, -1), (120, 1)])
+
+    def test_start_time_edit_moves_the_ride(self):
+        self.assertEqual(self.deltas(ride(), ride(start_time=datetime(2025, 4, 1))), [(-100, -1), (100, 1)])
+
+    def test_null_fare(self):
+        # A paid ride without a fare is left out of the rollup, unlike a fare of 0.
+        self.assertEqual(self.deltas(ride(fare=None), ride(fare=None)), [])
+        self.assertEqual(self.deltas(ride(fare=None), ride(fare=50)), [(50, 1)])
+        self.assertEqual(self.deltas(ride(fare=None), ride(fare=0)), [(0, 1)])
+        self.assertEqual(self.deltas(ride(fare=80), ride(fare=None)), [(-80, -1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Deadline scheduler (utils.scheduler) on a hand-driven clock: firing order,
+rescheduling and cancelling, heap compaction, and waking the worker for an
+earlier deadline.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.scheduler import DeadlineScheduler
+
+T0 = datetime(2025, 1, 1, 9, 0)
+
+
+class Clock:
+    def __init__(self):
+        self.now = T0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+
+def at(seconds):
+    return T0 + timedelta(seconds=seconds)
+
+
+class DeadlineSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = DeadlineScheduler(clock=self.clock)
+
+    def test_fires_due_keys_earliest_first(self):
+        self.scheduler.schedule('b', at(20))
+        self.scheduler.schedule('a', at(10))
+        self.scheduler.schedule('c', at(90))
+        self.clock.advance(30)
+        self.assertEqual(self.scheduler.wait_due(), ['a', 'b'])
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.next_due_at(), at(90))
+
+    def test_past_deadline_fires_at_once(self):
+        self.scheduler.schedule('late', at(-5))
+        self.assertEqual(self.scheduler.wait_due(), ['late'])
+
+    def test_reschedule_replaces_the_deadline(self):
+        self.scheduler.schedule('a', at(10))
+        self.scheduler.schedule('a', at(100))
+        self.clock.advance(50)
+        self.assertEqual(self.scheduler.next_due_at(), at(100))
+        self.scheduler.schedule('a', at(40))
+        self.assertEqual(self.scheduler.wait_due(), ['a'])
+        self.assertNotIn('a', self.scheduler)
+        self.assertIsNone(self.scheduler.next_due_at())
+
+    def test_same_deadline_is_not_queued_twice(self):
+        for _ in range(5):
+            self.scheduler.schedule('a', at(10))
+        stats = self.scheduler.stats()
+        self.assertEqual((stats["scheduled"], stats["heap_entries"]), (1, 1))
+
+    def test_cancel(self):
+        self.scheduler.schedule('a', at(10))
+        self.scheduler.schedule('b', at(20))
+        self.scheduler.cancel('a')
+        self.scheduler.cancel('missing')
+        self.clock.advance(30)
+        self.assertEqual(self.scheduler.wait_due(), ['b'])
+
+    def test_compaction_keeps_the_heap_bounded(self):
+        for round_number in range(200):
+            for key in range(10):
+                self.scheduler.schedule(key, at(1000 + round_number))
+        stats = self.scheduler.stats()
+        self.assertGreater(stats["compactions"], 0)
+        self.assertLessEqual(stats["heap_entries"], 2 * 10 + 16 + 1)
+        self.assertEqual(stats["pending"], 10)
+        self.clock.advance(2000)
+        self.assertEqual(sorted(self.scheduler.wait_due()), list(range(10)))
+
+    def test_cancelled_keys_are_compacted_away(self):
+        for key in range(100):
+            self.scheduler.schedule(key, at(key))
+        for key in range(100):
+            self.scheduler.cancel(key)
+        self.assertLessEqual(self.scheduler.stats()["heap_entries"], 16)
+
+    def test_stop_returns_nothing(self):
+        self.scheduler.schedule('a', at(-1))
+        self.scheduler.stop()
+        self.assertEqual(self.scheduler.wait_due(), [])
+        self.scheduler.resume()
+        self.assertEqual(self.scheduler.wait_due(), ['a'])
+
+    def test_earlier_deadline_wakes_the_worker(self):
+        scheduler = DeadlineScheduler()  # real clock: the worker really sleeps
+        scheduler.schedule('later', datetime.now() + timedelta(seconds=30))
+        fired = []
+        worker = threading.Thread(target=lambda: fired.extend(scheduler.wait_due()))
+        worker.start()
+        scheduler.schedule('now', datetime.now())
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(fired, ['now'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Write-back chat session cache (utils.session_store): only changed columns
+are written, and a dirty session is never dropped from the cache - by
+eviction, expiry or invalidate - until its changes are written.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.session_store import WriteBackSessionStore
+
+
+class FlakyTable:
+    """A stand-in chat_sessions table whose writes fail while `down` is set."""
+
+    def __init__(self, rows=None):
+        self.rows = rows or {}
+        self.down = False
+        self.writes = []
+
+    def load(self, key):
+        return dict(self.rows[key]) if key in self.rows else None
+
+    def write(self, changes):
+        if self.down:
+            raise RuntimeError("database unavailable")
+        self.writes.append(changes)
+        for key, changed in changes:
+            self.rows.setdefault(key, {}).update(changed)
+
+
+class SessionStoreTest(unittest.TestCase):
+    def make_store(self, table, **options):
+        # The sweeper thread sleeps for the whole test; sweeps are run by hand.
+        options.setdefault('flush_interval', 3600)
+        return WriteBackSessionStore(table.load, table.write, ('state', 'pickup'), **options)
+
+    def test_only_changed_columns_are_written(self):
+        table = FlakyTable({'a': {'state': 'idle', 'pickup': None}})
+        store = self.make_store(table, flush_on=('state',))
+        store.save('a', {**store.get('a'), 'pickup': 'MG Road', 'scratch': 1})
+        self.assertEqual(table.writes, [])  # not a state change: written back later
+        store.flush()
+        self.assertEqual(table.writes, [[('a', {'pickup': 'MG Road'})]])
+        store.save('a', {**store.get('a'), 'state': 'awaiting_drop'})
+        self.assertEqual(table.writes[-1], [('a', {'state': 'awaiting_drop'})])
+
+    def test_failed_flush_keeps_the_session_dirty(self):
+        table = FlakyTable({'a': {'state': 'idle', 'pickup': None}})
+        store = self.make_store(table, flush_on=())
+        store.save('a', {**store.get('a'), 'pickup': 'MG Road'})
+        table.down = True
+        store.flush()
+        self.assertEqual(store.stats()["dirty"], 1)
+        self.assertEqual(store.stats()["write_errors"], 1)
+        table.down = False
+        store.flush()
+        self.assertEqual(table.rows['a']['pickup'], 'MG Road')
+        self.assertEqual(store.stats()["dirty"], 0)
+
+    def test_eviction_keeps_dirty_sessions_until_written(self):
+        table = FlakyTable({key: {'state': 'idle', 'pickup': None} for key in 'abc'})
+        store = self.make_store(table, capacity=2, flush_on=())
+        for key in 'ab':
+            store.save(key, {**store.get(key), 'pickup': f'P{key}'})
+        table.down = True
+        store.get('c')  # over capacity: 'a' is the oldest, but its write fails
+        self.assertEqual(store.stats()["entries"], 3)
+        self.assertEqual(store.get('a')['pickup'], 'Pa')
+        table.down = False
+        store.flush()
+        self.assertEqual(table.rows['a']['pickup'], 'Pa')
+        self.assertEqual(table.rows['b']['pickup'], 'Pb')
+
+    def test_eviction_writes_then_drops(self):
+        table = FlakyTable({key: {'state': 'idle', 'pickup': None} for key in 'abc'})
+        store = self.make_store(table, capacity=2, flush_on=())
+        store.save('a', {**store.get('a'), 'pickup': 'Pa'})
+        store.get('b')
+        store.get('c')
+        self.assertEqual(table.rows['a']['pickup'], 'Pa')
+        self.assertEqual(store.stats()["entries"], 2)
+        self.assertEqual(store.stats()["evictions"], 1)
+
+    def test_sweep_keeps_expired_dirty_sessions_until_written(self):
+        table = FlakyTable({'a': {'state': 'idle', 'pickup': None}})
+        store = self.make_store(table, ttl=0, flush_on=())
+        store.save('a', {**store.get('a'), 'pickup': 'MG Road'})
+        time.sleep(0.01)
+        table.down = True
+        store._sweep()
+        self.assertEqual(store.stats()["entries"], 1)
+        self.assertEqual(store.stats()["expired"], 0)
+        table.down = False
+        store._sweep()
+        self.assertEqual(table.rows['a']['pickup'], 'MG Road')
+        self.assertEqual(store.stats()["entries"], 0)
+        self.assertEqual(store.stats()["expired"], 1)
+
+    def test_invalidate_keeps_dirty_sessions_until_written(self):
+        table = FlakyTable({key: {'state': 'idle', 'pickup': None} for key in 'ab'})
+        store = self.make_store(table, flush_on=())
+        store.get('b')
+        store.save('a', {**store.get('a'), 'pickup': 'MG Road'})
+        table.down = True
+        store.invalidate()
+        self.assertEqual(store.stats()["entries"], 1)  # the clean 'b' goes at once
+        table.down = False
+        store.invalidate('a')
+        self.assertEqual(table.rows['a']['pickup'], 'MG Road')
+        self.assertEqual(store.stats()["entries"], 0)
+
+    def test_new_session_is_written_through(self):
+        table = FlakyTable()
+        store = self.make_store(table)
+        self.assertIsNone(store.get('new'))
+        store.save('new', {'state': 'idle'})
+        self.assertEqual(table.rows['new'], {'state': 'idle'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+"""
+Reservation calendar: which drivers or cars are free for a time window.
+
+Each resource (a driver id or a car id) keeps its reservations as
+intervals sorted by start, with a running maximum of the end times. A
+window [start, end) conflicts with a resource's reservations exactly when
+some interval starting before `end` ends after `start`, so one bisect plus
+one lookup in the running maximum answers "is this resource free", and
+filtering a list of candidates costs O(candidates * log reservations).
+
+    python -m utils.availability [resources] [rides]   # lookup benchmark
+"""
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def as_datetime(value):
+    """A naive datetime from a DATETIME value or string. Aware values keep their wall-clock time, as rides store it."""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        text = str(value)
+        for pattern in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M'):
+            try:
+                return datetime.strptime(text, pattern)
+            except ValueError:
+                continue
+        value = datetime.fromisoformat(text)
+    return value.replace(tzinfo=None) if value.tzinfo else value
+
+def ride_window(start_time, end_time=None, duration_s=None, default_minutes=60):
+    """
+    The [start, end) a ride occupies its driver and car. The end is the
+    ride's end_time, else start plus its duration, else start plus
+    `default_minutes`. Returns None when the ride has no start time.
+    """
+    start = as_datetime(start_time)
+    if start is None:
+        return None
+    end = as_datetime(end_time)
+    if end is None or end <= start:
+        seconds = duration_s if duration_s else default_minutes * 60
+        end = start + timedelta(seconds=int(seconds))
+    return start, end
+
+
+class _Timeline:
+    __slots__ = ("starts", "intervals", "max_end")
+
+    def __init__(self):
+        self.starts = []
+        self.intervals = []  # (start, end, ride_id), sorted by start
+        self.max_end = []    # max_end[i] = latest end among intervals[:i + 1]
+
+    def _rebuild_from(self, index):
+        latest = self.max_end[index - 1] if index > 0 else None
+        del self.max_end[index:]
+        for start, end, _ in self.intervals[index:]:
+            latest = end if latest is None or end > latest else latest
+            self.max_end.append(latest)
+
+    def add(self, start, end, ride_id):
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.intervals.insert(index, (start, end, ride_id))
+        self._rebuild_from(index)
+
+    def discard(self, start, ride_id):
+        index = bisect.bisect_left(self.starts, start)
+        while index < len(self.starts) and self.starts[index] == start:
+            if self.intervals[index][2] == ride_id:
+                del self.starts[index]
+                del self.intervals[index]
+                self._rebuild_from(index)
+                return
+            index += 1
+
+    def is_free(self, start, end):
+        index = bisect.bisect_left(self.starts, end)
+        return index == 0 or self.max_end[index - 1] <= start
+
+    def overlapping(self, start, end):
+        index = bisect.bisect_left(self.starts, end)
+        return [ride_id for begin, finish, ride_id in self.intervals[:index] if finish > start]
+
+
+class ReservationCalendar:
+    """
+    Reservations of one kind of resource (drivers, or cars), keyed by ride
+    id so that re-saving a ride moves its reservation instead of adding a
+    second one. `buffer` is the turnaround kept free on both sides of
+    every reservation.
+    """
+
+    def __init__(self, buffer=timedelta(0)):
+        self.buffer = buffer
+        self._timelines = {}
+        self._rides = {}  # ride_id -> (resource_id, start, end)
+        self._lock = threading.RLock()
+        self._stats = {"lookups": 0, "conflicts": 0}
+
+    # -- updates --
+    def reserve(self, ride_id, resource_id, start, end):
+        """Books `resource_id` for [start, end) on behalf of `ride_id`, replacing that ride's old booking."""
+        with self._lock:
+            self.release(ride_id)
+            if resource_id is None or start is None or end is None:
+                return
+            self._timelines.setdefault(resource_id, _Timeline()).add(start, end, ride_id)
+            self._rides[ride_id] = (resource_id, start, end)
+
+    def release(self, ride_id):
+        with self._lock:
+            booking = self._rides.pop(ride_id, None)
+            if booking is None:
+                return
+            resource_id, start, _ = booking
+            timeline = self._timelines[resource_id]
+            timeline.discard(start, ride_id)
+            if not timeline.starts:
+                del self._timelines[resource_id]
+
+    def load(self, bookings):
+        """Replaces every reservation with (ride_id, resource_id, start, end) tuples."""
+        with self._lock:
+            self._timelines.clear()
+            self._rides.clear()
+            # In start order, so every insert lands at the end of its timeline.
+            for booking in sorted(bookings, key=lambda booking: booking[2] or datetime.min):
+                self.reserve(*booking)
+
+    # -- queries --
+    def is_free(self, resource_id, start, end, ignore_ride=None):
+        """True when `resource_id` has no reservation within the buffer of [start, end)."""
+        with self._lock:
+            self._stats["lookups"] += 1
+            timeline = self._timelines.get(resource_id)
+            if timeline is None:
+                return True
+            start, end = start - self.buffer, end + self.buffer
+            if timeline.is_free(start, end):
+                return True
+            if ignore_ride is not None and timeline.overlapping(start, end) == [ignore_ride]:
+                return True
+            self._stats["conflicts"] += 1
+            return False
+
+    def free_among(self, resource_ids, start, end, ignore_ride=None):
+        """The ids from `resource_ids` (in order) that are free for [start, end)."""
+        return [resource_id for resource_id in resource_ids if self.is_free(resource_id, start, end, ignore_ride)]
+
+    def conflicts(self, resource_id, start, end):
+        """Ride ids whose reservation of `resource_id` falls within the buffer of [start, end)."""
+        with self._lock:
+            timeline = self._timelines.get(resource_id)
+            return timeline.overlapping(start - self.buffer, end + self.buffer) if timeline else []
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["resources"] = len(self._timelines)
+            stats["reservations"] = len(self._rides)
+        return stats
+
+    def __len__(self):
+        return len(self._rides)
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+
+    resource_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    ride_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    rng = random.Random(5)
+    origin = datetime(2025, 1, 1)
+    bookings = []
+    for ride_id in range(ride_count):
+        start = origin + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        bookings.append((ride_id, rng.randrange(resource_count), start, start + timedelta(minutes=rng.randint(20, 120))))
+    calendar = ReservationCalendar(timedelta(minutes=15))
+    started = time.perf_counter()
+    calendar.load(bookings)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    queries = []
+    for _ in range(2000):
+        start = origin + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        queries.append((start, start + timedelta(minutes=60)))
+    resources = list(range(resource_count))
+
+    started = time.perf_counter()
+    for start, end in queries:
+        calendar.free_among(resources, start, end)
+    index_us = (time.perf_counter() - started) / len(queries) * 1e6
+
+    buffer = timedelta(minutes=15)
+    started = time.perf_counter()
+    for start, end in queries[:50]:
+        busy = {resource for _, resource, begin, finish in bookings if begin < end + buffer and finish > start - buffer}
+        [resource for resource in resources if resource not in busy]
+    scan_us = (time.perf_counter() - started) / 50 * 1e6
+
+    print(f"{ride_count} reservations over {resource_count} resources, loaded in {load_ms:.0f} ms")
+    print(f"  calendar   {index_us:10.1f} us per 'who is free' query")
+    print(f"  full scan  {scan_us:10.1f} us per 'who is free' query")
@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+import re
+from decimal import Decimal, InvalidOperation
+
+MAX_IMPORT_ROWS = 10000
+
+_PHONE = re.compile(r"^\+?\d{10,15}$")
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+RESOURCE_STATUSES = {'free', 'busy'}
+
+
+class ImportPayloadError(ValueError):
+    """Raised when an import payload cannot be parsed at all."""
+
+
+def parse_payload(body, content_type):
+    """
+    Turns a request body into a list of row dicts. Accepts a JSON array,
+    a JSON object with a "rows" array, or CSV with a header line.
+    """
+    content_type = (content_type or '').lower()
+    text = body.decode('utf-8-sig') if isinstance(body, bytes) else body
+    if not text or not text.strip():
+        raise ImportPayloadError("The import is empty.")
+
+    if 'json' in content_type or text.lstrip()[:1] in ('[', '{'):
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as err:
+            raise ImportPayloadError(f"Invalid JSON: {err}")
+        if isinstance(data, dict):
+            data = data.get('rows')
+        if not isinstance(data, list):
+            raise ImportPayloadError("JSON imports must be an array of objects or {\"rows\": [...]}.")
+        rows = data
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames:
+            raise ImportPayloadError("CSV imports need a header line.")
+        rows = list(reader)
+
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ImportPayloadError(f"Imports are limited to {MAX_IMPORT_ROWS} rows; split the file.")
+    return rows
+
+
+def _text(value, field, max_length):
+    value = '' if value is None else str(value).strip()
+    if not value:
+        raise ValueError(f"{field} is required")
+    if len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+def _phone(value, field='phone'):
+    value = re.sub(r"[\s-]", "", '' if value is None else str(value))
+    if not _PHONE.match(value):
+        raise ValueError(f"{field} must be 10-15 digits")
+    return value.lstrip('+')
+
+def _rate(value):
+    try:
+        rate = Decimal(str(value).strip())
+    except (InvalidOperation, AttributeError):
+        raise ValueError("rate must be a number")
+    if rate <= 0 or rate >= Decimal('100000000'):
+        raise ValueError("rate must be between 0 and 100000000")
+    return rate.quantize(Decimal('0.01'))
+
+def _status(value, allowed):
+    value = (str(value).strip().lower() if value not in (None, '') else 'free')
+    if value not in allowed:
+        raise ValueError(f"status must be one of {', '.join(sorted(allowed))}")
+    return value
+
+def _optional_id(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+
+
+def validate_car(row):
+    return (
+        _text(row.get('car_number'), 'car_number', 20).upper(),
+        _text(row.get('model'), 'model', 100),
+        _text(row.get('type'), 'type', 50).lower(),
+        _rate(row.get('rate')),
+        _status(row.get('status'), RESOURCE_STATUSES),
+    )
+
+def validate_driver(row):
+    return (
+        _text(row.get('name'), 'name', 255),
+        _phone(row.get('phone')),
+        _optional_id(row.get('car_id'), 'car_id'),
+        _status(row.get('status'), RESOURCE_STATUSES),
+    )
+
+def validate_user(row):
+    email = _text(row.get('email'), 'email', 255).lower()
+    if not _EMAIL.match(email):
+        raise ValueError("email is not a valid address")
+    return (
+        _phone(row.get('phone')),
+        _text(row.get('name'), 'name', 255),
+        email,
+    )
+
+
+# Per entity: the row validator and the tuple positions that must be unique within one file.
+IMPORT_SCHEMAS = {
+    'cars': (validate_car, (0,)),
+    'drivers': (validate_driver, (1,)),
+    'users': (validate_user, (0, 2)),
+}
+
+
+def validate_rows(rows, entity):
+    """
+    Validates every row. Returns (valid, errors) where `valid` is a list of
+    (row_number, values) and `errors` a list of {"row", "error"} dicts.
+    Row numbers are 1-based positions in the import, not counting a CSV header.
+    """
+    validator, unique_positions = IMPORT_SCHEMAS[entity]
+    seen = {position: {} for position in unique_positions}
+    valid, errors = [], []
+    for row_number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({"row": row_number, "error": "row must be an object"})
+            continue
+        try:
+            values = validator(row)
+        except ValueError as err:
+            errors.append({"row": row_number, "error": str(err)})
+            continue
+
+        duplicate = next((position for position in unique_positions if values[position] in seen[position]), None)
+        if duplicate is not None:
+            first = seen[duplicate][values[duplicate]]
+            errors.append({"row": row_number, "error": f"duplicate of row {first} ({values[duplicate]})"})
+            continue
+        for position in unique_positions:
+            seen[position][values[position]] = row_number
+        valid.append((row_number, values))
+    return valid, errors
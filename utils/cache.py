@@ -0,0 +1,93 @@
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    A small thread-safe in-process cache whose entries expire after `ttl` seconds.
+    Each gunicorn worker has its own copy, so the TTL bounds how stale a worker
+    can be after another worker writes.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}  # key -> [lock, threads holding or waiting for it]
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self, key=None):
+        """Drops one key, or everything when no key is given."""
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value, calling `loader()` on a miss. Only one thread
+        loads a given key at a time so a burst of requests triggers a single
+        query; misses on other keys load in parallel. A None result is
+        returned but not cached, and a result is discarded if the cache was
+        invalidated while it was being loaded.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            slot = self._load_locks.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
+                with self._lock:
+                    entry = self._data.get(key)
+                    if entry is not None and entry[1] > time.monotonic():
+                        return entry[0]
+                    generation = self._generation
+                value = loader()
+                if value is not None:
+                    with self._lock:
+                        if generation == self._generation:
+                            self._data[key] = (value, time.monotonic() + self.ttl)
+                return value
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._load_locks[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "ttl_seconds": self.ttl,
+            }
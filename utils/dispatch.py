@@ -0,0 +1,219 @@
+"""
+In-memory spatial index of driver positions for nearest-driver dispatch.
+
+Drivers are bucketed into a uniform latitude/longitude grid. A k-nearest
+search walks rings of cells outwards from the pickup and stops once no
+unvisited cell can hold anything closer than the k-th best match, so it
+touches a handful of cells however many drivers there are.
+
+    python -m utils.dispatch [drivers]   # search-time benchmark
+"""
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class _Driver:
+    __slots__ = ("lat", "lng", "free", "car_type", "cell")
+
+    def __init__(self, lat, lng, free, car_type, cell):
+        self.lat = lat
+        self.lng = lng
+        self.free = free
+        self.car_type = car_type
+        self.cell = cell
+
+
+class DriverIndex:
+    """
+    Positions of drivers, with the free ones in a grid of `cell_km` cells.
+    Busy drivers keep their position so they are searchable again as soon
+    as they are freed. `car_type` is the type of a driver's fixed car, or
+    None for a driver who can take any car.
+    """
+
+    def __init__(self, cell_km=1.0):
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self._drivers = {}
+        self._cells = defaultdict(set)
+        self._free = 0
+        self._lock = threading.RLock()
+        self._stats = {"searches": 0, "search_seconds_total": 0.0, "cells_visited": 0, "updates": 0}
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def _unlink(self, driver_id, entry):
+        if entry.free:
+            cell = self._cells[entry.cell]
+            cell.discard(driver_id)
+            self._free -= 1
+            if not cell:
+                del self._cells[entry.cell]
+
+    def _link(self, driver_id, entry):
+        if entry.free:
+            self._cells[entry.cell].add(driver_id)
+            self._free += 1
+
+    # -- updates --
+    def set_driver(self, driver_id, lat, lng, free, car_type=None):
+        """Adds or replaces a driver. Drivers without a position are dropped."""
+        with self._lock:
+            self.remove(driver_id)
+            if lat is None or lng is None:
+                return
+            lat, lng = float(lat), float(lng)
+            entry = self._drivers[driver_id] = _Driver(lat, lng, bool(free), car_type, self._cell(lat, lng))
+            self._link(driver_id, entry)
+            self._stats["updates"] += 1
+
+    def move(self, driver_id, lat, lng):
+        """Updates a known driver's position; returns False if the driver is not indexed."""
+        with self._lock:
+            entry = self._drivers.get(driver_id)
+            if entry is None:
+                return False
+            self._unlink(driver_id, entry)
+            entry.lat, entry.lng = float(lat), float(lng)
+            entry.cell = self._cell(entry.lat, entry.lng)
+            self._link(driver_id, entry)
+            self._stats["updates"] += 1
+            return True
+
+    def remove(self, driver_id):
+        with self._lock:
+            entry = self._drivers.pop(driver_id, None)
+            if entry is not None:
+                self._unlink(driver_id, entry)
+
+    def load(self, drivers):
+        """Replaces the whole index with (driver_id, lat, lng, free, car_type) tuples."""
+        with self._lock:
+            self._drivers.clear()
+            self._cells.clear()
+            self._free = 0
+            for driver in drivers:
+                self.set_driver(*driver)
+
+    # -- search --
+    def _ring(self, center, radius):
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for dc in range(-radius, radius + 1):
+            yield row - radius, col + dc
+            yield row + radius, col + dc
+        for dr in range(-radius + 1, radius):
+            yield row + dr, col - radius
+            yield row + dr, col + radius
+
+    def _ring_min_km(self, lat, radius):
+        """A lower bound on the distance from the query point to any cell in ring `radius`."""
+        if radius <= 1:
+            return 0.0
+        widest_lat = min(89.9, abs(lat) + (radius + 1) * self.cell_deg)
+        return (radius - 1) * self.cell_deg * KM_PER_DEGREE * math.cos(math.radians(widest_lat))
+
+    def nearest(self, lat, lng, k=5, accept=None, max_km=None):
+        """
+        Returns up to `k` (distance_km, driver_id, car_type) tuples for the
+        free drivers closest to (lat, lng), nearest first. `accept(car_type)`
+        filters candidates; `max_km` caps the search radius.
+        """
+        if k < 1:
+            return []
+        started = time.perf_counter()
+        lat, lng = float(lat), float(lng)
+        best = []  # max-heap of (-distance, driver_id, car_type)
+        visited = 0
+        with self._lock:
+            center = self._cell(lat, lng)
+            remaining = self._free
+            radius = 0
+            while remaining > 0:
+                bound = self._ring_min_km(lat, radius)
+                if max_km is not None and bound > max_km:
+                    break
+                if len(best) == k and bound > -best[0][0]:
+                    break
+                if 8 * radius > len(self._cells):
+                    # Sparse grid: cheaper to check every occupied cell left than to walk empty rings.
+                    cells = [cell for key, cell in self._cells.items()
+                             if max(abs(key[0] - center[0]), abs(key[1] - center[1])) >= radius]
+                else:
+                    cells = [self._cells[key] for key in self._ring(center, radius) if key in self._cells]
+                for cell in cells:
+                    visited += 1
+                    remaining -= len(cell)
+                    for driver_id in cell:
+                        entry = self._drivers[driver_id]
+                        if accept is not None and not accept(entry.car_type):
+                            continue
+                        distance = haversine_km(lat, lng, entry.lat, entry.lng)
+                        if max_km is not None and distance > max_km:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-distance, driver_id, entry.car_type))
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, (-distance, driver_id, entry.car_type))
+                radius += 1
+            self._stats["searches"] += 1
+            self._stats["cells_visited"] += visited
+            self._stats["search_seconds_total"] += time.perf_counter() - started
+        return sorted((-negative, driver_id, car_type) for negative, driver_id, car_type in best)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["drivers"] = len(self._drivers)
+            stats["free"] = self._free
+            stats["cells"] = len(self._cells)
+        searches = stats.pop("search_seconds_total")
+        stats["search_us_avg"] = round(searches / stats["searches"] * 1e6, 1) if stats["searches"] else 0.0
+        return stats
+
+    def __len__(self):
+        return len(self._drivers)
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = random.Random(7)
+    # Drivers spread over roughly 40 x 40 km around Bengaluru.
+    drivers = [(i, 12.97 + rng.uniform(-0.18, 0.18), 77.59 + rng.uniform(-0.18, 0.18), rng.random() < 0.7,
+                rng.choice((None, None, 'sedan', 'suv'))) for i in range(count)]
+    index = DriverIndex()
+    index.load(drivers)
+    queries = [(12.97 + rng.uniform(-0.15, 0.15), 77.59 + rng.uniform(-0.15, 0.15)) for _ in range(2000)]
+
+    started = time.perf_counter()
+    for lat, lng in queries:
+        index.nearest(lat, lng, k=5, accept=lambda car_type: car_type in (None, 'sedan'))
+    grid_us = (time.perf_counter() - started) / len(queries) * 1e6
+
+    free = [driver for driver in drivers if driver[3] and driver[4] in (None, 'sedan')]
+    started = time.perf_counter()
+    for lat, lng in queries[:200]:
+        heapq.nsmallest(5, free, key=lambda driver: haversine_km(lat, lng, driver[1], driver[2]))
+    scan_us = (time.perf_counter() - started) / 200 * 1e6
+
+    print(f"{count} drivers, {index.stats()['cells']} occupied cells")
+    print(f"  grid index  {grid_us:8.1f} us per 5-nearest search")
+    print(f"  full scan   {scan_us:8.1f} us per 5-nearest search")
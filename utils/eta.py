@@ -0,0 +1,75 @@
+"""
+Driver-to-pickup ETAs from the driver's recent location history.
+
+The driver's speed is the path length of their recent track over the
+time it spans; the remaining distance is the straight line to the pickup
+stretched by ROAD_FACTOR, the typical ratio of road to crow-flies
+distance in a city. With too short a track (or a driver who has been
+standing still) DEFAULT_SPEED_KMH stands in, so every ping does not need
+a Directions call.
+
+    python -m utils.eta   # ETA for a simulated approach
+"""
+import math
+
+from utils.dispatch import haversine_km
+
+ROAD_FACTOR = 1.3
+DEFAULT_SPEED_KMH = 22.0
+MIN_SPEED_KMH = 8.0
+MAX_SPEED_KMH = 60.0
+# A track shorter than this (in time or distance) says nothing about speed.
+MIN_TRACK_SECONDS = 60
+MIN_TRACK_KM = 0.1
+
+
+def track_speed_kmh(track):
+    """
+    Average speed over `track`, a list of (epoch seconds, lat, lng) in time
+    order, or None when the track is too short to tell.
+    """
+    if len(track) < 2:
+        return None
+    seconds = track[-1][0] - track[0][0]
+    km = sum(haversine_km(lat1, lng1, lat2, lng2)
+             for (_, lat1, lng1), (_, lat2, lng2) in zip(track, track[1:]))
+    if seconds < MIN_TRACK_SECONDS or km < MIN_TRACK_KM:
+        return None
+    return km / (seconds / 3600)
+
+
+def estimate_eta(track, pickup_lat, pickup_lng):
+    """
+    {"eta_minutes", "distance_km", "speed_kmh", "speed_source"} for the
+    driver whose latest position is the last point of `track` (see
+    track_speed_kmh), or None without a position. `speed_source` is
+    "track" or "default".
+    """
+    if not track or pickup_lat is None or pickup_lng is None:
+        return None
+    _, lat, lng = track[-1]
+    distance_km = haversine_km(lat, lng, float(pickup_lat), float(pickup_lng)) * ROAD_FACTOR
+    speed = track_speed_kmh(track)
+    source = "track" if speed is not None else "default"
+    speed = min(max(speed, MIN_SPEED_KMH), MAX_SPEED_KMH) if speed is not None else DEFAULT_SPEED_KMH
+    return {
+        "eta_minutes": max(1, math.ceil(distance_km / speed * 60)),
+        "distance_km": round(distance_km, 2),
+        "speed_kmh": round(speed, 1),
+        "speed_source": source,
+    }
+
+
+if __name__ == "__main__":
+    # A driver 6 km out, reporting every 5 s while driving at 30 km/h.
+    pickup = (12.9716, 77.5946)
+    step_km = 30 / 3600 * 5
+    track = []
+    for i in range(60):
+        lat = pickup[0] + (6 - i * step_km) / 111.2
+        track.append((i * 5.0, lat, pickup[1]))
+        if i in (0, 6, 24, 59):
+            eta = estimate_eta(track[-24:], *pickup)
+            remaining = (6 - i * step_km) * ROAD_FACTOR
+            print(f"after {i * 5:3d}s: {eta['eta_minutes']:2d} min at {eta['speed_kmh']} km/h ({eta['speed_source']}), "
+                  f"{remaining / 30 * 60:.1f} min at the true speed")
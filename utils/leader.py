@@ -0,0 +1,144 @@
+"""
+Leader election over a database named lock (MySQL GET_LOCK).
+
+Every process runs a LeaderElection for the same lock name. Whoever holds
+the lock is the leader and runs the cluster's singleton jobs; the rest
+retry every `heartbeat_seconds`. The lock lives on a dedicated
+connection, so a crashed or partitioned leader loses it as soon as the
+server drops that connection, and a follower takes over on its next
+attempt. The leader heartbeats by checking that its session still owns
+the lock, and steps down (calling `on_demoted`) the moment it does not.
+"""
+import os
+import socket
+import threading
+import time
+
+
+class LeaderElection:
+    def __init__(self, name, connect, on_elected, on_demoted=None, heartbeat_seconds=5):
+        self.name = name
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_seconds = heartbeat_seconds
+        self._connect = connect
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._conn = None
+        self._leader = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {"elections": 0, "demotions": 0, "heartbeats": 0, "errors": 0,
+                       "leader_since": None, "last_heartbeat": None, "last_error": None}
+
+    # -- lifecycle --
+    def start(self):
+        """Starts campaigning in a daemon thread; safe to call repeatedly, and again after a fork."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child inherits the parent's state but not its thread or lock.
+            self._conn = None
+            self._leader.clear()
+            self._stopping.clear()
+            self.identity = f"{socket.gethostname()}:{os.getpid()}"
+            self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Steps down and releases the lock (e.g. on shutdown) so a follower takes over at once."""
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(self.heartbeat_seconds + 5)
+
+    def is_leader(self):
+        return self._leader.is_set()
+
+    # -- election --
+    def _query_one(self, query, params):
+        cursor = self._conn.cursor(buffered=True)
+        try:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            cursor.close()
+
+    def _try_acquire(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._query_one("SELECT GET_LOCK(%s, 0)", (self.name,)) == 1
+
+    def _still_held(self):
+        return self._query_one("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.name,)) == 1
+
+    def _drop_connection(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _demote(self, reason):
+        if not self._leader.is_set():
+            return
+        self._leader.clear()
+        self._stats["demotions"] += 1
+        self._stats["leader_since"] = None
+        print(f"⚠️ {self.identity} is no longer leader for {self.name}: {reason}")
+        if self._on_demoted:
+            try:
+                self._on_demoted()
+            except Exception as e:
+                print(f"❌ Leader demotion hook failed: {e}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self._leader.is_set():
+                    if self._still_held():
+                        self._stats["heartbeats"] += 1
+                        self._stats["last_heartbeat"] = time.time()
+                    else:
+                        self._demote("lock not held by this session")
+                        self._drop_connection()
+                elif self._try_acquire():
+                    self._leader.set()
+                    self._stats["elections"] += 1
+                    self._stats["leader_since"] = self._stats["last_heartbeat"] = time.time()
+                    print(f"👑 {self.identity} is now leader for {self.name}.")
+                    try:
+                        self._on_elected()
+                    except Exception as e:
+                        print(f"❌ Leader election hook failed: {e}")
+            except Exception as e:
+                self._stats["errors"] += 1
+                self._stats["last_error"] = str(e)
+                self._demote(f"database error ({e})")
+                self._drop_connection()
+            self._stopping.wait(self.heartbeat_seconds)
+
+        self._demote("stopping")
+        if self._conn is not None:
+            try:
+                self._query_one("SELECT RELEASE_LOCK(%s)", (self.name,))
+            except Exception:
+                pass
+        self._drop_connection()
+
+    def stats(self):
+        stats = dict(self._stats)
+        now = time.time()
+        stats["identity"] = self.identity
+        stats["role"] = "leader" if self.is_leader() else "follower"
+        since = stats.pop("leader_since")
+        stats["leader_for_seconds"] = round(now - since, 1) if since else None
+        last = stats.pop("last_heartbeat")
+        stats["heartbeat_age_seconds"] = round(now - last, 1) if last and self.is_leader() else None
+        stats["heartbeat_seconds"] = self.heartbeat_seconds
+        return stats
@@ -0,0 +1,170 @@
+"""
+Buffered ingestion of driver location pings.
+
+Pings are coalesced in memory, last write wins per driver (by the time the
+fix was taken, so a late-arriving older ping never overwrites a newer
+one), and a flusher thread hands the latest position of every driver that
+moved to `writer` in batches every `flush_interval` seconds. However many
+pings arrive in an interval, each driver costs one row in one batch.
+
+    python -m utils.location_ingest [drivers] [seconds]   # coalescing benchmark
+"""
+import math
+import os
+import threading
+import time
+
+
+class LocationBuffer:
+    """
+    `writer(batch)` persists a list of (driver_id, lat, lng, recorded_at)
+    tuples and raises on failure, in which case the batch is re-queued
+    (unless a newer ping for the driver arrived meanwhile). `on_ping`
+    (optional) sees every accepted ping at once, for in-memory consumers
+    such as the dispatch index. A batch is flushed early once
+    `max_pending` drivers are waiting.
+    """
+
+    def __init__(self, writer, flush_interval=2.0, max_pending=5000, on_ping=None):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_ping = on_ping
+        self._pending = {}  # driver_id -> (lat, lng, recorded_at)
+        self._latest = {}   # driver_id -> (lat, lng, recorded_at) of the newest accepted ping
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher_pid = None
+        self._stats = {"pings": 0, "coalesced": 0, "stale": 0, "rejected": 0, "flushes": 0,
+                       "rows_written": 0, "write_errors": 0, "last_flush_ms": None}
+
+    def offer(self, driver_id, lat, lng, recorded_at=None):
+        """
+        Queues a ping; `recorded_at` is the fix's epoch seconds (default
+        now, and clamped to now so a client clock running ahead cannot
+        freeze the driver). Returns False for an out-of-range position, a
+        non-numeric `recorded_at` or a ping older than one already accepted
+        for the driver.
+        """
+        now = time.time()
+        try:
+            lat, lng = float(lat), float(lng)
+            recorded_at = min(float(recorded_at), now) if recorded_at is not None else now
+        except (TypeError, ValueError):
+            lat = lng = recorded_at = None
+        if lat is None or not math.isfinite(recorded_at) or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        self._ensure_flusher()
+        with self._lock:
+            self._stats["pings"] += 1
+            latest = self._latest.get(driver_id)
+            if latest is not None and recorded_at < latest[2]:
+                self._stats["stale"] += 1
+                return False
+            self._latest[driver_id] = (lat, lng, recorded_at)
+            if driver_id in self._pending:
+                self._stats["coalesced"] += 1
+            self._pending[driver_id] = (lat, lng, recorded_at)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wake.set()
+        if self.on_ping:
+            try:
+                self.on_ping(driver_id, lat, lng)
+            except Exception as e:
+                print(f"⚠️ Location ping hook failed for driver {driver_id}: {e}")
+        return True
+
+    def flush(self):
+        """Writes every pending position now. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            batch = [(driver_id, lat, lng, recorded_at) for driver_id, (lat, lng, recorded_at) in pending.items()]
+            started = time.perf_counter()
+            try:
+                self.writer(batch)
+            except Exception as e:
+                print(f"❌ Driver location flush failed ({len(batch)} drivers): {e}")
+                with self._lock:
+                    self._stats["write_errors"] += 1
+                    for driver_id, position in pending.items():
+                        self._pending.setdefault(driver_id, position)
+                return 0
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["rows_written"] += len(batch)
+                self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            return len(batch)
+
+    def position(self, driver_id):
+        """(lat, lng, recorded_at) of the driver's newest ping seen by this process, flushed or not, or None."""
+        with self._lock:
+            return self._latest.get(driver_id)
+
+    def forget(self, driver_id):
+        """Drops a driver's pending ping and ordering state (e.g. when the driver is deleted)."""
+        with self._lock:
+            self._pending.pop(driver_id, None)
+            self._latest.pop(driver_id, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+            stats["drivers_seen"] = len(self._latest)
+        stats["pings_per_row"] = round(stats["pings"] / stats["rows_written"], 2) if stats["rows_written"] else None
+        stats["flush_interval_seconds"] = self.flush_interval
+        return stats
+
+    def _run_flusher(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Driver location flusher error: {e}")
+
+    def _ensure_flusher(self):
+        # Threads do not survive a fork, so each worker process starts its own flusher.
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid != os.getpid():
+                threading.Thread(target=self._run_flusher, name="driver-location-flusher", daemon=True).start()
+                self._flusher_pid = os.getpid()
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+
+    driver_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    batches = []
+    buffer = LocationBuffer(batches.append, flush_interval=1.0)
+    rng = random.Random(9)
+    positions = {driver_id: (12.9 + rng.random() * 0.3, 77.5 + rng.random() * 0.3) for driver_id in range(driver_count)}
+
+    # Every driver pings about once a second, with some pings arriving out of order.
+    deadline = time.time() + seconds
+    sent = 0
+    while time.time() < deadline:
+        for driver_id in rng.sample(range(driver_count), driver_count // 10):
+            lat, lng = positions[driver_id]
+            buffer.offer(driver_id, lat + rng.gauss(0, 1e-4), lng + rng.gauss(0, 1e-4), time.time() - rng.random() * 0.2)
+            sent += 1
+        time.sleep(0.1)
+    buffer.flush()
+
+    stats = buffer.stats()
+    print(f"{sent} pings from {driver_count} drivers over {seconds:.0f}s")
+    print(f"  {len(batches)} batches, {stats['rows_written']} rows written ({stats['pings_per_row']} pings per row), "
+          f"{stats['stale']} stale pings dropped")
+    print(f"  one UPDATE per ping would have been {sent} transactions")
@@ -69,7 +69,11 @@ def get_route_details(origin_place_id, destination_place_id):
     route = response["routes"][0]["legs"][0]
     return {
         "distance": route["distance"]["text"],
-        "duration": route["duration"]["text"]
+        "duration": route["duration"]["text"],
+        "distance_m": route["distance"]["value"],
+        "duration_s": route["duration"]["value"],
+        "start_lat": route["start_location"]["lat"],
+        "start_lng": route["start_location"]["lng"]
     }
 
 
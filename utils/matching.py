@@ -0,0 +1,264 @@
+"""
+Batch ride-to-driver assignment as a min-cost bipartite matching.
+
+solve_assignment() is the Hungarian algorithm (shortest augmenting paths
+with potentials, O(n^2 m)) on a rides x drivers cost matrix. Every ride
+also gets a private "unassigned" column, so the optimum first covers as
+many rides as possible and then minimises total pickup distance.
+plan_assignments() builds the matrix from ride and driver rows and
+hands out pool cars.
+
+    python -m utils.matching [rides] [drivers]   # batch vs greedy benchmark
+"""
+import math
+from collections import defaultdict
+
+from utils.dispatch import haversine_km
+
+INFEASIBLE = math.inf
+# Per uncovered ride; larger than any sum of real pickup distances, so
+# covering one more ride always beats shortening pickups.
+UNASSIGNED_COST = 1e7
+# Pickup cost when the ride or the driver has no known position.
+UNKNOWN_DISTANCE_KM = 25.0
+
+
+def solve_assignment(cost):
+    """
+    Min-cost assignment of rows to columns. `cost` is a list of rows of
+    equal length; INFEASIBLE entries are never used. Returns a list with
+    the column for each row, or None when the row stays unassigned.
+    """
+    n = len(cost)
+    if n == 0:
+        return []
+    m = len(cost[0])
+    width = m + n  # real columns, then one "unassigned" column per row
+    big = UNASSIGNED_COST * (n + 1)
+    # Row i as 1-based columns: real costs, then UNASSIGNED_COST in its own slot.
+    rows = []
+    for i, row in enumerate(cost):
+        full = [0.0] + [big if value == INFEASIBLE else value for value in row] + [big] * n
+        full[m + 1 + i] = UNASSIGNED_COST
+        rows.append(full)
+
+    # Potentials u (rows) and v (columns); column 0 is the virtual root.
+    u = [0.0] * (n + 1)
+    v = [0.0] * (width + 1)
+    owner = [0] * (width + 1)
+    way = [0] * (width + 1)
+    columns = range(1, width + 1)
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        minv = [math.inf] * (width + 1)
+        used = [False] * (width + 1)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            row, ui = rows[i0 - 1], u[i0]
+            delta, j1 = math.inf, 0
+            for j in columns:
+                if used[j]:
+                    continue
+                reduced = row[j] - ui - v[j]
+                if reduced < minv[j]:
+                    minv[j] = reduced
+                    way[j] = j0
+                    if reduced < delta:
+                        delta, j1 = reduced, j
+                elif minv[j] < delta:
+                    delta, j1 = minv[j], j
+            for j in range(width + 1):
+                if used[j]:
+                    u[owner[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+
+    result = [None] * n
+    for j in range(1, m + 1):
+        i = owner[j]
+        if i and cost[i - 1][j - 1] != INFEASIBLE:
+            result[i - 1] = j - 1
+    return result
+
+
+def _position(row, lat_key, lng_key):
+    lat, lng = row.get(lat_key), row.get(lng_key)
+    return (float(lat), float(lng)) if lat is not None and lng is not None else None
+
+def pickup_cost(ride, driver, car_type_of):
+    """Pickup distance in km, or INFEASIBLE when the driver cannot serve the ride's car type."""
+    wanted = (ride.get('car_type') or '').lower()
+    fixed_type = car_type_of(driver)
+    if fixed_type is not None and fixed_type != wanted:
+        return INFEASIBLE
+    pickup = _position(ride, 'pickup_lat', 'pickup_lng')
+    position = _position(driver, 'last_latitude', 'last_longitude')
+    if pickup is None or position is None:
+        return UNKNOWN_DISTANCE_KM
+    return haversine_km(pickup[0], pickup[1], position[0], position[1])
+
+
+def _fixed_type(driver):
+    if driver.get('is_fixed') and driver.get('car_id') is not None:
+        return (driver.get('car_type') or '').lower()
+    return None
+
+def _cars_by_type(pool_cars):
+    cars_by_type = defaultdict(list)
+    for car in pool_cars:
+        cars_by_type[(car.get('type') or '').lower()].append(car)
+    return cars_by_type
+
+def _own_car(driver):
+    return {'id': driver['car_id'], 'type': driver.get('car_type')}
+
+
+def plan_assignments(rides, drivers, pool_cars, driver_free=None, car_free=None):
+    """
+    Pairs prebooked rides with free drivers and cars.
+
+    `drivers` are free driver rows; a fixed driver (is_fixed with a car_id)
+    brings their own car, whose type must be in the row as `car_type` and
+    match the ride. Other drivers take a car from `pool_cars` (free car
+    rows nobody is fixed to) of the ride's type. `driver_free(ride, driver)`
+    and `car_free(ride, car)`, when given, rule out drivers and cars booked
+    elsewhere during the ride. Returns (ride, driver, car, distance_km)
+    tuples and the unassigned rides.
+
+    Pool cars are a shared per-type budget, which a plain assignment cannot
+    express, so when a type is oversubscribed only its cheapest pool
+    pairings keep their pool options and the matching is solved again (at
+    most once per car type).
+    """
+    fixed_type = _fixed_type
+    driver_free = driver_free or (lambda ride, driver: True)
+    car_free = car_free or (lambda ride, car: True)
+    cars_by_type = _cars_by_type(pool_cars)
+
+    cost = []
+    for ride in rides:
+        wanted = (ride.get('car_type') or '').lower()
+        pool = [car for car in cars_by_type.get(wanted, ()) if car_free(ride, car)]
+        row = []
+        for driver in drivers:
+            if fixed_type(driver) is None:
+                usable = bool(pool)
+            else:
+                usable = car_free(ride, _own_car(driver))
+            if usable and driver_free(ride, driver):
+                row.append(pickup_cost(ride, driver, fixed_type))
+            else:
+                row.append(INFEASIBLE)
+        cost.append(row)
+
+    while True:
+        columns = solve_assignment(cost)
+        oversubscribed = False
+        pooled = defaultdict(list)
+        for i, j in enumerate(columns):
+            if j is not None and fixed_type(drivers[j]) is None:
+                pooled[(rides[i].get('car_type') or '').lower()].append((cost[i][j], i))
+        for car_type, matches in pooled.items():
+            budget = len(cars_by_type[car_type])
+            if len(matches) <= budget:
+                continue
+            # Keep the cheapest pool pairings of this type; every other ride
+            # of the type may only go to a fixed driver from now on.
+            oversubscribed = True
+            keep = {i for _, i in sorted(matches)[:budget]}
+            for i, ride in enumerate(rides):
+                if i not in keep and (ride.get('car_type') or '').lower() == car_type:
+                    cost[i] = [value if fixed_type(drivers[j]) is not None else INFEASIBLE for j, value in enumerate(cost[i])]
+        if not oversubscribed:
+            break
+
+    plan, unassigned = [], []
+    remaining_cars = {car_type: list(cars) for car_type, cars in cars_by_type.items()}
+    for i, j in enumerate(columns):
+        if j is None:
+            unassigned.append(rides[i])
+            continue
+        driver = drivers[j]
+        if fixed_type(driver) is not None:
+            car = _own_car(driver)
+        else:
+            cars = remaining_cars[(rides[i].get('car_type') or '').lower()]
+            car = next((car for car in cars if car_free(rides[i], car)), None)
+            if car is None:
+                unassigned.append(rides[i])
+                continue
+            cars.remove(car)
+        plan.append((rides[i], driver, car, round(cost[i][j], 3)))
+    return plan, unassigned
+
+
+def plan_greedy(rides, drivers, pool_cars):
+    """
+    One ride at a time in the given order, each taking the nearest driver
+    still free (and a pool car if needed). The baseline for the benchmark.
+    """
+    cars_by_type = _cars_by_type(pool_cars)
+    free = list(drivers)
+    plan, unassigned = [], []
+    for ride in rides:
+        wanted = (ride.get('car_type') or '').lower()
+        options = [
+            (cost, index) for index, driver in enumerate(free)
+            for cost in [pickup_cost(ride, driver, _fixed_type)]
+            if cost != INFEASIBLE and (_fixed_type(driver) is not None or cars_by_type.get(wanted))
+        ]
+        if not options:
+            unassigned.append(ride)
+            continue
+        cost, index = min(options)
+        driver = free.pop(index)
+        car = _own_car(driver) if _fixed_type(driver) is not None else cars_by_type[wanted].pop(0)
+        plan.append((ride, driver, car, round(cost, 3)))
+    return plan, unassigned
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    ride_count = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    driver_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(11)
+    types = ('sedan', 'suv', 'compact')
+
+    def point():
+        return 12.97 + rng.uniform(-0.15, 0.15), 77.59 + rng.uniform(-0.15, 0.15)
+
+    rides = []
+    for i in range(ride_count):
+        lat, lng = point()
+        rides.append({'id': i, 'car_type': rng.choice(types), 'pickup_lat': lat, 'pickup_lng': lng})
+    drivers, pool_cars = [], []
+    for i in range(driver_count):
+        lat, lng = point()
+        fixed = rng.random() < 0.4
+        drivers.append({'id': i, 'is_fixed': fixed, 'car_id': 1000 + i if fixed else None,
+                        'car_type': rng.choice(types) if fixed else None, 'last_latitude': lat, 'last_longitude': lng})
+    for i in range(int(driver_count * 0.5)):
+        pool_cars.append({'id': 2000 + i, 'type': rng.choice(types)})
+
+    print(f"{ride_count} rides, {driver_count} drivers ({sum(1 for d in drivers if d['is_fixed'])} fixed), {len(pool_cars)} pool cars")
+    for label, planner in (("greedy", plan_greedy), ("batch", plan_assignments)):
+        started = time.perf_counter()
+        plan, unassigned = planner(rides, drivers, pool_cars)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        total_km = sum(distance for _, _, _, distance in plan)
+        average = total_km / len(plan) if plan else 0.0
+        print(f"  {label:<7} assigned {len(plan):>4}  unassigned {len(unassigned):>4}  "
+              f"pickup {total_km:8.1f} km (avg {average:5.2f})  {elapsed_ms:8.1f} ms")
@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+from collections import Counter, deque
+from functools import lru_cache
+
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+SAMPLES_PER_SHAPE = int(os.getenv("DB_QUERY_SAMPLES", 1000))
+SLOW_LOG_SIZE = int(os.getenv("DB_SLOW_LOG_SIZE", 100))
+# A request running the same statement shape this many times is reported as a likely N+1.
+N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", 10))
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalise_sql(query):
+    """
+    Reduces a statement to its shape: literals and placeholders become ?,
+    IN lists and multi-row VALUES collapse, and whitespace is squeezed.
+    Parameter values never reach the stats or the slow log.
+    """
+    shape = _STRING_LITERAL.sub("?", query)
+    shape = _PLACEHOLDER.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _WHITESPACE.sub(" ", shape).strip()
+    shape = _IN_LIST.sub("IN (...)", shape)
+    shape = _VALUES_LIST.sub(r"\1, ...", shape)
+    return shape
+
+
+def _percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class _ShapeStats:
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "acquire_ms", "rows", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.acquire_ms = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLES_PER_SHAPE)
+
+
+class QueryStats:
+    """
+    Process-wide statement timings grouped by normalised SQL. Percentiles are
+    computed over the most recent SAMPLES_PER_SHAPE executions of each shape.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shapes = {}
+        self._slow = deque(maxlen=SLOW_LOG_SIZE)
+        self._n_plus_one = Counter()
+        self._request = threading.local()
+
+    # -- per-request counters --
+    def begin_request(self):
+        self._request.count = 0
+        self._request.total_ms = 0.0
+        self._request.shapes = Counter()
+
+    def request_summary(self):
+        """Returns (query count, total ms, Counter of shapes) for the current request."""
+        return (
+            getattr(self._request, 'count', 0),
+            getattr(self._request, 'total_ms', 0.0),
+            getattr(self._request, 'shapes', Counter()),
+        )
+
+    def check_n_plus_one(self, endpoint):
+        """Logs and returns the shapes this request ran at least N_PLUS_ONE_THRESHOLD times."""
+        count, total_ms, shapes = self.request_summary()
+        repeated = [(shape, runs) for shape, runs in shapes.items() if runs >= N_PLUS_ONE_THRESHOLD]
+        for shape, runs in repeated:
+            print(f"⚠️ Possible N+1 in {endpoint}: {runs}x {shape[:200]} ({count} queries, {total_ms:.1f} ms total)")
+            with self._lock:
+                self._n_plus_one[(endpoint, shape)] += 1
+        return repeated
+
+    # -- recording --
+    def record(self, query, elapsed_ms, acquire_ms=0.0, rows=0, error=False):
+        shape = normalise_sql(query)
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                stats = self._shapes[shape] = _ShapeStats()
+            stats.count += 1
+            stats.errors += 1 if error else 0
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.acquire_ms += acquire_ms
+            stats.rows += rows or 0
+            stats.samples.append(elapsed_ms)
+            if elapsed_ms >= SLOW_QUERY_MS:
+                self._slow.append({
+                    "sql": shape,
+                    "ms": round(elapsed_ms, 2),
+                    "acquire_ms": round(acquire_ms, 2),
+                    "rows": rows,
+                })
+
+        if getattr(self._request, 'shapes', None) is not None:
+            self._request.count += 1
+            self._request.total_ms += elapsed_ms
+            self._request.shapes[shape] += 1
+
+        if elapsed_ms >= SLOW_QUERY_MS:
+            print(f"🐢 Slow query ({elapsed_ms:.1f} ms, {rows} rows, acquire {acquire_ms:.1f} ms): {shape[:500]}")
+
+    # -- reporting --
+    def snapshot(self, limit=50):
+        """Returns the `limit` shapes with the most total time, plus the slow-query log."""
+        with self._lock:
+            shapes = [(shape, stats, sorted(stats.samples)) for shape, stats in self._shapes.items()]
+            slow = list(self._slow)
+            n_plus_one = [
+                {"endpoint": endpoint, "sql": shape, "requests": requests}
+                for (endpoint, shape), requests in self._n_plus_one.most_common(limit)
+            ]
+        shapes.sort(key=lambda item: item[1].total_ms, reverse=True)
+        return {
+            "slow_query_ms": SLOW_QUERY_MS,
+            "shapes_tracked": len(shapes),
+            "top": [
+                {
+                    "sql": shape,
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "total_ms": round(stats.total_ms, 2),
+                    "avg_ms": round(stats.total_ms / stats.count, 2),
+                    "p50_ms": round(_percentile(samples, 0.50), 2),
+                    "p95_ms": round(_percentile(samples, 0.95), 2),
+                    "p99_ms": round(_percentile(samples, 0.99), 2),
+                    "max_ms": round(stats.max_ms, 2),
+                    "avg_acquire_ms": round(stats.acquire_ms / stats.count, 2),
+                    "avg_rows": round(stats.rows / stats.count, 2),
+                }
+                for shape, stats, samples in shapes[:limit]
+            ],
+            "slow_queries": slow,
+            "n_plus_one": n_plus_one,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._slow.clear()
+            self._n_plus_one.clear()
+
+
+query_stats = QueryStats()
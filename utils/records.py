@@ -0,0 +1,138 @@
+"""
+Compact row objects for large result sets.
+
+A dictionary cursor builds one dict per row, each with its own hash table
+of column names. A record type is a class with __slots__ built once per
+column list, so a row costs one small object holding only its values.
+Records read like the dicts they replace (row['fare'], row.get('fare'),
+'fare' in row) and turn back into dicts with _asdict() for JSON.
+
+    python -m utils.records [rows]   # memory benchmark against dict rows
+"""
+import keyword
+from functools import lru_cache
+
+_RESERVED = {'self', 'get', 'keys', 'values', 'items'}
+
+
+class Record:
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._asdict() == other._asdict()
+        if isinstance(other, dict):
+            return self._asdict() == other
+        return NotImplemented
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self._fields else default
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return [getattr(self, field) for field in self._fields]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self._fields]
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
+
+
+def _valid_fields(columns):
+    return (
+        len(set(columns)) == len(columns)
+        and all(column.isidentifier() and not keyword.iskeyword(column) and not column.startswith('_')
+                and column not in _RESERVED for column in columns)
+    )
+
+
+@lru_cache(maxsize=256)
+def record_type(columns, name='Row'):
+    """
+    Returns the record class for a tuple of column names, or None if the
+    names cannot be slot names (e.g. an un-aliased COUNT(*)).
+    """
+    columns = tuple(columns)
+    if not _valid_fields(columns):
+        return None
+    args = ", ".join(columns)
+    body = "".join(f"    self.{column} = {column}\n" for column in columns) or "    pass\n"
+    namespace = {}
+    exec(f"def __init__(self, {args}):\n{body}", namespace)
+    return type(name, (Record,), {"__slots__": columns, "_fields": columns, "__init__": namespace["__init__"]})
+
+
+def to_records(columns, rows, name='Row'):
+    """Builds records from tuple rows; falls back to dicts when the column names don't allow it."""
+    cls = record_type(tuple(columns), name)
+    if cls is None:
+        return [dict(zip(columns, row)) for row in rows]
+    return [cls(*row) for row in rows]
+
+
+def measure_memory(columns, rows):
+    """Returns peak bytes for materialising `rows` as dicts and as records."""
+    import tracemalloc
+
+    results = {}
+    for label, build in (("dict", lambda: [dict(zip(columns, row)) for row in rows]),
+                         ("record", lambda: to_records(columns, rows))):
+        record_type.cache_clear()
+        tracemalloc.start()
+        built = build()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[label] = peak
+        del built
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    from datetime import datetime, timedelta
+    from decimal import Decimal
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    columns = ('id', 'customer_name', 'driver_name', 'pickup', 'destination', 'distance', 'duration',
+               'fare', 'status', 'payment_status', 'start_time', 'end_time', 'car_model', 'car_number',
+               'user_phone', 'driver_id', 'car_id')
+    start = datetime(2025, 1, 1, 8, 0)
+    rows = [
+        (i, 'Customer', 'Driver', 'Pickup address', 'Drop address', '12.4 km', '25 mins',
+         Decimal('250.00'), 'completed', 'paid', start + timedelta(minutes=i), None,
+         'Maruti Dzire', 'KA01AB1234', '919000000000', 1, 1)
+        for i in range(count)
+    ]
+    results = measure_memory(columns, rows)
+    print(f"{count} rows x {len(columns)} columns (shared values, so this is container overhead only)")
+    for label, peak in results.items():
+        print(f"  {label:<6} {peak / 1024 / 1024:8.1f} MiB  ({peak / count:.0f} B/row)")
+    print(f"  saving {100 * (1 - results['record'] / results['dict']):.0f}%")
@@ -0,0 +1,65 @@
+import re
+
+# Google Directions text values, e.g. "8 km", "1,204 km", "850 m", "3.1 mi",
+# "20 mins", "1 hour 5 mins", "2 days 3 hours".
+_NUMBER_UNIT = re.compile(r"(\d[\d,]*(?:\.\d+)?)\s*([a-zA-Z]+)")
+
+_METRES_PER_UNIT = {
+    'm': 1, 'meter': 1, 'meters': 1, 'metre': 1, 'metres': 1,
+    'km': 1000, 'kms': 1000, 'kilometer': 1000, 'kilometers': 1000, 'kilometre': 1000, 'kilometres': 1000,
+    'mi': 1609.344, 'mile': 1609.344, 'miles': 1609.344,
+    'ft': 0.3048, 'feet': 0.3048, 'foot': 0.3048,
+}
+_SECONDS_PER_UNIT = {
+    's': 1, 'sec': 1, 'secs': 1, 'second': 1, 'seconds': 1,
+    'min': 60, 'mins': 60, 'minute': 60, 'minutes': 60,
+    'h': 3600, 'hr': 3600, 'hrs': 3600, 'hour': 3600, 'hours': 3600,
+    'day': 86400, 'days': 86400,
+}
+
+
+def _parse(text, units, default_unit):
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return int(round(text * units[default_unit]))
+    total, matched = 0.0, False
+    for number, unit in _NUMBER_UNIT.findall(str(text)):
+        factor = units.get(unit.lower())
+        if factor is None:
+            continue
+        total += float(number.replace(',', '')) * factor
+        matched = True
+    if not matched:
+        # A bare number ("12.5") is taken to be in the default unit.
+        try:
+            return int(round(float(str(text).replace(',', '').strip()) * units[default_unit]))
+        except ValueError:
+            return None
+    return int(round(total))
+
+
+def parse_distance_m(text):
+    """Parses a distance like "1,204 km" or "850 m" into whole metres; None if unparseable."""
+    return _parse(text, _METRES_PER_UNIT, 'km')
+
+def parse_duration_s(text):
+    """Parses a duration like "1 hour 5 mins" into whole seconds; None if unparseable."""
+    return _parse(text, _SECONDS_PER_UNIT, 'mins')
+
+
+def route_distance_m(route):
+    """Metres for a route dict from utils.maps, preferring the numeric Directions value."""
+    if not route:
+        return None
+    if route.get('distance_m') is not None:
+        return int(route['distance_m'])
+    return parse_distance_m(route.get('distance'))
+
+def route_duration_s(route):
+    """Seconds for a route dict from utils.maps, preferring the numeric Directions value."""
+    if not route:
+        return None
+    if route.get('duration_s') is not None:
+        return int(route['duration_s'])
+    return parse_duration_s(route.get('duration'))
@@ -0,0 +1,161 @@
+"""
+Deadline scheduler: a time-ordered priority queue of keys that a worker
+thread sleeps on until the earliest one is due.
+
+schedule() and cancel() can be called from any thread. A new deadline
+earlier than the one the worker is sleeping towards wakes it at once, so
+nothing waits for a polling interval. Rescheduling a key replaces its
+old deadline; stale heap entries are skipped when they surface.
+
+    python -m utils.scheduler [keys]   # firing-lateness benchmark
+"""
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+# Upper bound on one sleep, so a wall-clock jump (NTP, DST) is noticed.
+MAX_SLEEP_SECONDS = 60
+
+
+class DeadlineScheduler:
+    def __init__(self, clock=datetime.now):
+        self._clock = clock
+        self._heap = []   # (due_at, sequence, key)
+        self._due = {}    # key -> due_at of its live entry
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._stats = {"scheduled": 0, "fired": 0, "wakeups": 0, "compactions": 0, "lateness_seconds_total": 0.0}
+
+    def schedule(self, key, due_at):
+        """Fires `key` at `due_at` (a datetime; past deadlines fire at once), replacing any earlier deadline."""
+        with self._condition:
+            if self._due.get(key) == due_at:
+                return
+            self._due[key] = due_at
+            heapq.heappush(self._heap, (due_at, next(self._sequence), key))
+            self._stats["scheduled"] += 1
+            self._compact()
+            if self._heap[0][2] == key and self._heap[0][0] == due_at:
+                self._condition.notify_all()
+
+    def cancel(self, key):
+        with self._condition:
+            self._due.pop(key, None)
+            self._compact()
+
+    def __contains__(self, key):
+        with self._condition:
+            return key in self._due
+
+    def stop(self):
+        """Makes wait_due() return [] until resume(); queued deadlines are kept."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def resume(self):
+        with self._condition:
+            self._stopped = False
+
+    def _compact(self):
+        # Replaced and cancelled deadlines stay in the heap until they surface;
+        # rebuild it once they outnumber the live ones, so it stays O(live keys).
+        if len(self._heap) > 2 * len(self._due) + 16:
+            self._heap = [(due_at, sequence, key) for due_at, sequence, key in self._heap if self._due.get(key) == due_at]
+            heapq.heapify(self._heap)
+            self._stats["compactions"] += 1
+
+    def _discard_stale(self):
+        while self._heap:
+            due_at, _, key = self._heap[0]
+            if self._due.get(key) == due_at:
+                return
+            heapq.heappop(self._heap)
+
+    def wait_due(self):
+        """
+        Blocks until at least one key is due and returns every due key,
+        earliest first, removing them from the queue. Returns [] while
+        the scheduler is stopped.
+        """
+        with self._condition:
+            while not self._stopped:
+                self._discard_stale()
+                now = self._clock()
+                if self._heap and self._heap[0][0] <= now:
+                    due = []
+                    while self._heap and self._heap[0][0] <= now:
+                        due_at, _, key = heapq.heappop(self._heap)
+                        if self._due.get(key) != due_at:
+                            continue
+                        del self._due[key]
+                        due.append(key)
+                        self._stats["lateness_seconds_total"] += (now - due_at).total_seconds()
+                    self._stats["fired"] += len(due)
+                    return due
+                timeout = MAX_SLEEP_SECONDS
+                if self._heap:
+                    timeout = min(timeout, max((self._heap[0][0] - now).total_seconds(), 0.0))
+                self._condition.wait(timeout)
+                self._stats["wakeups"] += 1
+            return []
+
+    def next_due_at(self):
+        with self._condition:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._due)
+            stats["heap_entries"] = len(self._heap)
+        next_due = self.next_due_at()
+        lateness = stats.pop("lateness_seconds_total")
+        stats["lateness_ms_avg"] = round(lateness / stats["fired"] * 1000, 1) if stats["fired"] else 0.0
+        stats["next_due_at"] = next_due.strftime('%Y-%m-%d %H:%M:%S') if next_due else None
+        return stats
+
+    def __len__(self):
+        with self._condition:
+            return len(self._due)
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(3)
+    scheduler = DeadlineScheduler()
+    fired_late = []
+
+    def worker():
+        while True:
+            keys = scheduler.wait_due()
+            if not keys:
+                return
+            now = datetime.now()
+            fired_late.extend((now - deadlines[key]).total_seconds() * 1000 for key in keys)
+
+    deadlines = {}
+    thread = threading.Thread(target=worker)
+    thread.start()
+    started = datetime.now()
+    # Deadlines over the next three seconds, scheduled from the main thread
+    # in random order while the worker is already sleeping.
+    for key in range(count):
+        deadlines[key] = started + timedelta(seconds=rng.uniform(0.1, 3.0))
+        scheduler.schedule(key, deadlines[key])
+        time.sleep(0.001)
+    time.sleep(3.2)
+    scheduler.stop()
+    thread.join()
+
+    fired_late.sort()
+    print(f"{len(fired_late)}/{count} keys fired")
+    print(f"  lateness p50 {fired_late[len(fired_late) // 2]:.2f} ms  p99 {fired_late[int(len(fired_late) * 0.99)]:.2f} ms")
+    print("  a 300 s polling loop averages 150 000 ms")
@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("data", "persisted", "dirty", "touched_at")
+
+    def __init__(self, data, persisted):
+        self.data = data
+        self.persisted = persisted
+        self.dirty = False
+        self.touched_at = time.monotonic()
+
+
+class WriteBackSessionStore:
+    """
+    An in-process LRU cache of chat sessions with write-back persistence.
+
+    `loader(key)` returns the stored row (a dict) or None. `writer(changes)`
+    persists a list of (key, {column: value}) pairs holding only the columns
+    that changed. A save that changes one of `flush_on` (the conversation
+    state) is written through at once; other changes are marked dirty and
+    written in batches every `flush_interval` seconds by a sweeper thread,
+    which also drops sessions idle for longer than `ttl` (after flushing
+    them). Keys that are not columns stay in memory only.
+
+    Every process keeps its own cache, so with several worker processes a
+    conversation must stick to one worker (or the cache be disabled).
+    """
+
+    def __init__(self, loader, writer, columns, capacity=5000, ttl=900, flush_interval=2.0, flush_on=('state',)):
+        self.loader = loader
+        self.writer = writer
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_on = tuple(flush_on)
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "columns_written": 0, "write_throughs": 0,
+                       "evictions": 0, "expired": 0, "write_errors": 0}
+
+    # -- public API --
+    def get(self, key):
+        """Returns a copy of the session, or None if there is none."""
+        self._ensure_sweeper()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.touched_at = time.monotonic()
+                self._stats["hits"] += 1
+                return dict(entry.data) if entry.data is not None else None
+            self._stats["misses"] += 1
+
+        row = self.loader(key)
+        persisted = {column: row.get(column) for column in self.columns} if row else {}
+        with self._lock:
+            # Another thread may have loaded or saved this session meanwhile; keep its copy.
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(dict(row) if row else None, persisted)
+            evicted, drop = self._evict_over_capacity()
+            data = dict(entry.data) if entry.data is not None else None
+        self._write(evicted, drop, "evictions")
+        return data
+
+    def save(self, key, data):
+        """Replaces the session; only the columns that differ from the stored row get written."""
+        self._ensure_sweeper()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(None, _MISSING)
+            self._entries.move_to_end(key)
+            entry.data = dict(data)
+            entry.touched_at = time.monotonic()
+            entry.dirty = True
+            write_through = entry.persisted is _MISSING or any(
+                entry.data.get(column) != entry.persisted.get(column) for column in self.flush_on
+            )
+            pending = []
+            if write_through:
+                pending = self._take_changes([key])
+                self._stats["write_throughs"] += 1
+            evicted, drop = self._evict_over_capacity()
+        self._write(pending + evicted, drop, "evictions")
+        return True
+
+    def flush(self):
+        """Writes every dirty session now."""
+        with self._lock:
+            pending = self._take_changes([key for key, entry in self._entries.items() if entry.dirty])
+        self._write(pending)
+
+    def invalidate(self, key=None):
+        """Drops a cached session (flushing it first), or every session."""
+        with self._lock:
+            keys = [k for k in (list(self._entries) if key is None else [key]) if k in self._entries]
+            dirty = [k for k in keys if self._entries[k].dirty]
+            for k in set(keys) - set(dirty):
+                del self._entries[k]
+            pending = self._take_changes(dirty)
+        # Dirty sessions leave the cache only once written.
+        self._write(pending, dirty)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["dirty"] = sum(1 for entry in self._entries.values() if entry.dirty)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    # -- internals (call with the lock held unless noted) --
+    def _take_changes(self, keys):
+        """Collects the changed columns of `keys`, marking them clean and persisted."""
+        changes = []
+        for key in keys:
+            entry = self._entries[key]
+            entry.dirty = False
+            if entry.data is None:
+                continue
+            persisted = {} if entry.persisted is _MISSING else entry.persisted
+            changed = {
+                column: entry.data.get(column) for column in self.columns
+                if entry.persisted is _MISSING or entry.data.get(column) != persisted.get(column)
+            }
+            if changed:
+                changes.append((key, changed))
+                entry.persisted = {**persisted, **changed}
+        return changes
+
+    def _evict_over_capacity(self):
+        """
+        Drops the least recently used clean sessions over capacity. Dirty
+        ones are returned as (changes, keys) to drop once written, so a
+        failed write leaves them cached and dirty.
+        """
+        excess = len(self._entries) - self.capacity
+        if excess <= 0:
+            return [], []
+        oldest = [key for key, _ in zip(self._entries, range(excess))]
+        dirty = [key for key in oldest if self._entries[key].dirty]
+        for key in oldest:
+            if not self._entries[key].dirty:
+                del self._entries[key]
+                self._stats["evictions"] += 1
+        return self._take_changes(dirty), dirty
+
+    def _write(self, changes, drop=(), drop_stat=None):
+        """
+        Persists changes outside the lock. On failure the columns are marked
+        dirty again; on success the sessions in `drop` (evicted or expired,
+        and not saved again meanwhile) leave the cache.
+        """
+        if changes:
+            try:
+                self.writer(changes)
+            except Exception as e:
+                self._write_failed(changes, e)
+                return
+            with self._lock:
+                self._stats["writes"] += len(changes)
+                self._stats["columns_written"] += sum(len(changed) for _, changed in changes)
+        if drop:
+            with self._lock:
+                for key in drop:
+                    entry = self._entries.get(key)
+                    if entry is not None and not entry.dirty:
+                        del self._entries[key]
+                        if drop_stat:
+                            self._stats[drop_stat] += 1
+
+    def _write_failed(self, changes, error):
+        print(f"❌ Chat session write-back failed: {error}")
+        with self._lock:
+            self._stats["write_errors"] += 1
+            for key, changed in changes:
+                entry = self._entries.get(key)
+                if entry is not None and entry.persisted is not _MISSING:
+                    for column in changed:
+                        entry.persisted[column] = _MISSING
+                    entry.dirty = True
+
+    def _sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if now - entry.touched_at > self.ttl]
+            pending = self._take_changes([key for key, entry in self._entries.items() if entry.dirty])
+        # Expired sessions stay cached until their last changes are written.
+        self._write(pending, expired, "expired")
+
+    def _run_sweeper(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self._sweep()
+            except Exception as e:
+                print(f"❌ Chat session sweeper error: {e}")
+
+    def _ensure_sweeper(self):
+        # Threads do not survive a fork, so each worker process starts its own sweeper.
+        if self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid != os.getpid():
+                self._sweeper = threading.Thread(target=self._run_sweeper, name="chat-session-sweeper", daemon=True)
+                self._sweeper.start()
+                self._sweeper_pid = os.getpid()
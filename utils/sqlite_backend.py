@@ -0,0 +1,304 @@
+"""
+Embedded SQLite engine for offline development and benchmarks.
+
+connect(path) returns an object with the parts of the mysql.connector
+connection API that db.py uses (cursor(dictionary=..., buffered=...),
+start_transaction, commit, rollback, in_transaction, ping, close). Every
+statement is translated from the MySQL dialect the code is written in,
+and sqlite3 errors are re-raised as the matching mysql.connector errors so
+existing error handling keeps working.
+
+Select it with DB_BACKEND=sqlite (and optionally SQLITE_PATH).
+"""
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+import mysql.connector
+
+BUSY_TIMEOUT_SECONDS = 30
+
+# ---- TYPES ----
+# Mirror what mysql.connector returns: DATETIME columns as datetime,
+# DECIMAL columns as Decimal.
+def _to_datetime(raw):
+    text = raw.decode()
+    for pattern in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, pattern)
+        except ValueError:
+            continue
+    return text
+
+def _to_decimal(raw):
+    try:
+        return Decimal(raw.decode())
+    except ArithmeticError:
+        return raw.decode()
+
+sqlite3.register_adapter(datetime, lambda value: value.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_converter('DATETIME', _to_datetime)
+sqlite3.register_converter('DECIMAL', _to_decimal)
+
+
+# ---- SQL FUNCTIONS ----
+_DATE_FORMAT_CODES = {
+    '%Y': '%Y', '%y': '%y', '%m': '%m', '%c': '%-m', '%d': '%d', '%e': '%-d', '%H': '%H', '%k': '%-H',
+    '%h': '%I', '%I': '%I', '%i': '%M', '%s': '%S', '%S': '%S', '%p': '%p', '%M': '%B', '%b': '%b',
+    '%W': '%A', '%a': '%a', '%j': '%j', '%u': '%W', '%%': '%%',
+}
+
+def _date_format(value, mysql_format):
+    """MySQL DATE_FORMAT. %u (Monday-based week) maps to Python's %W, which can differ around New Year."""
+    if value is None or mysql_format is None:
+        return None
+    if not isinstance(value, datetime):
+        value = _to_datetime(str(value).encode())
+        if not isinstance(value, datetime):
+            return None
+    python_format = re.sub(r"%.", lambda match: _DATE_FORMAT_CODES.get(match.group(0), match.group(0)), mysql_format)
+    return value.strftime(python_format)
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class _NamedLocks:
+    """GET_LOCK and friends for connections of this process (one embedded database, one process)."""
+
+    def __init__(self):
+        self._owners = {}
+        self._condition = threading.Condition()
+
+    def get(self, name, timeout, owner):
+        deadline = time.monotonic() + max(timeout or 0, 0)
+        with self._condition:
+            while self._owners.get(name) not in (None, owner):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return 0
+                self._condition.wait(remaining)
+            self._owners[name] = owner
+            return 1
+
+    def release(self, name, owner):
+        with self._condition:
+            if name not in self._owners:
+                return None
+            if self._owners[name] != owner:
+                return 0
+            del self._owners[name]
+            self._condition.notify_all()
+            return 1
+
+    def is_free(self, name):
+        with self._condition:
+            return 0 if name in self._owners else 1
+
+    def owner(self, name):
+        with self._condition:
+            return self._owners.get(name)
+
+    def release_all(self, owner):
+        with self._condition:
+            for name in [name for name, held_by in self._owners.items() if held_by == owner]:
+                del self._owners[name]
+            self._condition.notify_all()
+
+_named_locks = _NamedLocks()
+
+
+# ---- DIALECT ----
+_PLACEHOLDER = re.compile(r"%s")
+_LOCKING_READ = re.compile(r"\s+(FOR\s+UPDATE|LOCK\s+IN\s+SHARE\s+MODE)\b", re.IGNORECASE)
+_ON_DUPLICATE = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.IGNORECASE)
+_VALUES_REF = re.compile(r"\bVALUES\s*\(\s*(\w+)\s*\)", re.IGNORECASE)
+_INSERT_IGNORE = re.compile(r"\bINSERT\s+IGNORE\b", re.IGNORECASE)
+_SHOW_TABLES = re.compile(r"^\s*SHOW\s+TABLES\s+LIKE\s+('[^']*'|%s)\s*$", re.IGNORECASE)
+_AUTO_INCREMENT_PK = re.compile(r"\bINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b", re.IGNORECASE)
+_ONLINE_DDL = re.compile(r"\s+(ALGORITHM\s*=\s*\w+|LOCK\s*=\s*\w+)", re.IGNORECASE)
+_AFTER_COLUMN = re.compile(r"\s+AFTER\s+\w+\s*$", re.IGNORECASE)
+_PARTITIONING = re.compile(r"\)\s*PARTITION\s+BY\b.*$", re.IGNORECASE | re.DOTALL)
+_CREATE_TABLE = re.compile(r"^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+_INLINE_KEY = re.compile(r",\s*(UNIQUE\s+)?KEY\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+_DDL = re.compile(r"^\s*(CREATE\s+(UNIQUE\s+)?INDEX|ALTER\s+TABLE)\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def translate(query):
+    """
+    Rewrites one MySQL statement for SQLite. Returns a tuple of statements:
+    a CREATE TABLE with inline KEYs becomes the table plus CREATE INDEXes.
+    """
+    show_tables = _SHOW_TABLES.match(query)
+    if show_tables:
+        return (f"SELECT name FROM sqlite_master WHERE type='table' AND name LIKE {show_tables.group(1)}",)
+
+    sql = _LOCKING_READ.sub("", query)
+    sql = _INSERT_IGNORE.sub("INSERT OR IGNORE", sql)
+    if _ON_DUPLICATE.search(sql):
+        head, assignments = _ON_DUPLICATE.split(sql, maxsplit=1)
+        assignments = _VALUES_REF.sub(r"excluded.\1", assignments.strip().rstrip(';'))
+        sql = f"{head.rstrip()} ON CONFLICT DO UPDATE SET {assignments}"
+
+    statements = []
+    create_table = _CREATE_TABLE.match(sql)
+    if create_table:
+        sql = _AUTO_INCREMENT_PK.sub("INTEGER PRIMARY KEY AUTOINCREMENT", sql)
+        sql = _PARTITIONING.sub(")", sql.rstrip())
+        table, if_not_exists = create_table.group(2), create_table.group(1) or ""
+        for unique, name, columns in _INLINE_KEY.findall(sql):
+            statements.append(f"CREATE {'UNIQUE ' if unique else ''}INDEX {if_not_exists}{name} ON {table} ({columns})")
+        sql = _INLINE_KEY.sub("", sql)
+    elif _DDL.match(sql):
+        sql = _AFTER_COLUMN.sub("", _ONLINE_DDL.sub("", sql).rstrip())
+
+    sql = _PLACEHOLDER.sub("?", sql)
+    return (sql,) + tuple(statements)
+
+
+# ---- ERRORS ----
+def _mysql_error(err):
+    message = str(err)
+    if isinstance(err, sqlite3.IntegrityError):
+        return mysql.connector.errors.IntegrityError(msg=message, errno=1062 if 'UNIQUE' in message else 1452)
+    if isinstance(err, sqlite3.OperationalError):
+        return mysql.connector.errors.OperationalError(msg=message)
+    if isinstance(err, sqlite3.ProgrammingError):
+        return mysql.connector.errors.ProgrammingError(msg=message)
+    return mysql.connector.errors.DatabaseError(msg=message)
+
+
+# ---- CONNECTION ----
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection._raw.cursor()
+        self._dictionary = dictionary
+        self.rowcount = -1
+        self.lastrowid = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def execute(self, query, params=()):
+        statements = translate(query)
+        try:
+            self._cursor.execute(statements[0], tuple(params or ()))
+            for statement in statements[1:]:
+                self._connection._raw.execute(statement)
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def executemany(self, query, seq_params):
+        statement = translate(query)[0]
+        try:
+            self._cursor.executemany(statement, [tuple(params) for params in seq_params])
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """A sqlite3 connection in autocommit mode, with explicit transactions like the MySQL pool uses."""
+
+    def __init__(self, path):
+        try:
+            self._raw = sqlite3.connect(
+                path, timeout=BUSY_TIMEOUT_SECONDS, detect_types=sqlite3.PARSE_DECLTYPES,
+                isolation_level=None, check_same_thread=False
+            )
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+        self._raw.execute("PRAGMA foreign_keys = ON")
+        if path != ':memory:':
+            self._raw.execute("PRAGMA journal_mode = WAL")
+            self._raw.execute("PRAGMA synchronous = NORMAL")
+        owner = id(self)
+        self._raw.create_function("NOW", 0, _now)
+        self._raw.create_function("CURDATE", 0, lambda: date.today().isoformat())
+        self._raw.create_function("DATE_FORMAT", 2, _date_format)
+        self._raw.create_function("DATABASE", 0, lambda: 'main')
+        self._raw.create_function("GET_LOCK", 2, lambda name, timeout: _named_locks.get(name, timeout, owner))
+        self._raw.create_function("RELEASE_LOCK", 1, lambda name: _named_locks.release(name, owner))
+        self._raw.create_function("IS_FREE_LOCK", 1, _named_locks.is_free)
+        self._raw.create_function("IS_USED_LOCK", 1, _named_locks.owner)
+        self._raw.create_function("CONNECTION_ID", 0, lambda: owner)
+
+    def cursor(self, dictionary=False, buffered=False):
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def start_transaction(self):
+        # IMMEDIATE takes the write lock up front, the closest match to
+        # InnoDB's SELECT ... FOR UPDATE inside a transaction.
+        try:
+            self._raw.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+
+    def commit(self):
+        try:
+            if self._raw.in_transaction:
+                self._raw.execute("COMMIT")
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+
+    def rollback(self):
+        if self._raw.in_transaction:
+            self._raw.execute("ROLLBACK")
+
+    def ping(self, reconnect=False):
+        try:
+            self._raw.execute("SELECT 1")
+        except sqlite3.Error as err:
+            raise _mysql_error(err) from err
+
+    def is_connected(self):
+        try:
+            self._raw.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        _named_locks.release_all(id(self))
+        self._raw.close()
+
+
+def connect(path):
+    return SQLiteConnection(path)